@@ -1,3 +1,5 @@
+import DataPrepKit.utilities as util
+
 class AbstractMatchCandidate():
 
     def __init__(self):
@@ -6,6 +8,12 @@ class AbstractMatchCandidate():
     def get_rect(self):
         return None
 
+    def get_bounding_rect(self):
+        """Return the rectangle (x, y, width, height) of the target image
+        that contains the whole matched region. This is used to decide
+        whether two candidates overlap."""
+        return self.get_rect()
+
     def get_match_score(self):
         """This function should return a value between 0.0 and 1.0 where
         values closer to 1.0 are candidates more similar to the
@@ -21,10 +29,26 @@ class AbstractMatchCandidate():
         path when writing the result of the pattern match to a file on disk."""
         return ''
 
+    def get_homography(self):
+        """Return the 3x3 matrix that projects points of the reference
+        image into the target image, or None if the candidate is not a
+        projection."""
+        return None
+
+    def get_region_quad(self, rect):
+        """Return a 4x2 array of the corners, in the order of
+        'util.rect_to_spline_matrix()', of the region of the target
+        image matching the region 'rect' (x, y, width, height) of the
+        reference, as cropped by 'crop_write_images()'. The 'rect' is
+        relative to the matched rectangle."""
+        (x0, y0, _width, _height) = self.get_rect()
+        (x, y, width, height) = rect
+        return util.rect_to_spline_matrix((x0 + x, y0 + y, width, height))
+
     def check_crop_region_size(self):
         return False
 
-    def crop_write_images(self, crop_rects, output_path):
+    def crop_write_images(self, crop_rects, output_path, writer=None, source=None, infos=None):
         """The arguments are as follows:
 
           - rect_list: the dictionary of string labels associated with
@@ -36,8 +60,22 @@ class AbstractMatchCandidate():
             "{image_ID}" is replaced with a string that uniquely
             identifies the output image for this batch.
 
+          - writer: an optional DataPrepKit.ImageWriter which encodes
+            and writes the images on its own threads, if None the
+            images are written before this method returns.
+
+          - source: passed to the 'writer' to identify the image that
+            was cropped if writing fails.
+
+          - infos: an optional dictionary mapping labels to the 'info'
+            passed to the 'writer' for the image of that label, which
+            for example describes the image in the index of a tar
+            shard.
+
+        Returns a dictionary mapping each label to the path of the file
+        written for it.
         """
-        pass
+        return {}
 
 #---------------------------------------------------------------------------------------------------
 
@@ -108,6 +146,21 @@ class AbstractMatcher():
             pass
         return self.get_matched_points()
 
+    def suppress_overlaps(self, candidates, max_overlap=0.0):
+        """Remove candidates whose bounding rectangle overlaps the bounding
+        rectangle of a more similar candidate, see
+        'DataPrepKit.utilities.non_maximum_suppression()'. Candidates
+        are returned in their original order."""
+        if len(candidates) < 2:
+            return list(candidates)
+        else:
+            keep = util.non_maximum_suppression(
+                [c.get_bounding_rect() for c in candidates],
+                [c.get_match_score() for c in candidates],
+                max_overlap,
+              )
+            return [c for (c, k) in zip(candidates, keep) if k]
+
     def save_calculations(self):
         """This function is called to save the intermediate steps used to
         comptue the pattern matching operation. In the case of the RME
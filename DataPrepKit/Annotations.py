@@ -0,0 +1,236 @@
+import json
+import os
+from pathlib import Path, PurePath
+
+#---------------------------------------------------------------------------------------------------
+
+ANNOTATION_FORMATS = ['coco', 'yolo']
+
+COCO_FILE = 'annotations.json'
+  # The name of the COCO annotations file in the output directory.
+
+YOLO_LABELS_DIR = 'labels'
+  # The sub-directory of the output directory into which a YOLO label
+  # file is written for each target image.
+
+YOLO_CLASSES_FILE = 'classes.txt'
+  # The file in the output directory listing the YOLO class names, one
+  # per line, in the order of their class numbers.
+
+DEFAULT_CATEGORY = 'match'
+  # The category name of a region without a pattern or crop region label.
+
+#---------------------------------------------------------------------------------------------------
+
+def annotation_format(name):
+    """Check that 'name' is one of the 'ANNOTATION_FORMATS', ignoring
+    case, and return it in lower case, otherwise raise ValueError."""
+    if isinstance(name, str) and (name.lower() in ANNOTATION_FORMATS):
+        return name.lower()
+    else:
+        raise ValueError(f'annotation format must be one of {ANNOTATION_FORMATS!r}', name)
+
+def category_name(pattern, label):
+    """The category of a region labeled 'label' of a match for the pattern
+    labeled 'pattern', either of which may be the empty string or None."""
+    name = '/'.join(part for part in [pattern, label] if part)
+    return name if len(name) > 0 else DEFAULT_CATEGORY
+
+def clip_box(record, size, offset=(0, 0)):
+    """Return the bounding rectangle (x, y, width, height) of a match
+    record (see DataPrepKit.MatchRecords.match_record()) moved by
+    'offset' and clipped to an image of the given 'size' (width,
+    height), or None if no part of it is inside the image."""
+    (width, height) = size
+    (x_off, y_off) = offset
+    x_min = min(max(record['x'] + x_off, 0), width)
+    y_min = min(max(record['y'] + y_off, 0), height)
+    x_max = min(max(record['x'] + x_off + record['width'], 0), width)
+    y_max = min(max(record['y'] + y_off + record['height'], 0), height)
+    if (x_max <= x_min) or (y_max <= y_min):
+        return None
+    else:
+        return (x_min, y_min, x_max - x_min, y_max - y_min)
+
+#---------------------------------------------------------------------------------------------------
+
+class AnnotationWriter():
+    """Write the matched regions of each target image of a batch as
+    object detection annotations of the whole target image, rather
+    than cropping them into image files.
+
+    The 'categories' are the names (see 'category_name()') of every
+    kind of region, numbered in the order given, and any other name
+    found is numbered after them. In the "coco" format, a single
+    COCO_FILE is written into 'output_dir' by 'close()', in which each
+    annotation also has the "score" of the match and, as its
+    "segmentation", the quadrilateral of the region, which for the ORB
+    algorithm is not a rectangle. In the "yolo" format, a label file
+    named after each target image is written into the YOLO_LABELS_DIR
+    as soon as it is added, even if nothing matched, and the class
+    names are written to YOLO_CLASSES_FILE. If the 'inputs' are given,
+    the label files are laid out like the inputs are in the directory
+    that contains all of them, see 'yolo_label_path()', and ValueError
+    is raised if two inputs would have the same label file.
+
+    Rectangles are clipped to the bounds of the target image. If
+    'append' is True, the annotations of an existing COCO_FILE are kept,
+    except for the target images that are added again."""
+
+    def __init__(self, output_dir, format, categories=None, append=False, inputs=None):
+        self.output_dir = Path(output_dir)
+        self.format = annotation_format(format)
+        self.input_root = None
+        if (self.format == 'yolo') and (inputs is not None) and (len(inputs) > 0):
+            self.input_root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in inputs])
+            self.check_yolo_labels(inputs)
+        else:
+            pass
+        self.categories = {}
+        self.images = {}
+          # Maps the 'file_name' of each image to its 2-tuple
+          # (image, annotations) of COCO JSON objects.
+        if append and (self.format == 'coco') and (self.output_dir / COCO_FILE).exists():
+            self.load_coco()
+        else:
+            pass
+        for name in ([] if categories is None else categories):
+            self.category_id(name)
+        if self.format == 'yolo':
+            (self.output_dir / YOLO_LABELS_DIR).mkdir(parents=True, exist_ok=True)
+        else:
+            pass
+
+    def category_id(self, name):
+        if name not in self.categories:
+            self.categories[name] = len(self.categories)
+        else:
+            pass
+        return self.categories[name]
+
+    def load_coco(self):
+        with open(self.output_dir / COCO_FILE, 'r', encoding='utf8') as f:
+            coco = json.load(f)
+        for category in sorted(coco['categories'], key=lambda category: category['id']):
+            self.category_id(category['name'])
+        names = {category['id']: category['name'] for category in coco['categories']}
+        for image in coco['images']:
+            self.images[image['file_name']] = (image, [])
+        file_names = {image['id']: image['file_name'] for image in coco['images']}
+        for annotation in coco['annotations']:
+            annotation['category_id'] = self.category_id(names[annotation['category_id']])
+            self.images[file_names[annotation['image_id']]][1].append(annotation)
+
+    def add_image(self, path, size, records, offset=(0, 0)):
+        """Add the annotations of the target image at 'path' of the given
+        'size' (width, height), one for each match record in 'records',
+        whose coordinates are moved by 'offset' (x, y)."""
+        boxes = []
+        for record in records:
+            box = clip_box(record, size, offset)
+            if box is not None:
+                boxes.append((record, self.category_id(category_name(record['pattern'], record['label'])), box))
+            else:
+                pass
+        if self.format == 'coco':
+            self.add_coco(path, size, boxes, offset)
+        else:
+            self.add_yolo(path, size, boxes)
+
+    def add_coco(self, path, size, boxes, offset):
+        (width, height) = size
+        (x_off, y_off) = offset
+        file_name = str(path)
+        image = {'file_name': file_name, 'width': width, 'height': height}
+        annotations = []
+        for (record, category, (x, y, w, h)) in boxes:
+            quad = [value for (qx, qy) in record['quad'] for value in (qx + x_off, qy + y_off)]
+            annotations.append(
+              { 'category_id': category,
+                'bbox': [x, y, w, h],
+                'area': w * h,
+                'segmentation': [quad],
+                'score': record['score'],
+                'iscrowd': 0,
+              }
+            )
+        self.images[file_name] = (image, annotations)
+
+    def yolo_label_path(self, path):
+        """Return the path of the label file of the target image at 'path':
+        its path relative to the directory containing all of the
+        'inputs' with the suffix replaced by ".txt", so that inputs with
+        the same name in different directories do not share a label
+        file. Without 'inputs', or for an image that is not under that
+        directory, it is named after the image alone."""
+        name = PurePath(path).name
+        if self.input_root is not None:
+            try:
+                name = os.path.relpath(os.path.abspath(path), self.input_root)
+            except ValueError:
+                # On another drive.
+                pass
+            if name.startswith(os.pardir):
+                name = PurePath(path).name
+            else:
+                pass
+        else:
+            pass
+        return self.output_dir / YOLO_LABELS_DIR / PurePath(name).with_suffix('.txt')
+
+    def check_yolo_labels(self, inputs):
+        """Raise ValueError if two different 'inputs' have the same label
+        file, for example "image.png" and "image.jpg"."""
+        seen = {}
+        for path in inputs:
+            label_path = self.yolo_label_path(path)
+            other = seen.setdefault(label_path, path)
+            if os.path.abspath(other) != os.path.abspath(path):
+                raise ValueError(
+                    f'input images {str(other)!r} and {str(path)!r} would have the same YOLO label file',
+                    str(label_path),
+                  )
+            else:
+                pass
+
+    def add_yolo(self, path, size, boxes):
+        (width, height) = size
+        lines = []
+        for (_record, category, (x, y, w, h)) in boxes:
+            lines.append(
+                f'{category} {(x + w/2) / width:.6f} {(y + h/2) / height:.6f} '
+                f'{w / width:.6f} {h / height:.6f}\n'
+              )
+        label_path = self.yolo_label_path(path)
+        label_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(label_path, 'w', encoding='utf8') as f:
+            f.writelines(lines)
+
+    def coco_json(self):
+        """Return the COCO JSON object of all images added so far, the
+        images and annotations are numbered from 1 in order."""
+        images = []
+        annotations = []
+        for (image_id, (image, image_annotations)) in enumerate(self.images.values(), start=1):
+            images.append(dict(image, id=image_id))
+            for annotation in image_annotations:
+                annotations.append(dict(annotation, id=len(annotations) + 1, image_id=image_id))
+        categories = \
+          [ {'id': category, 'name': name, 'supercategory': ''} \
+            for (name, category) in self.categories.items() \
+          ]
+        return {'images': images, 'annotations': annotations, 'categories': categories}
+
+    def close(self):
+        """Write the COCO_FILE or the YOLO_CLASSES_FILE. Files are written
+        to a temporary file first and then renamed, so an interrupted
+        batch does not leave a partially written file."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.format == 'coco':
+            (path, text) = (self.output_dir / COCO_FILE, json.dumps(self.coco_json()))
+        else:
+            (path, text) = (self.output_dir / YOLO_CLASSES_FILE, ''.join(f'{name}\n' for name in self.categories))
+        temp_path = path.with_name(path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf8') as f:
+            f.write(text)
+        os.replace(temp_path, path)
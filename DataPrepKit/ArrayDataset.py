@@ -0,0 +1,231 @@
+from DataPrepKit.Annotations import category_name
+
+import ast
+from pathlib import Path
+
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------
+
+CROPS_FILE = 'crops.npy'
+  # The name of the array of crops in the directory of each category.
+
+METADATA_FILE = 'metadata.npy'
+  # The name of the array describing each crop, in the same order.
+
+SOURCES_FILE = 'sources.txt'
+  # The file in the output directory listing the source images, one
+  # per line, numbered from 0 by the 'source' field of the metadata.
+
+METADATA_DTYPE = np.dtype([('source', '<i8'), ('x', '<f8'), ('y', '<f8'), ('score', '<f8')])
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+#---------------------------------------------------------------------------------------------------
+
+def npy_header(shape, dtype, size=None):
+    """Return the header of an ".npy" file (format version 1.0) of a C
+    ordered array, padded with spaces to 'size' bytes. By default the
+    size is large enough for any number of rows, so the header can be
+    rewritten in place as rows are added."""
+    def header(rows):
+        return repr(
+          { 'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            'fortran_order': False,
+            'shape': (rows,) + tuple(shape[1:]),
+          }
+        ).encode('latin1')
+    if size is None:
+        # Room for the largest number of rows, aligned like numpy does.
+        size = -(-(len(NPY_MAGIC) + 2 + len(header(1 << 63)) + 1) // 64) * 64
+    else:
+        pass
+    text = header(shape[0])
+    padding = size - len(NPY_MAGIC) - 2 - len(text) - 1
+    if padding < 0:
+        raise ValueError('array header does not fit in the space reserved for it', shape)
+    else:
+        return NPY_MAGIC + (size - len(NPY_MAGIC) - 2).to_bytes(2, 'little') + text + b' ' * padding + b'\n'
+
+def read_npy_header(f):
+    """Read the header of an ".npy" file, return the 3-tuple (shape,
+    dtype, size), where 'size' is the number of bytes of the header."""
+    magic = f.read(len(NPY_MAGIC))
+    if magic != NPY_MAGIC:
+        raise ValueError('not an array file of format version 1.0', getattr(f, 'name', None))
+    else:
+        pass
+    length = int.from_bytes(f.read(2), 'little')
+    header = ast.literal_eval(f.read(length).decode('latin1'))
+    if header['fortran_order']:
+        raise ValueError('array file is not in C order', getattr(f, 'name', None))
+    else:
+        pass
+    return (tuple(header['shape']), np.dtype(np.lib.format.descr_to_dtype(header['descr'])), len(NPY_MAGIC) + 2 + length)
+
+#---------------------------------------------------------------------------------------------------
+
+class GrowableArray():
+    """An ".npy" file at 'path' to which rows of the given 'shape' and
+    'dtype' are appended one at a time. The header is rewritten after
+    each row, so the file can be loaded at any time, for example with
+    'np.load(path, mmap_mode="r")' which maps it into memory without
+    copying. If the file exists, rows are added to the end of it,
+    unless its rows have a different shape or dtype, which raises
+    ValueError."""
+
+    def __init__(self, path, shape, dtype):
+        self.path = Path(path)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+        if self.path.exists():
+            self.file = open(self.path, 'r+b')
+            (shape, dtype, self.header_size) = read_npy_header(self.file)
+            if (shape[1:] != self.shape) or (dtype != self.dtype):
+                self.file.close()
+                raise ValueError(
+                    f'cannot add rows of shape {self.shape} and type {self.dtype} '
+                    f'to an array of shape {shape} and type {dtype}',
+                    str(self.path),
+                  )
+            else:
+                pass
+            self.rows = shape[0]
+            # Discard a row written by a batch that was interrupted
+            # before the header was updated.
+            self.file.truncate(self.header_size + self.rows * self.row_bytes)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.path, 'w+b')
+            self.rows = 0
+            header = npy_header((0,) + self.shape, self.dtype)
+            self.header_size = len(header)
+            self.file.write(header)
+        self.file.flush()
+
+    def get_rows(self):
+        return self.rows
+
+    def append(self, row):
+        row = np.asarray(row)
+        if (row.shape != self.shape) or (row.dtype != self.dtype):
+            raise ValueError(
+                f'expecting an array of shape {self.shape} and type {self.dtype}, '
+                f'not of shape {row.shape} and type {row.dtype}',
+                str(self.path),
+              )
+        else:
+            pass
+        self.file.seek(self.header_size + self.rows * self.row_bytes)
+        self.file.write(np.ascontiguousarray(row).tobytes())
+        self.rows += 1
+        self.file.seek(0)
+        self.file.write(npy_header((self.rows,) + self.shape, self.dtype, self.header_size))
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        else:
+            pass
+
+#---------------------------------------------------------------------------------------------------
+
+class ArrayDatasetWriter():
+    """Write cropped images as rows of one array per category of region
+    (see DataPrepKit.Annotations.category_name()), rather than
+    encoding each one into an image file, so that a training loader
+    can map the arrays into memory without decoding anything. All of
+    the regions of a category have the same size, since crop regions
+    are fixed rectangles.
+
+    The crops of each category are written to CROPS_FILE, an array of
+    shape (N, height, width, channels), or (N, height, width) for
+    grayscale images, in the sub-directory of 'output_dir' named after
+    the category. Next to it, METADATA_FILE is an array of N records
+    of METADATA_DTYPE, holding the number of the 'source' image in the
+    SOURCES_FILE, the 'x' and 'y' of the bounding rectangle of the
+    region in the source image, and the 'score' of the match, as in
+    DataPrepKit.MatchRecords.match_record().
+
+    The arrays and the sources are added to if they already exist, so
+    running a batch again never overwrites earlier crops. This class
+    is not thread-safe, see the 'sink' of
+    DataPrepKit.ImageWriter.ImageWriter with 'raw=True'."""
+
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+        self.arrays = {}
+          # Maps each category to its 2-tuple (crops, metadata) of
+          # GrowableArray.
+        self.sources = {}
+        sources_path = self.output_dir / SOURCES_FILE
+        if sources_path.exists():
+            with open(sources_path, 'r', encoding='utf8') as f:
+                for line in f.read().splitlines():
+                    self.sources.setdefault(line, len(self.sources))
+        else:
+            pass
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.sources_file = open(sources_path, 'a', encoding='utf8')
+
+    def source_index(self, source):
+        source = str(source)
+        if source not in self.sources:
+            self.sources[source] = len(self.sources)
+            self.sources_file.write(source + '\n')
+            self.sources_file.flush()
+        else:
+            pass
+        return self.sources[source]
+
+    def category_arrays(self, category, image):
+        if category not in self.arrays:
+            directory = self.output_dir / category
+            crops = GrowableArray(directory / CROPS_FILE, image.shape, image.dtype)
+            try:
+                metadata = GrowableArray(directory / METADATA_FILE, (), METADATA_DTYPE)
+            except ValueError:
+                crops.close()
+                raise
+            self.arrays[category] = (crops, metadata)
+        else:
+            pass
+        return self.arrays[category]
+
+    def add(self, path, image, info):
+        """Add the 'image' cropped for a region described by 'info', which
+        is a match record as returned by
+        DataPrepKit.MatchRecords.match_record(). The 'path' the image
+        would otherwise have been written to is ignored."""
+        category = category_name(info['pattern'], info['label'])
+        (crops, metadata) = self.category_arrays(category, image)
+        row = np.zeros((), dtype=METADATA_DTYPE)
+        row['source'] = self.source_index(info['source'])
+        row['x'] = info['x']
+        row['y'] = info['y']
+        row['score'] = info['score']
+        crops.append(image)
+        metadata.append(row)
+
+    def close(self):
+        for (crops, metadata) in self.arrays.values():
+            crops.close()
+            metadata.close()
+        self.arrays = {}
+        self.sources_file.close()
+
+#---------------------------------------------------------------------------------------------------
+
+def load_array_dataset(output_dir, category):
+    """Return the 3-tuple (crops, metadata, sources) of the arrays written
+    by an ArrayDatasetWriter into 'output_dir' for a 'category', mapped
+    into memory read-only, and the list of source image paths."""
+    output_dir = Path(output_dir)
+    crops = np.load(output_dir / category / CROPS_FILE, mmap_mode='r')
+    metadata = np.load(output_dir / category / METADATA_FILE, mmap_mode='r')
+    with open(output_dir / SOURCES_FILE, 'r', encoding='utf8') as f:
+        sources = f.read().splitlines()
+    return (crops, metadata, sources)
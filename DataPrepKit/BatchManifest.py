@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import threading
+
+#---------------------------------------------------------------------------------------------------
+
+MANIFEST_FILE = 'manifest.jsonl'
+  # The name of the manifest file in the output directory of a batch.
+
+MANIFEST_VERSION = 1
+  # Entries with a different version are ignored, so the input images
+  # they describe are searched again.
+
+HASH_CHUNK_SIZE = 1 << 20
+
+#---------------------------------------------------------------------------------------------------
+
+def file_fingerprint(path, content_hash=False):
+    """Return a dictionary describing the file at 'path' by its size and
+    modification time, and also by a digest of its content if
+    'content_hash' is True. Returns None if the file cannot be read."""
+    try:
+        stat = os.stat(path)
+        result = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if content_hash:
+            digest = hashlib.blake2b(digest_size=20)
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            result['content_hash'] = digest.hexdigest()
+        else:
+            pass
+        return result
+    except OSError:
+        return None
+
+#---------------------------------------------------------------------------------------------------
+
+class BatchManifest():
+    """An append-only file of JSON lines in the output directory of a
+    batch, one line for each input image that was searched, recording
+    the fingerprint of the input image (see 'file_fingerprint()'), a
+    hash of the configuration it was searched with, the files that
+    were written relative to the output directory, and any errors.
+
+    When a batch is run again with the same manifest, 'is_done()'
+    tells which input images can be skipped: those with the same
+    fingerprint, searched with the same configuration, without
+    errors. If an input image appears more than once in the manifest,
+    the last entry is used. A line is written as soon as each input
+    image is done, so if a batch is interrupted, running it again
+    resumes where it stopped. A partially written last line is
+    ignored.
+
+    Entries are written in the order of the 'index' given to
+    'record()', which must count up from zero, so an entry waits for
+    the entries of every input image before it. Call 'skip()' for the
+    indices of the input images that are not searched."""
+
+    def __init__(self, output_dir, config_hash, content_hash=False):
+        self.output_dir = Path(output_dir)
+        self.path = self.output_dir / MANIFEST_FILE
+        self.config_hash = config_hash
+        self.content_hash = content_hash
+        self.entries = {}
+          # Maps each input image path to the 2-tuple (config,
+          # fingerprint) of its last entry, or to None if that entry has
+          # errors. Only what 'is_done()' needs is kept, not the
+          # outputs, so that a batch of many images stays small.
+        self.lock = threading.Lock()
+        self.next_index = 0
+        self.pending = {}
+        self.file = None
+        self.load()
+
+    def get_path(self):
+        return self.path
+
+    def load(self):
+        """Read the entries of an existing manifest file, if any."""
+        try:
+            with open(self.path, 'r', encoding='utf8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line of an interrupted batch.
+                        continue
+                    if isinstance(entry, dict) and (entry.get('version', None) == MANIFEST_VERSION):
+                        self.keep(entry)
+                    else:
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def open(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'a+b')
+        # Start on a new line if the last line was not finished.
+        if self.file.tell() > 0:
+            self.file.seek(-1, os.SEEK_END)
+            if self.file.read(1) != b'\n':
+                self.file.write(b'\n')
+            else:
+                pass
+        else:
+            pass
+
+    def keep(self, entry):
+        if len(entry.get('errors', [])) == 0:
+            self.entries[entry['input']] = (entry.get('config', None), entry.get('fingerprint', None))
+        else:
+            self.entries[entry['input']] = None
+
+    def fingerprint(self, path):
+        return file_fingerprint(path, self.content_hash)
+
+    def is_done(self, path, fingerprint):
+        """Return True if the input image at 'path' was already searched
+        without errors, with the same configuration, when its
+        fingerprint was the same as the given 'fingerprint'."""
+        return \
+            (fingerprint is not None) and \
+            (self.entries.get(str(path), None) == (self.config_hash, fingerprint))
+
+    def record(self, index, path, fingerprint, error, written, write_errors):
+        """Record that the input image at 'path' was searched. The 'error'
+        is None or the reason the search failed, 'written' is a list of
+        the paths of the files written, and 'write_errors' a list of
+        2-tuples (path, error) for the files that failed to be written,
+        as passed to the callback of 'ImageWriter.after_writes()'. This
+        may be called from any thread."""
+        errors = [] if error is None else [str(error)]
+        errors += [f'{path}: {message}' for (path, message) in write_errors]
+        entry = \
+          { 'version': MANIFEST_VERSION,
+            'input': str(path),
+            'fingerprint': fingerprint,
+            'config': self.config_hash,
+            'outputs': sorted(self.relative_path(output) for output in written),
+            'errors': errors,
+          }
+        self.put(index, entry)
+
+    def skip(self, index):
+        """Record that the input image at 'index' is not searched."""
+        self.put(index, None)
+
+    def relative_path(self, path):
+        try:
+            return Path(path).relative_to(self.output_dir).as_posix()
+        except ValueError:
+            return Path(path).as_posix()
+
+    def put(self, index, entry):
+        with self.lock:
+            self.pending[index] = entry
+            while self.next_index in self.pending:
+                entry = self.pending.pop(self.next_index)
+                self.next_index += 1
+                if entry is not None:
+                    if self.file is None:
+                        self.open()
+                    else:
+                        pass
+                    self.file.write(json.dumps(entry).encode('utf8') + b'\n')
+                    self.file.flush()
+                    self.keep(entry)
+                else:
+                    pass
+
+    def close(self):
+        """Close the manifest file. Entries still waiting for an earlier
+        index are discarded, so those input images are searched again
+        by the next batch."""
+        with self.lock:
+            self.pending.clear()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            else:
+                pass
@@ -1,19 +1,28 @@
 from DataPrepKit.RegionSize import RegionSize
-
-import cv2 as cv
-
-import os
+from DataPrepKit.DiskCache import content_hash
+from DataPrepKit.ImageCache import image_cache
 
 #---------------------------------------------------------------------------------------------------
 
 class CachedCVImageLoader():
     """A tool for loading and caching image from a file into an OpenCV image buffer.
+
+    Images are decoded through the process-wide
+    DataPrepKit.ImageCache.image_cache, so several loaders of the same
+    file share one decoded, read-only image buffer. Pass 'cache=False'
+    for an image that is used only once, so it is not kept in the
+    cache after this loader is done with it.
     """
 
-    def __init__(self, path=None, crop_rect=None):
+    def __init__(self, path=None, crop_rect=None, cache=True):
         self.crop_rect = crop_rect
+        self.cache = cache
         self.path   = path
         self.image  = None
+        self.file_key = None
+          # The key of the file in the image cache when it was loaded, or
+          # None if the image was not loaded from a file.
+        self.content_hash = None
 
     def assert_parameter(self, name):
         """Check if this object is ready to be used, or else raise an exception."""
@@ -26,14 +35,23 @@ class CachedCVImageLoader():
             return True
 
     def load_image(self, path=None, crop_rect=None):
+        """Load the image file at 'path', or if 'path' is None, from the path
+        given to the constructor or loaded last. If that file is
+        already loaded, it is decoded again only if it changed on disk,
+        as told by the image cache."""
         #print('CachedCVImageLoader.load_image(' +
         #      ('None' if path is None else f'"{path}"') +
         #      ')')
         self.crop_rect = crop_rect
-        if path is None:
-            path = self.path
+        path = self.path if path is None else path
+        if (self.image is None) or (path != self.path):
             self.force_load_image(path)
-        elif (self.image is None) or (path != self.path):
+        elif self.file_key is None:
+            # The image was given to 'set_image()', not loaded from the file.
+            pass
+        elif self.cache or (image_cache.file_key(path) != self.file_key):
+            # For an image kept in the cache, this is only a lookup unless
+            # the file changed.
             self.force_load_image(path)
         else:
             #print(f'{self.__class__.__name__}.load_image(path={path!r}, crop_rect={crop_rect!r}) #(already loaded)')
@@ -41,7 +59,16 @@ class CachedCVImageLoader():
 
     def force_load_image(self, path):
         #print(f'{self.__class__.__name__}.force_load_image({path!r})')
-        self.image = cv.imread(os.fspath(path))
+        # Taken before decoding, so a change while decoding is seen by
+        # the next 'load_image()'.
+        file_key = image_cache.file_key(path)
+        image = image_cache.load(path, store=self.cache)
+        if image is not self.image:
+            self.content_hash = None
+        else:
+            pass
+        self.image = image
+        self.file_key = file_key
         if self.image is None:
             self.path = None
             raise ValueError(
@@ -77,6 +104,20 @@ class CachedCVImageLoader():
     def set_image(self, path, pixmap):
         self.path = path
         self.image = pixmap
+        self.file_key = None
+        self.content_hash = None
+
+    def get_content_hash(self):
+        """Return a digest of the pixels of the whole (uncropped) image,
+        which is computed only once after the image is loaded. Returns
+        None if no image is loaded."""
+        if self.image is None:
+            return None
+        elif self.content_hash is None:
+            self.content_hash = content_hash(self.image)
+            return self.content_hash
+        else:
+            return self.content_hash
 
     def clear(self):
         self.set_image(None, None)
@@ -0,0 +1,156 @@
+import DataPrepKit.utilities as util
+
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------
+
+EVICT_FRACTION = 0.75
+  # When the cache grows larger than its maximum size, results are
+  # evicted until it is no larger than this fraction of it, so that
+  # the cache directory is not scanned again after every result.
+
+#---------------------------------------------------------------------------------------------------
+
+def content_hash(*parts):
+    """Compute a hexadecimal digest of all 'parts', which may be NumPy
+    arrays (hashed by shape, type, and content), bytes, or anything
+    else that has a stable 'repr()' such as strings, numbers, tuples,
+    and None."""
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(repr((part.shape, part.dtype.str)).encode('utf8'))
+            digest.update(memoryview(np.ascontiguousarray(part)).cast('B'))
+        elif isinstance(part, bytes):
+            digest.update(part)
+        else:
+            digest.update(repr(part).encode('utf8'))
+        # Separate parts so that ('ab', 'c') and ('a', 'bc') differ.
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+#---------------------------------------------------------------------------------------------------
+
+class DiskCache():
+    """A directory of cached results, each result being a set of named
+    NumPy arrays stored as ".npy" files in a sub-directory named after
+    the key of the result. Arrays are returned memory-mapped, so only
+    the parts of a result that are actually used are read from disk.
+
+    The total size of the cache is kept under 'max_bytes' by deleting
+    the least recently used results. A result is "used" when it is
+    stored or retrieved, this is tracked by the modification time of
+    its sub-directory. The directory is scanned once when the cache is
+    opened, after which the size of each result stored is added to a
+    running total, and the directory is only scanned again when the
+    total exceeds 'max_bytes', to evict results until the cache is no
+    larger than EVICT_FRACTION of 'max_bytes'. Results stored by other
+    processes sharing the directory are counted at that scan.
+
+    Results are written to a temporary directory first and then
+    renamed, so other processes sharing the same cache directory
+    never see a partially written result."""
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = Path(directory)
+        self.max_bytes = util.byte_size(max_bytes)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.total_bytes = sum(size for (_, size, _) in self.entries())
+
+    def get_directory(self):
+        return self.directory
+
+    def get_max_bytes(self):
+        return self.max_bytes
+
+    def get_total_bytes(self):
+        return self.total_bytes
+
+    def entry_path(self, key):
+        return self.directory / key
+
+    def get(self, key, names):
+        """Return a dictionary mapping each of the given 'names' to the
+        memory-mapped array stored under 'key', or None if any of the
+        arrays is not in the cache."""
+        path = self.entry_path(key)
+        try:
+            result = \
+              { name: np.load(path / f'{name}.npy', mmap_mode='r', allow_pickle=False) \
+                for name in names \
+              }
+            os.utime(path)
+            return result
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, arrays):
+        """Store a dictionary of named arrays under 'key', replacing
+        nothing if 'key' is already stored, then evict the least
+        recently used results if the cache is too large."""
+        path = self.entry_path(key)
+        if path.is_dir():
+            return
+        else:
+            pass
+        temp = Path(tempfile.mkdtemp(prefix='.tmp-', dir=self.directory))
+        try:
+            for (name, array) in arrays.items():
+                np.save(temp / f'{name}.npy', np.asarray(array), allow_pickle=False)
+            size = sum(f.stat().st_size for f in temp.iterdir())
+            os.replace(temp, path)
+        except OSError:
+            # Another process stored the same key first.
+            shutil.rmtree(temp, ignore_errors=True)
+            return
+        with self.lock:
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+            else:
+                pass
+
+    def entries(self):
+        """Return a list of 3-tuples (last_used, size, path) for every
+        result in the cache."""
+        result = []
+        for path in self.directory.iterdir():
+            if path.name.startswith('.tmp-') or not path.is_dir():
+                continue
+            else:
+                pass
+            try:
+                size = sum(f.stat().st_size for f in path.iterdir())
+                result.append((path.stat().st_mtime, size, path))
+            except OSError:
+                # Evicted by another process while we were looking.
+                pass
+        return result
+
+    def evict(self):
+        """Scan the cache and delete the least recently used results until
+        it is no larger than EVICT_FRACTION of 'max_bytes'. Must be
+        called with the 'lock' held."""
+        entries = sorted(self.entries())
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total <= self.max_bytes * EVICT_FRACTION:
+                break
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+        self.total_bytes = total
+
+    def clear(self):
+        with self.lock:
+            for (_, _, path) in self.entries():
+                shutil.rmtree(path, ignore_errors=True)
+            self.total_bytes = 0
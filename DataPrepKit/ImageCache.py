@@ -0,0 +1,114 @@
+import DataPrepKit.utilities as util
+
+from collections import OrderedDict
+import os
+import threading
+
+import cv2 as cv
+
+#---------------------------------------------------------------------------------------------------
+
+DEFAULT_IMAGE_CACHE_SIZE = 512 << 20
+  # The default number of bytes of decoded images kept in memory.
+
+#---------------------------------------------------------------------------------------------------
+
+class ImageCache():
+    """Decoded images kept in memory, so that an image file used in
+    several places, such as the same reference image in several tabs
+    of the GUI or in every iteration of a batch, is decoded only
+    once. Images are looked up by the absolute path of the file, its
+    modification time and size, and the 'flags' passed to
+    'cv.imread()', so an image file that changes on disk is decoded
+    again.
+
+    The decoded images never take more than 'max_bytes': the least
+    recently used images are evicted to make room for a new one, and
+    an image larger than 'max_bytes' is not kept at all. The images
+    kept are shared by every caller, so they are made read-only.
+    Images that are used only once, such as the target images of a
+    batch, should be loaded with 'store=False' so they do not take the
+    place of images that are used again. This class is thread-safe."""
+
+    def __init__(self, max_bytes=DEFAULT_IMAGE_CACHE_SIZE):
+        self.max_bytes = util.byte_size(max_bytes)
+        self.lock = threading.Lock()
+        self.images = OrderedDict()
+          # Maps each key to its decoded image, least recently used first.
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_max_bytes(self):
+        return self.max_bytes
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = util.byte_size(max_bytes)
+            self.evict(0)
+
+    def get_total_bytes(self):
+        return self.total_bytes
+
+    def evict(self, nbytes):
+        """Forget the least recently used images until there is room for
+        'nbytes' more. Must be called with the 'lock' held."""
+        while (len(self.images) > 0) and (self.total_bytes + nbytes > self.max_bytes):
+            (_key, image) = self.images.popitem(last=False)
+            self.total_bytes -= image.nbytes
+
+    def file_key(self, path, flags=cv.IMREAD_COLOR):
+        """Return the key that the image decoded from the file at 'path'
+        with 'flags' is kept under, which changes when the file changes,
+        or None if the file does not exist."""
+        path = os.path.abspath(os.fspath(path))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (path, stat.st_mtime_ns, stat.st_size, flags)
+
+    def load(self, path, flags=cv.IMREAD_COLOR, store=True):
+        """Return the image decoded from the file at 'path', decoding it
+        only if it is not already in the cache, or None if the file
+        does not exist or cannot be decoded, like 'cv.imread()'. If
+        'store' is False, an image that is not already in the cache is
+        decoded but not kept."""
+        key = self.file_key(path, flags)
+        if key is None:
+            return None
+        else:
+            path = key[0]
+        with self.lock:
+            image = self.images.get(key, None)
+            if image is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+                return image
+            else:
+                self.misses += 1
+        # Decode without holding the lock, so other threads can decode
+        # other images at the same time.
+        image = cv.imread(path, flags)
+        if (image is None) or not store:
+            return image
+        else:
+            image.flags.writeable = False
+        with self.lock:
+            if (key not in self.images) and (image.nbytes <= self.max_bytes):
+                self.evict(image.nbytes)
+                self.images[key] = image
+                self.total_bytes += image.nbytes
+            else:
+                pass
+        return image
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.total_bytes = 0
+
+#---------------------------------------------------------------------------------------------------
+
+image_cache = ImageCache()
+  # The cache used by every DataPrepKit.CachedCVImageLoader.CachedCVImageLoader.
@@ -1,5 +1,6 @@
 from DataPrepKit.FileSet import FileSet
 from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
+from DataPrepKit.TarShards import TarShardWriter, DEFAULT_SHARD_SIZE
 import DataPrepKit.utilities as util
 import DataPrepKit.Consts as const
 
@@ -93,6 +94,9 @@ class ImageDiff():
         self.color_map = const.color_forest_fire
             # ^ Set to False to show the image without comparison to the reference
         self.similarity = None
+        self.tar_shards = DEFAULT_SHARD_SIZE
+          # The maximum size of a shard when 'save_all()' writes into
+          # tar shards.
 
     def enable_show_diff(self, boolean):
         """This is the state of the check box that enables or disables
@@ -141,6 +145,12 @@ class ImageDiff():
     def get_similarity(self):
         return self.similarity
 
+    def get_tar_shards(self):
+        return self.tar_shards
+
+    def set_tar_shards(self, max_bytes):
+        self.tar_shards = util.byte_size(max_bytes)
+
     def get_color_map(self):
         return self.color_map
 
@@ -201,12 +211,18 @@ class ImageDiff():
             pass
         cv.imwrite(os.fspath(filepath), image_buffer)
 
-    def save_all(self, output_dir=None):
+    def save_all(self, output_dir=None, shard_size=None):
         """This method will compute the difference between the reference and
         every single item in the 'self.file_set', and save each
         computed image in a file named with a string '_diff' appended
         to the file name before the file extension (for example:
         "input.png" becomes "input_diff.png")
+
+        If 'shard_size' is not None, the images are written into tar
+        archives of at most that many bytes in 'output_dir' rather than
+        as separate files, see DataPrepKit.TarShards, and each is
+        described in the index of its shard by its 'source' path and
+        'similarity'.
         """
         if (output_dir is None) or isinstance(output_dir, PurePath):
             pass
@@ -219,6 +235,16 @@ class ImageDiff():
             raise ValueError('no reference image set')
         else:
             pass
+        shards = None if shard_size is None else TarShardWriter(output_dir, shard_size)
+        try:
+            self.write_all_diffs(ref_image, output_dir, shards)
+        finally:
+            if shards is not None:
+                shards.close()
+            else:
+                pass
+
+    def write_all_diffs(self, ref_image, output_dir, shards=None):
         with \
           open(
             str(output_dir / PurePath('similarity.csv')),
@@ -226,7 +252,8 @@ class ImageDiff():
             newline='',
           ) as csvfile:
             csvwriter = csv.writer(csvfile, delimiter=',', quotechar='\\')
-            img_loader = CachedCVImageLoader()
+            # Each input is used once, so it is not kept in the image cache.
+            img_loader = CachedCVImageLoader(cache=False)
             for path in self.file_set:
                 img_loader.load_image(path=path)
                 input_image = img_loader.get_image()
@@ -238,5 +265,16 @@ class ImageDiff():
                     (image_buffer, similarity) = \
                         diff_images(ref_image, input_image, self.color_map)
                     out_path = rename_path_to_diff(path, output_dir)
-                    cv.imwrite(os.fspath(out_path), image_buffer)
+                    if shards is None:
+                        cv.imwrite(os.fspath(out_path), image_buffer)
+                    else:
+                        (ok, data) = cv.imencode(out_path.suffix, image_buffer)
+                        if not ok:
+                            raise ValueError('failed to encode image', str(out_path))
+                        else:
+                            pass
+                        shards.add(
+                            out_path, data.tobytes(),
+                            {'source': str(path), 'similarity': float(similarity)},
+                          )
                     csvwriter.writerow([similarity, out_path.name])
@@ -58,6 +58,13 @@ class FilesTab(fs.FileSetGUI):
           )
         self._display.addAction(self.save_all_action)
         self.get_list_widget().addAction(self.save_all_action)
+        #---------------
+        self.save_all_shards_action = context_menu_item(
+            "Save diff image for every file into tar shards",
+            self.do_save_all_shards,
+          )
+        self._display.addAction(self.save_all_shards_action)
+        self.get_list_widget().addAction(self.save_all_shards_action)
 
     def default_image_display_widget(self):
         return super(FilesTab, self).default_image_display_widget()
@@ -131,14 +138,20 @@ class FilesTab(fs.FileSetGUI):
         else:
             pass
 
-    def do_save_all(self):
+    def prompt_save_all(self, shard_size=None):
         if self.app_model.get_reference().get_raw_image() is not None:
             output_dir = self.modal_prompt_get_directory(Path.cwd())
-            self.app_model.save_all(output_dir=output_dir)
+            self.app_model.save_all(output_dir=output_dir, shard_size=shard_size)
         else:
             # TODO: display error dialog box
             print('WARNING: no reference image selected')
 
+    def do_save_all(self):
+        self.prompt_save_all()
+
+    def do_save_all_shards(self):
+        self.prompt_save_all(shard_size=self.app_model.get_tar_shards())
+
 #---------------------------------------------------------------------------------------------------
 
 class ReferenceSetupTab(qt.QWidget):
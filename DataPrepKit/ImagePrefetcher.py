@@ -0,0 +1,117 @@
+from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
+import DataPrepKit.utilities as util
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+#---------------------------------------------------------------------------------------------------
+
+DEFAULT_PREFETCH_BUDGET = 256 << 20
+  # The default number of bytes of decoded images that may be waiting
+  # to be used.
+
+PREFETCH_THREADS = 2
+  # OpenCV releases the GIL while decoding, so a few threads are
+  # enough to keep ahead of the pattern matching.
+
+PREFETCH_MAX_AHEAD = 8
+  # Never decode more than this many images ahead, however small.
+
+#---------------------------------------------------------------------------------------------------
+
+class ImagePrefetcher():
+    """Iterate over a list of image file paths, yielding for each one a
+    CachedCVImageLoader with the image already loaded. The next few
+    images are decoded on background threads while the current one is
+    being used, so that reading and decoding image files overlaps
+    with pattern matching.
+
+    The decoded images waiting to be used never take more than
+    'memory_budget' bytes, except that at least one image is always
+    decoded ahead regardless of its size. Since the size of an image
+    is only known once it is decoded, images still being decoded are
+    counted as being as large as the largest image decoded so far.
+
+    If an image fails to load, the loader for it is yielded without an
+    image, so that loading it again raises the error at the point
+    where it is used."""
+
+    def __init__(
+            self, paths,
+            crop_rect=None,
+            memory_budget=DEFAULT_PREFETCH_BUDGET,
+            max_ahead=PREFETCH_MAX_AHEAD,
+            workers=PREFETCH_THREADS,
+          ):
+        self.paths = list(paths)
+        self.crop_rect = crop_rect
+        self.memory_budget = util.byte_size(memory_budget)
+        self.max_ahead = max(1, max_ahead)
+        self.workers = max(1, workers)
+        self.pool = None
+        self.pending = deque()
+        self.next_index = 0
+        self.largest = None
+
+    def load(self, path):
+        # Each image is used once, so it is not kept in the image cache,
+        # which would hold on to it after it is consumed.
+        loader = CachedCVImageLoader(path=path, crop_rect=self.crop_rect, cache=False)
+        try:
+            loader.load_image(path=path, crop_rect=self.crop_rect)
+            return loader
+        except ValueError:
+            # A failed load forgets the path, so return a new loader
+            # that will try again.
+            return CachedCVImageLoader(path=path, crop_rect=self.crop_rect, cache=False)
+
+    def queued_bytes(self):
+        """Estimate the number of bytes taken by the images that have been
+        submitted for decoding but not yet yielded."""
+        total = 0
+        for future in self.pending:
+            if future.done() and (future.result().get_raw_image() is not None):
+                total += future.result().get_raw_image().nbytes
+            else:
+                total += self.largest if self.largest is not None else 0
+        return total
+
+    def fill(self):
+        """Submit more images for decoding, as long as there is room in the
+        budget. Until the size of one image is known, only one image is
+        decoded ahead."""
+        while (self.next_index < len(self.paths)) and \
+              (len(self.pending) < self.max_ahead) and \
+              ( (len(self.pending) == 0) or \
+                ( (self.largest is not None) and \
+                  (self.queued_bytes() + self.largest <= self.memory_budget) \
+                ) \
+              ):
+            self.pending.append(self.pool.submit(self.load, self.paths[self.next_index]))
+            self.next_index += 1
+
+    def __iter__(self):
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            self.fill()
+            while len(self.pending) > 0:
+                loader = self.pending.popleft().result()
+                image = loader.get_raw_image()
+                if image is not None:
+                    self.largest = image.nbytes if self.largest is None else max(self.largest, image.nbytes)
+                else:
+                    pass
+                self.fill()
+                yield loader
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop decoding images, this is called when iteration ends, or may
+        be called to stop iterating early."""
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+            self.pending.clear()
+        else:
+            pass
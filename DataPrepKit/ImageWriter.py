@@ -0,0 +1,241 @@
+import DataPrepKit.utilities as util
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+import cv2 as cv
+
+#---------------------------------------------------------------------------------------------------
+
+DEFAULT_WRITE_BUDGET = 256 << 20
+  # The default number of bytes of images that may be waiting to be
+  # encoded and written.
+
+WRITER_THREADS = 4
+  # OpenCV releases the GIL while encoding, so encoding several images
+  # at once uses several CPU cores.
+
+#---------------------------------------------------------------------------------------------------
+
+class ImageWriter():
+    """Encode and write image files on a pool of threads, so that the
+    caller can go on to the next image while the previous ones are
+    still being written. Call 'write()' for each image, and 'flush()'
+    to wait until all of them are written.
+
+    The images waiting to be written never take more than 'max_bytes',
+    except that one image is always accepted regardless of its size:
+    'write()' blocks until there is room for another image. An image
+    is not copied unless 'copy=True' is given, so it must not be
+    modified until it is written, although a view into a larger image
+    can be passed without copying that larger image.
+
+    Errors are not raised by 'write()', but collected, together with
+    the path of the file that failed and the 'source' given to
+    'write()', and returned by 'flush()'. To find out when all of the
+    images from one source have been written, see 'after_writes()',
+    which needs 'track_sources=True'. Otherwise nothing is kept about
+    the images once they are written, except their errors.
+
+    If a 'sink' is given, no files are written, instead each image is
+    encoded in memory and passed to 'sink(path, data, info)', where
+    'data' are the bytes of the encoded image and 'info' is the value
+    passed to 'write()', for example the 'add()' method of a
+    DataPrepKit.TarShards.TarShardWriter. The sink is called from one
+    thread at a time, in the order 'write()' was called, so it need
+    not be thread-safe, and an image is not considered written until
+    the sink returns. If 'raw' is True, the image is not encoded, and
+    'data' is the image array itself, for example for a
+    DataPrepKit.ArrayDataset.ArrayDatasetWriter."""
+
+    def __init__(self, workers=WRITER_THREADS, max_bytes=DEFAULT_WRITE_BUDGET, sink=None, raw=False, track_sources=True):
+        self.workers = max(1, workers)
+        self.max_bytes = util.byte_size(max_bytes)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.condition = threading.Condition()
+        self.queued_bytes = 0
+        self.queued_count = 0
+        self.submitted = 0
+        self.errors = []
+        self.track_sources = track_sources
+        self.sources = {}
+          # Maps each 'source' with images still being written to a
+          # 4-list [count, written paths, errors, callbacks]. A source
+          # stays here until 'after_writes()' is called for it, so this
+          # is empty unless 'track_sources' is True.
+        self.sink = sink
+        self.raw = raw
+        self.sink_lock = threading.Lock()
+        self.sink_count = 0
+        self.sink_next = 0
+        self.sink_pending = {}
+          # Maps the order of each encoded image waiting for the images
+          # before it to be passed to the 'sink', to its arguments.
+
+    def write(self, path, image, params=None, source=None, copy=False, info=None):
+        """Write 'image' to the file at 'path', the file format is chosen by
+        the suffix of the path. The 'params' are passed to
+        'cv.imwrite()' to control the encoding, and 'source' is any
+        value that identifies where the image came from when reporting
+        an error, usually the path of the image it was cropped from.
+        The 'info' is only passed to the 'sink', if any."""
+        image = image.copy() if copy else image
+        with self.condition:
+            while (self.queued_count > 0) and (self.queued_bytes + image.nbytes > self.max_bytes):
+                self.condition.wait()
+            self.queued_bytes += image.nbytes
+            self.queued_count += 1
+            index = self.submitted
+            self.submitted += 1
+            order = self.sink_count
+            self.sink_count += 1
+            if self.track_sources:
+                self.source_state(source)[0] += 1
+            else:
+                pass
+        self.pool.submit(self.encode, index, order, os.fspath(path), image, params, source, info)
+
+    def encode(self, index, order, path, image, params, source, info):
+        data = None
+        try:
+            if (self.sink is not None) and self.raw:
+                (written, data) = (True, image)
+            elif self.sink is not None:
+                (written, data) = cv.imencode(os.path.splitext(path)[1], image, [] if params is None else params)
+                data = data.tobytes()
+            elif params is None:
+                written = cv.imwrite(path, image)
+            else:
+                written = cv.imwrite(path, image, params)
+            error = None if written else 'failed to write image file'
+        except Exception as err:
+            error = str(err).strip()
+        if self.sink is None:
+            self.finish(index, path, image.nbytes, source, error)
+        else:
+            for args in self.send(order, (index, path, image.nbytes, source, error, data, info)):
+                self.finish(*args)
+
+    def send(self, order, args):
+        """Pass the encoded images to the 'sink' in order, returning the
+        arguments to 'finish()' for each image that was passed."""
+        with self.sink_lock:
+            self.sink_pending[order] = args
+            done = []
+            while self.sink_next in self.sink_pending:
+                (index, path, nbytes, source, error, data, info) = self.sink_pending.pop(self.sink_next)
+                self.sink_next += 1
+                if error is None:
+                    try:
+                        self.sink(path, data, info)
+                    except Exception as err:
+                        error = str(err).strip()
+                else:
+                    pass
+                done.append((index, path, nbytes, source, error))
+            return done
+
+    def finish(self, index, path, nbytes, source, error):
+        with self.condition:
+            if error is not None:
+                self.errors.append((index, source, path, error))
+            else:
+                pass
+            if self.track_sources:
+                state = self.source_state(source)
+                state[0] -= 1
+                if error is not None:
+                    state[2].append((path, error))
+                else:
+                    state[1].append(path)
+                done = self.source_done(source)
+            else:
+                done = None
+        # Call back before this image stops being counted, so that
+        # 'flush()' also waits for the callbacks.
+        try:
+            self.call_back(done)
+        finally:
+            with self.condition:
+                self.queued_bytes -= nbytes
+                self.queued_count -= 1
+                self.condition.notify_all()
+
+    def source_state(self, source):
+        if source not in self.sources:
+            self.sources[source] = [0, [], [], []]
+        else:
+            pass
+        return self.sources[source]
+
+    def source_done(self, source):
+        """If no images from 'source' are waiting to be written and a
+        callback is waiting for it, forget the source and return its
+        state, otherwise return None. Must be called with the
+        'condition' locked."""
+        state = self.sources.get(source, None)
+        if (state is None) or (state[0] > 0) or (len(state[3]) == 0):
+            return None
+        else:
+            del self.sources[source]
+            return state
+
+    def call_back(self, state):
+        """Call the callbacks of a state returned by 'source_done()', which
+        must be done with the 'condition' unlocked."""
+        if state is not None:
+            (_count, written, errors, callbacks) = state
+            for callback in callbacks:
+                callback(written, errors)
+        else:
+            pass
+
+    def after_writes(self, source, callback):
+        """Call 'callback(written, errors)' as soon as every image passed to
+        'write()' with the given 'source' has been written, or right
+        away if there are none. The 'written' argument is the list of
+        paths that were written, and 'errors' is a list of 2-tuples
+        (path, error) for the images that failed, including errors
+        passed to 'report()'. The callback may be called on one of the
+        threads of this writer. This must be called before 'flush()',
+        which forgets which images were written. Raises ValueError if
+        this writer was created with 'track_sources=False'."""
+        if not self.track_sources:
+            raise ValueError('this image writer does not track the sources of its images')
+        else:
+            pass
+        with self.condition:
+            self.source_state(source)[3].append(callback)
+            done = self.source_done(source)
+        self.call_back(done)
+
+    def report(self, source, path, error):
+        """Add an error that happened while preparing an image to be written
+        to the errors returned by the next 'flush()'."""
+        with self.condition:
+            self.errors.append((self.submitted, source, path, error))
+            self.submitted += 1
+            if self.track_sources:
+                self.source_state(source)[2].append((path, error))
+            else:
+                pass
+
+    def flush(self):
+        """Wait until every image passed to 'write()' so far is written, and
+        return a list of 3-tuples (source, path, error) for each image
+        that could not be written, in the order 'write()' was called."""
+        with self.condition:
+            while self.queued_count > 0:
+                self.condition.wait()
+            errors = sorted(self.errors, key=lambda error: error[0])
+            self.errors = []
+            # Forget the sources that nobody is waiting for.
+            self.sources = {}
+        return [(source, path, error) for (_index, source, path, error) in errors]
+
+    def close(self):
+        """Wait for every image to be written, and stop the threads. Errors
+        that were not yet returned by 'flush()' are discarded."""
+        self.flush()
+        self.pool.shutdown()
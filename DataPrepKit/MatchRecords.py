@@ -0,0 +1,157 @@
+import csv
+import json
+from pathlib import Path
+import threading
+
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------
+
+RECORD_FIELDS = \
+  [ 'source', 'pattern', 'label', 'id', 'score',
+    'x', 'y', 'width', 'height', 'quad', 'homography', 'output',
+  ]
+  # The fields of each match record, in the order of the columns of a
+  # CSV file. See 'match_record()'.
+
+RECORD_FORMATS = ['jsonl', 'csv']
+
+#---------------------------------------------------------------------------------------------------
+
+def match_record(source, pattern, label, match_item, rect, output):
+    """Construct the record for one region 'rect' (x, y, width, height),
+    relative to the matched rectangle, cropped from the target image
+    'source' for the 'match_item' candidate and written to 'output',
+    which is None if no file was written.
+    The 'pattern' is the label of the pattern in a PatternLibrary, or
+    the empty string, and 'label' is the label of the crop region, or
+    the empty string for the feature region. The 'id' is the string ID
+    of the candidate, which is the same for all of its regions.
+
+    The region is recorded both as the four corners 'quad' of the
+    region of the target image that was cropped, which for the ORB
+    algorithm is not a rectangle, and as the axis-aligned bounding
+    rectangle 'x', 'y', 'width', 'height' of these corners. The
+    'homography' is the 3x3 matrix projecting the reference image into
+    the target image as a list of rows, or None for the RME
+    algorithm."""
+    quad = np.float64(match_item.get_region_quad(rect)).reshape(-1,2)
+    (x_min, y_min) = quad.min(axis=0)
+    (x_max, y_max) = quad.max(axis=0)
+    homography = match_item.get_homography()
+    return \
+      { 'source': str(source),
+        'pattern': pattern,
+        'label': label,
+        'id': match_item.get_string_id(),
+        'score': float(match_item.get_match_score()),
+        'x': float(x_min),
+        'y': float(y_min),
+        'width': float(x_max - x_min),
+        'height': float(y_max - y_min),
+        'quad': quad.tolist(),
+        'homography': None if homography is None else np.float64(homography).tolist(),
+        'output': None if output is None else str(output),
+      }
+
+def record_format(path):
+    """Return the format of a match records file from the suffix of its
+    'path', or raise ValueError if the suffix is not one of the
+    'RECORD_FORMATS'."""
+    suffix = Path(path).suffix.lower().lstrip('.')
+    if suffix == 'json':
+        return 'jsonl'
+    elif suffix in RECORD_FORMATS:
+        return suffix
+    else:
+        raise ValueError(
+            f'match records file must have one of the suffixes {RECORD_FORMATS!r}',
+            str(path),
+          )
+
+#---------------------------------------------------------------------------------------------------
+
+class MatchRecordFile():
+    """A file to which match records (see 'match_record()') are written
+    as they are produced, one line per record. The format is chosen by
+    the suffix of the 'path': ".jsonl" for one JSON object per line, or
+    ".csv" for comma-separated values with a header line, in which the
+    'quad' and 'homography' fields are JSON-encoded lists.
+
+    Records are flushed to the file after each call to 'append()' or
+    'extend()', that is once per image during a batch, so they can be
+    read while a batch is still running. If 'append' is
+    True, records are added to the end of an existing file, otherwise
+    the file is replaced.
+
+    During a batch, the records of each image are passed to 'record()'
+    once its files are written, which writes them in the order of the
+    'index' given, like DataPrepKit.BatchManifest.BatchManifest."""
+
+    def __init__(self, path, append=False):
+        self.path = Path(path)
+        self.format = record_format(self.path)
+        self.lock = threading.Lock()
+        self.next_index = 0
+        self.pending = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'a' if append else 'w', encoding='utf8', newline='')
+        if self.format == 'csv':
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=RECORD_FIELDS)
+            if self.file.tell() == 0:
+                self.csv_writer.writeheader()
+            else:
+                pass
+        else:
+            self.csv_writer = None
+
+    def get_path(self):
+        return self.path
+
+    def write(self, record):
+        if self.csv_writer is not None:
+            row = dict(record)
+            for key in ['quad', 'homography']:
+                row[key] = '' if row[key] is None else json.dumps(row[key])
+            self.csv_writer.writerow(row)
+        else:
+            self.file.write(json.dumps(record) + '\n')
+
+    def append(self, record):
+        self.extend([record])
+
+    def extend(self, records):
+        for record in records:
+            self.write(record)
+        self.file.flush()
+
+    def record(self, index, records, written, write_errors):
+        """Write the 'records' of the image at 'index', which must count up
+        from zero, after the records of every image before it. The
+        'written' and 'write_errors' are as passed to the callback of
+        'ImageWriter.after_writes()', and the 'output' of a record whose
+        file was not written is set to None, so that no record refers
+        to a file that does not exist. This may be called from any
+        thread."""
+        written = {str(path) for path in written}
+        records = \
+          [ record if (record['output'] is None) or (record['output'] in written) else \
+              dict(record, output=None) \
+            for record in records \
+          ]
+        with self.lock:
+            self.pending[index] = records
+            while self.next_index in self.pending:
+                self.extend(self.pending.pop(self.next_index))
+                self.next_index += 1
+
+    def close(self):
+        """Close the file. Records still waiting for an earlier index are
+        discarded, as are the entries of a BatchManifest."""
+        with self.lock:
+            self.pending.clear()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            else:
+                pass
@@ -1,9 +1,12 @@
 from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
 from DataPrepKit.AbstractMatcher import AbstractMatcher, AbstractMatchCandidate
+from DataPrepKit.DiskCache import content_hash
 import DataPrepKit.utilities as util
 
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 import math
+import os
 from pathlib import (PurePath, Path)
 
 import cv2 as cv
@@ -14,16 +17,83 @@ import traceback
 
 ####################################################################################################
 
+CACHE_VERSION = 1
+  # Increase this whenever a change to ImageWithORB or SegmentedImage
+  # changes the keypoints or descriptors computed for an image, so that
+  # keypoints computed before the change are not used.
+
+FEATURE_ARRAYS = ('keypoints', 'descriptors')
+  # The names of the arrays stored in a DiskCache for the features of
+  # an image, see 'pack_keypoints()'.
+
+SEGMENT_FEATURE_ARRAYS = ('points', 'descriptors', 'counts')
+  # The names of the arrays stored in a DiskCache for the features of
+  # every segment of a SegmentedImage, see 'SegmentedImage.search_segments()'.
+
+# The values accepted by 'ORBConfig.set_matcher()'.
+MATCHERS = ('bruteforce', 'flann')
+
+# Parameters of the FLANN locality-sensitive hashing (LSH) index used
+# to search for the nearest binary ORB descriptors.
+FLANN_LSH_PARAMS = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)
+FLANN_SEARCH_PARAMS = dict(checks=64)
+
+# The LSH index is built from random hash functions, the OpenCV random
+# number generator is seeded with this value before an index is built
+# so that the same image always gives the same matches.
+FLANN_RNG_SEED = 1
+
+# The number of nearest whole-image descriptors found for each
+# reference descriptor by the FLANN index, the 2 nearest of these that
+# lie within a segment are used for the ratio test in that segment.
+# Every copy of the pattern in the target image takes some of these
+# neighbors, so this must be larger than the number of copies expected.
+FLANN_NEIGHBORS = 64
+
+
+def pack_keypoints(keypoints):
+    """Pack a list of OpenCV KeyPoints into an Nx6 float32 array with
+    columns (x, y, size, angle, response, octave), so that they can be
+    stored in a DiskCache."""
+    return np.float32(
+        [ (kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave) \
+          for kp in keypoints \
+        ],
+      ).reshape(-1,6)
+
+def unpack_keypoints(packed):
+    """The inverse of 'pack_keypoints()'."""
+    return tuple(
+        cv.KeyPoint(float(x), float(y), float(size), float(angle), float(response), int(octave)) \
+        for (x, y, size, angle, response, octave) in np.asarray(packed).tolist()
+      )
+
+def pack_descriptors(descriptors):
+    """ORB computes no descriptors for an image without keypoints, which
+    ImageWithORB stores as an empty list, this returns an array in
+    either case."""
+    return np.zeros((0, 32), dtype=np.uint8) if len(descriptors) == 0 else np.asarray(descriptors)
+
+#---------------------------------------------------------------------------------------------------
+
 class ImageWithORB():
     """This class defines a reference image object associated with the key
     points and descriptors computed by the ORB algorithm.
+
+    If a DiskCache is given as the "cache" argument, the keypoints and
+    descriptors are stored in it, keyed by the content of the image
+    and the ORB detection parameters, so that they are only computed
+    once for the same image even across runs of the program.
     """
 
-    def __init__(self, image, orb_config=None):
+    def __init__(self, image, orb_config=None, cache=None):
         self.orb_config = ORBConfig() if not orb_config else orb_config
+        self.cache = cache
         self.ORB = None
         self.keypoints = None
         self.descriptors = None
+        self.points = None
+        self.matcher = None
         if isinstance(image, PurePath) or isinstance(image, Path):
             #print(f'{self.__class__.__name__}.__init__() #({str(image)!r})')
             self.cached_image = CachedCVImageLoader(image)
@@ -55,10 +125,16 @@ class ImageWithORB():
         #print(f'{self.__class__.__name__}.set_orb_config({orb_config})')
         if self.orb_config == orb_config:
             pass
+        elif self.orb_config.same_detection(orb_config):
+            # Only matching parameters changed, so the keypoints and
+            # descriptors are still valid.
+            self.orb_config = deepcopy(orb_config)
         else:
             self.orb_config = deepcopy(orb_config)
             self.keypoints = None
             self.descriptors = None
+            self.points = None
+            self.matcher = None
 
     def get_ORB(self):
         return self.ORB
@@ -69,43 +145,98 @@ class ImageWithORB():
     def get_descriptors(self):
         return self.descriptors
 
+    def get_points(self):
+        """Return the positions of the keypoints as an Nx2 array."""
+        if self.points is None:
+            self.points = np.float32([keypoint.pt for keypoint in self.keypoints]).reshape(-1,2)
+        else:
+            pass
+        return self.points
+
+    def get_matcher(self):
+        """Return a brute-force descriptor matcher using the Hamming
+        distance appropriate to the ORB descriptors of this image. The
+        matcher is constructed once and reused for every segment of
+        every target image that this image is matched against."""
+        if self.matcher is None:
+            self.matcher = cv.BFMatcher(self.orb_config.get_descriptor_norm())
+        else:
+            pass
+        return self.matcher
+
     def get_crop_rect(self):
         if self.cached_image:
             return self.cached_image.get_crop_rect()
         else:
             return (0, 0, self.image.shape[1], self.image.shape[0])
 
-    def compute(self):
+    def cache_key(self, n_features):
+        """The key under which the features of this image are stored in a
+        DiskCache."""
+        if self.cached_image is not None:
+            image_key = (self.cached_image.get_content_hash(), self.cached_image.get_crop_rect())
+        else:
+            image_key = content_hash(self.image)
+        return content_hash(
+            'ORB', CACHE_VERSION, image_key, n_features,
+            self.orb_config.detection_parameters(),
+          )
+
+    def compute(self, n_features=None):
         """Check if the ORB computation has been run yet and do nothing if it
-        already has, otherwise if not compute it now. """
+        already has, otherwise if not compute it now. The number of
+        features is taken from the ORBConfig unless 'n_features' is
+        given."""
         #print(f'{self.__class__.__name__}.compute()')
+        n_features = n_features if n_features is not None else self.orb_config.get_nFeatures()
         if (self.image is None):
             raise ValueError(f'{self.__class__.__name__}.compute() #(failed to load pixmap)')
-        elif (self.descriptors is None) or (self.keypoints is None):
-            # Set the init_crop_rect
-            #height = self.image.shape[0]
-            #width = self.image.shape[1]
-            #print(f'compute ORB (image size ({width},{height}))')
-            # Run the ORB algorithm
-            #print(f'ImageWithORB.compute({str(orb_config)})')
-            ORB = cv.ORB_create( \
-                nfeatures=self.orb_config.get_nFeatures(), \
-                scaleFactor=self.orb_config.get_scaleFactor(), \
-                nlevels=self.orb_config.get_nLevels(), \
-                edgeThreshold=self.orb_config.get_edgeThreshold(), \
-                firstLevel=self.orb_config.get_firstLevel(), \
-                WTA_K=self.orb_config.get_WTA_K(), \
-                scoreType=self.orb_config.get_scoreType(), \
-                patchSize=self.orb_config.get_patchSize(), \
-                fastThreshold=self.orb_config.get_fastThreshold(), \
-              )
-            (keypoints, descriptors) = ORB.detectAndCompute(self.image, None)
-            self.ORB = ORB
-            self.keypoints = keypoints if keypoints is not None else []
-            self.descriptors = descriptors if descriptors is not None else []
-            #print(f'{self.__class__.__name__}.compute() #(generated {len(self.keypoints)} keypoints, {len(self.descriptors)} descriptors)')
-        else:
+        elif (self.descriptors is not None) and (self.keypoints is not None):
             pass
+        elif self.cache is not None:
+            key = self.cache_key(n_features)
+            cached = self.cache.get(key, FEATURE_ARRAYS)
+            if cached is not None:
+                #print(f'{self.__class__.__name__}.compute() #(cache hit {key})')
+                self.keypoints = unpack_keypoints(cached['keypoints'])
+                self.descriptors = np.array(cached['descriptors'])
+                self.points = None
+            else:
+                self.detect(n_features)
+                self.cache.put(
+                    key,
+                    { 'keypoints': pack_keypoints(self.keypoints),
+                      'descriptors': pack_descriptors(self.descriptors),
+                    },
+                  )
+        else:
+            self.detect(n_features)
+
+    def detect(self, n_features):
+        """Run the ORB algorithm on the image."""
+        # Set the init_crop_rect
+        #height = self.image.shape[0]
+        #width = self.image.shape[1]
+        #print(f'compute ORB (image size ({width},{height}))')
+        # Run the ORB algorithm
+        #print(f'ImageWithORB.compute({str(orb_config)})')
+        ORB = cv.ORB_create( \
+            nfeatures=n_features, \
+            scaleFactor=self.orb_config.get_scaleFactor(), \
+            nlevels=self.orb_config.get_nLevels(), \
+            edgeThreshold=self.orb_config.get_edgeThreshold(), \
+            firstLevel=self.orb_config.get_firstLevel(), \
+            WTA_K=self.orb_config.get_WTA_K(), \
+            scoreType=self.orb_config.get_scoreType(), \
+            patchSize=self.orb_config.get_patchSize(), \
+            fastThreshold=self.orb_config.get_fastThreshold(), \
+          )
+        (keypoints, descriptors) = ORB.detectAndCompute(self.image, None)
+        self.ORB = ORB
+        self.keypoints = keypoints if keypoints is not None else []
+        self.points = None
+        self.descriptors = descriptors if descriptors is not None else []
+        #print(f'{self.__class__.__name__}.compute() #(generated {len(self.keypoints)} keypoints, {len(self.descriptors)} descriptors)')
 
 #---------------------------------------------------------------------------------------------------
 
@@ -191,6 +322,26 @@ class FeatureProjection(AbstractMatchCandidate):
     def get_match_score(self):
         return self.similarity
 
+    def get_bounding_rect(self):
+        """The axis-aligned rectangle around the reference rectangle after
+        it is projected into the target image."""
+        bounds = self.get_perspective_bounds()
+        (x_min, y_min) = bounds.min(axis=0)
+        (x_max, y_max) = bounds.max(axis=0)
+        return (float(x_min), float(y_min), float(x_max - x_min), float(y_max - y_min))
+
+    def get_homography(self):
+        return self.homography
+
+    def get_region_quad(self, rect):
+        """See documentation for AbstractMatchCandidate.get_region_quad().
+        The 'rect' is projected into the target image, just as
+        'warp_region()' does."""
+        return cv.perspectiveTransform(
+            util.rect_to_spline_matrix(rect).reshape(-1,1,2),
+            self.homography,
+          ).reshape(-1,2)
+
     def get_match_points(self):
         #offset = np.float32([])
         return self.train_points.reshape(-1,2)
@@ -245,26 +396,56 @@ class FeatureProjection(AbstractMatchCandidate):
     def check_crop_region_size(self):
         return self.in_bounds
 
-    def crop_image(self, relative_rect=None):
-        relative_rect = relative_rect if relative_rect is not None else self.rect
-        (_x, _y, width, height) = relative_rect
+    def warp_region(self, rect):
+        """Return the region 'rect' (x, y, width, height) of the reference
+        image as it appears in the target image, that is, warp the
+        target image by the inverse of the homography into an image of
+        the size of 'rect'. The time this takes depends on the size of
+        'rect' and not on the size of the target image."""
+        (x, y, width, height) = rect
+        # The matrix maps pixels of the result to pixels of the target
+        # image: shift by (x, y) into the reference image, then project
+        # into the target image.
+        matrix = self.homography @ np.float64([[1, 0, x], [0, 1, y], [0, 0, 1]])
         return cv.warpPerspective(
             self.image,
-            self.inverse_homography,
+            matrix,
             (width, height),
+            flags=(cv.INTER_LINEAR | cv.WARP_INVERSE_MAP),
           )
 
-    def crop_write_images(self, crop_rects, output_path):
+    def crop_image(self, relative_rect=None):
+        relative_rect = relative_rect if relative_rect is not None else (0, 0, self.rect[2], self.rect[3])
+        return self.warp_region(relative_rect)
+
+    def crop_write_images(self, crop_rects, output_path, writer=None, source=None, infos=None):
+        """See documentation for AbstractMatchCandidate.crop_write_image().
+        The union of all 'crop_rects' is warped once, and each crop
+        region is then cut from the warped image."""
+        if len(crop_rects) == 0:
+            return {}
+        else:
+            pass
         image_ID = self.get_string_id()
+        rects = np.int64([rect for rect in crop_rects.values()]).reshape(-1,4)
+        (x_min, y_min) = rects[:,0:2].min(axis=0)
+        (x_max, y_max) = (rects[:,0:2] + rects[:,2:4]).max(axis=0)
+        union = (int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min))
+        warped = self.warp_region(union)
+        written = {}
         for (label, (x, y, width, height)) in crop_rects.items():
             outpath = str(output_path).format(label=label, image_ID=image_ID)
             #print(f'{self.__class__.__name__}.crop_write_images() #(save {outpath!r})')
-            image = cv.warpPerspective(
-                self.image,
-                self.inverse_homography,
-                (width, height),
-              )
-            cv.imwrite(outpath, image)
+            (x, y) = (x - union[0], y - union[1])
+            if writer is not None:
+                writer.write(
+                    outpath, warped[y:y+height, x:x+width],
+                    source=source, info=None if infos is None else infos[label],
+                  )
+            else:
+                cv.imwrite(outpath, warped[y:y+height, x:x+width])
+            written[label] = outpath
+        return written
 
 #---------------------------------------------------------------------------------------------------
 
@@ -277,14 +458,20 @@ class SegmentedImage():
     and hypotenuse is chosen as the segment size.
     """
 
-    def __init__(self, orb_config, nparray2d, rect, progress=None):
+    def __init__(self, orb_config, nparray2d, rect, progress=None, shared=None, workers=1, cache=None):
         #print(f'{self.__class__.__name__}.__init__()')
         (_x, _y, seg_width, seg_height) = rect
         shape = nparray2d.shape
         img_height = shape[0]
         img_width  = shape[1]
-        self.orb_config = orb_config
+        self.orb_config = deepcopy(orb_config)
         self.progress_dialog = progress
+        self.shared = shared if shared is not None else {}
+        self.workers = max(1, workers)
+        self.cache = cache
+        self.segment_neighbors = None
+        self.searched_descriptors = None
+        self.searched_minimum = None
         if (seg_height > img_height) and (seg_width > img_width):
             raise ValueError(f'bad reference image, both width and height ({seg_width},{seg_height}) are larger than search target image ({img_width},{img_height})', (seg_width, seg_height), (img_width, img_height))
         elif (seg_height > img_height):
@@ -331,23 +518,32 @@ class SegmentedImage():
 
     def guess_compute_steps(self):
         #print(f'{self.__class__.__name__}.guess_compute_steps()')
-        return \
-            SegmentedImage.guess_compute_steps_1D(self.image_height, self.segment_height) * \
-            SegmentedImage.guess_compute_steps_1D(self.image_width,  self.segment_width)
+        if self.orb_config.get_prefilter_segments():
+            return len(self.prefilter_segments(list(self.segment_rects())))
+        else:
+            return \
+                SegmentedImage.guess_compute_steps_1D(self.image_height, self.segment_height) * \
+                SegmentedImage.guess_compute_steps_1D(self.image_width,  self.segment_width)
 
-    def foreach(self):
-        #print(f'{self.__class__.__name__}.foreach()')
+    def segment_rects(self):
+        """Iterate over the rectangles (x, y, width, height) of every
+        segment, in row-major order."""
         for (y_min,y_max) in SegmentedImage.foreach_1D(self.image_height, self.segment_height):
             for (x_min,x_max) in SegmentedImage.foreach_1D(self.image_width, self.segment_width):
                 #print(f'x_min={x_min}, x_max={x_max}, y_min={y_min}, y_max={y_max}')
-                yield \
-                    ( (x_min, y_min, x_max-x_min, y_max-y_min,),
-                      self.image[y_min:y_max, x_min:x_max],
-                    )
-                if self.progress_dialog is not None:
-                    self.progress_dialog.update_progress(1)
-                else:
-                    pass
+                yield (x_min, y_min, x_max-x_min, y_max-y_min,)
+
+    def update_progress(self):
+        if self.progress_dialog is not None:
+            self.progress_dialog.update_progress(1)
+        else:
+            pass
+
+    def foreach(self):
+        #print(f'{self.__class__.__name__}.foreach()')
+        for (x, y, w, h) in self.segment_rects():
+            yield ((x, y, w, h,), self.image[y:y+h, x:x+w])
+            self.update_progress()
 
     def find_matching_points(self, ref):
         #print(f'{self.__class__.__name__}.find_matching_points(ref) #(ref is a {type(ref)})')
@@ -357,11 +553,72 @@ class SegmentedImage():
             self.matched_points = self.compute(ref)
             return self.matched_points
 
+    def whole_image_orb(self, ref):
+        """Run ORB detection once on the whole target image, rather than
+        once on each segment, and return a KeypointGrid of the
+        result. ORB keeps only the 'nFeatures' strongest keypoints of
+        the image it is given, so the number of features is scaled up
+        by the number of segment-sized areas that fit in the image, so
+        that there are about as many keypoints per area as there would
+        be if each segment were searched separately.
+
+        The "shared" dictionary given to the constructor keeps the
+        KeypointGrid (and its FLANN index), so that searching the same
+        target image for another reference of the same size does not
+        detect the keypoints again."""
+        area_ratio = (self.image_width * self.image_height) / \
+            (self.segment_width * self.segment_height)
+        n_features = round(self.orb_config.get_nFeatures() * max(1.0, area_ratio))
+        shared_key = ('orb', n_features) + self.orb_config.detection_parameters()
+        if shared_key in self.shared:
+            return self.shared[shared_key]
+        else:
+            pass
+        image_orb = ImageWithORB(self.image, self.orb_config, cache=self.cache)
+        image_orb.compute(n_features=n_features)
+        grid = KeypointGrid(
+            image_orb.get_keypoints(),
+            image_orb.get_descriptors(),
+            max(1, round(min(self.segment_width, self.segment_height) / 4)),
+          )
+        self.shared[shared_key] = grid
+        return grid
+
+    def get_orb_config(self):
+        return self.orb_config
+
+    def set_orb_config(self, orb_config):
+        """Change the ORB parameters, which discards the matched points so
+        that the next call to 'find_matching_points()' computes them
+        again. If only the matching parameters have changed (see
+        'ORBConfig.same_search()'), the nearest neighbors found in every
+        segment by the last search are kept, and only the ratio test
+        and homographies are computed again, which is much faster."""
+        if self.orb_config == orb_config:
+            return
+        elif not self.orb_config.same_search(orb_config):
+            self.segment_neighbors = None
+        else:
+            pass
+        self.matched_points = None
+        self.orb_config = deepcopy(orb_config)
+
+    def needs_search(self, ref):
+        """True if 'find_matching_points(ref)' must search every segment for
+        the nearest neighbors of the descriptors of 'ref', rather than
+        reusing the nearest neighbors found by the last search."""
+        return \
+            (self.segment_neighbors is None) or \
+            (self.searched_descriptors is not ref.get_descriptors()) or \
+            ( (self.searched_minimum is not None) and \
+              ( (not self.orb_config.get_prefilter_segments()) or \
+                (self.orb_config.get_minimum_descriptor_count() < self.searched_minimum) \
+              ) \
+            )
+
     def compute(self, ref):
         #print(f'{self.__class__.__name__}.compute(ref) #(ref is a {type(ref)})')
         ref.compute()
-        (_x, _y, width, height) = ref.get_crop_rect()
-        descriptor_threshold = self.orb_config.get_descriptor_threshold()
         reference_keypoints = ref.get_keypoints()
         reference_descriptors = ref.get_descriptors()
         if reference_descriptors is None:
@@ -370,59 +627,405 @@ class SegmentedImage():
             raise Exception('no reference keypoints')
         else:
             pass
-        matched_points = []
-        for ((x, y, _w, _h), segment) in self.foreach():
-            segment_orb = ImageWithORB(segment, ref.get_orb_config())
-            segment_orb.compute()
-            #segment_keypoints = segment_orb.get_keypoints()
-            segment_descriptors = segment_orb.get_descriptors()
-            if len(segment_descriptors) < self.orb_config.get_minimum_descriptor_count():
-                #print(f'ignore block ({x:05},{y:05}), only {len(segment_descriptors)} descriptors created')
-                pass
-            else:
-                bruteforce_match = cv.BFMatcher()
-                matches = bruteforce_match.knnMatch(
-                    reference_descriptors,
-                    segment_descriptors,
-                    k=2
-                  )
-                best_matches = []
-                nsum = 0
-                bestsum = 0
-                for m,n in matches:
-                    #print(f'M: {m.distance}, N: {n.distance}')
-                    nsum += n.distance
-                    if m.distance < descriptor_threshold * n.distance:
-                        bestsum += m.distance
-                        best_matches.append(m)
-                    else:
-                        pass
-                if len(best_matches) < self.orb_config.get_minimum_descriptor_count():
-                    #print(f'ignore block ({x:05},{y:05}), only {len(best_matches)} best matches (out of {len(matches)})')
+        # Computed here, before any threads that use it are started.
+        ref.get_points()
+        if self.needs_search(ref):
+            self.segment_neighbors = self.search_segments(ref)
+            self.searched_descriptors = reference_descriptors
+            self.searched_minimum = \
+                self.orb_config.get_minimum_descriptor_count() \
+                if self.orb_config.get_prefilter_segments() else None
+        else:
+            #print(f'{self.__class__.__name__}.compute() #(reuse nearest neighbors)')
+            pass
+        def ratio_test(neighbors):
+            return None if neighbors is None else self.ratio_test(ref, *neighbors)
+        matched_points = \
+          [ proj for proj in self.map_segments(ratio_test, self.segment_neighbors) \
+            if proj is not None \
+          ]
+        return self.merge_duplicates(ref, matched_points)
+
+    def map_segments(self, function, items, progress=False):
+        """Apply 'function' to each of the 'items' using the pool of
+        'workers' threads, and return the list of results in the same
+        order as the 'items' regardless of which worker finished first.
+        If 'progress' is True, the progress dialog is updated as each
+        result is collected, always from the calling thread."""
+        results = []
+        def collect(iterator):
+            for result in iterator:
+                if progress:
+                    self.update_progress()
+                else:
                     pass
+                results.append(result)
+        if self.workers > 1:
+            pool = ThreadPoolExecutor(max_workers=self.workers)
+            try:
+                collect(pool.map(function, items))
+            finally:
+                # If the progress dialog was canceled, do not wait for
+                # the remaining segments to be computed.
+                pool.shutdown(cancel_futures=True)
+        else:
+            collect(map(function, items))
+        return results
+
+    def search_segments(self, ref):
+        """Find the nearest and second nearest descriptors in each segment
+        for every descriptor of 'ref'. Returns a list with one element
+        for each segment in row-major order, except those left out by
+        'prefilter_segments()', each being either None (if the segment
+        has too few descriptors) or the tuple of arguments after 'ref'
+        that are passed to 'ratio_test()'.
+
+        When keypoints are detected separately in each segment and a
+        DiskCache was given to the constructor, the keypoints and
+        descriptors of all segments are stored in the cache as a
+        single entry, and taken from the cache when the same image is
+        searched again."""
+        use_flann = (self.orb_config.get_matcher() == 'flann')
+        grid = None
+        neighbors = None
+        segment_features = None
+        computed_features = None
+        cache_key = None
+        if use_flann or self.orb_config.get_detect_whole_image():
+            grid = self.whole_image_orb(ref)
+        elif self.cache is not None:
+            cache_key = self.segment_features_key()
+            segment_features = self.unpack_segment_features(
+                self.cache.get(cache_key, SEGMENT_FEATURE_ARRAYS),
+              )
+            computed_features = [] if segment_features is None else None
+        else:
+            pass
+        if use_flann:
+            # The FLANN index is searched once for the whole image, the
+            # results are then filtered for each segment.
+            neighbors = grid.knn_search(ref.get_descriptors(), FLANN_NEIGHBORS)
+        else:
+            pass
+        rects = list(self.segment_rects())
+        if computed_features is not None:
+            computed_features = [None] * len(rects)
+        else:
+            pass
+        def search_segment(i):
+            (x, y, w, h) = rect = rects[i]
+            if neighbors is not None:
+                return self.segment_neighbors_in_grid(ref, rect, grid, neighbors)
+            elif grid is not None:
+                (segment_points, segment_descriptors) = grid.select(rect)
+            elif segment_features is not None:
+                (segment_points, segment_descriptors) = segment_features[i]
+            else:
+                segment_orb = ImageWithORB(self.image[y:y+h, x:x+w], ref.get_orb_config())
+                segment_orb.compute()
+                segment_descriptors = segment_orb.get_descriptors()
+                segment_points = segment_orb.get_points()
+                if computed_features is not None:
+                    # Each thread only sets its own element.
+                    computed_features[i] = (segment_points, pack_descriptors(segment_descriptors))
                 else:
-                    target_keypoints = segment_orb.get_keypoints()
-                    reference_selection = np.float32(
-                        [reference_keypoints[m.queryIdx].pt for m in best_matches],
-                      )
-                    reference_selection = reference_selection.reshape(-1,1,2)
-                    target_selection = np.float32(
-                        [target_keypoints[m.trainIdx].pt for m in best_matches],
-                      )
-                    target_selection = target_selection.reshape(-1,1,2)
-                    proj = FeatureProjection.make(
-                        self.image,
-                        (x, y, width, height,),
-                        reference_selection,
-                        target_selection,
-                        (bestsum/nsum)/descriptor_threshold,
-                      )
-                    if proj is not None:
-                        matched_points.append(proj)
-                    else:
-                        #print(f'{self.__class__.__name__}.find_matching_points() #(({x},{y}) ignored)')
-                        pass
-        return matched_points
+                    pass
+            return self.segment_nearest_neighbors(ref, rect, segment_points, segment_descriptors)
+        result = self.map_segments(search_segment, self.prefilter_segments(rects), progress=True)
+        if (computed_features is not None) and \
+           all(features is not None for features in computed_features):
+            self.cache.put(cache_key, self.pack_segment_features(computed_features))
+        else:
+            # Segments skipped by the prefilter have no features to store.
+            pass
+        return result
+
+    def fast_points(self):
+        """Detect FAST corners on the whole target image, using the same
+        threshold as ORB, and return them as an Nx2 array of points.
+        The "shared" dictionary given to the constructor keeps the
+        result, so it is computed only once for each target image."""
+        shared_key = ('fast', self.orb_config.get_fastThreshold())
+        if shared_key in self.shared:
+            return self.shared[shared_key]
+        else:
+            pass
+        image = self.image
+        if (len(image.shape) == 3) and (image.shape[2] == 3):
+            image = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+        elif len(image.shape) == 3:
+            image = cv.cvtColor(image, cv.COLOR_BGRA2GRAY)
+        else:
+            pass
+        fast = cv.FastFeatureDetector_create(threshold=self.orb_config.get_fastThreshold())
+        keypoints = fast.detect(image, None)
+        points = np.float32([keypoint.pt for keypoint in keypoints]).reshape(-1, 2)
+        self.shared[shared_key] = points
+        return points
+
+    def segment_keypoint_counts(self, rects, points):
+        """Count how many of the 'points' (an Nx2 array) lie within each of
+        the 'rects'. The points are counted in the cells of a grid whose
+        lines are the edges of every segment, and the integral image
+        of this grid gives the count for any one segment by adding
+        and subtracting its 4 corners."""
+        rects = np.int64(rects).reshape(-1, 4)
+        xs = np.unique(np.concatenate([rects[:,0], rects[:,0] + rects[:,2]]))
+        ys = np.unique(np.concatenate([rects[:,1], rects[:,1] + rects[:,3]]))
+        column = np.searchsorted(xs, points[:,0], side='right') - 1
+        row = np.searchsorted(ys, points[:,1], side='right') - 1
+        inside = (column >= 0) & (column < len(xs) - 1) & (row >= 0) & (row < len(ys) - 1)
+        cells = np.zeros((len(ys), len(xs)), dtype=np.int64)
+        np.add.at(cells, (row[inside] + 1, column[inside] + 1), 1)
+        integral = cells.cumsum(axis=0).cumsum(axis=1)
+        left = np.searchsorted(xs, rects[:,0])
+        right = np.searchsorted(xs, rects[:,0] + rects[:,2])
+        top = np.searchsorted(ys, rects[:,1])
+        bottom = np.searchsorted(ys, rects[:,1] + rects[:,3])
+        return \
+            integral[bottom, right] - integral[top, right] - \
+            integral[bottom, left] + integral[top, left]
+
+    def prefilter_segments(self, rects):
+        """Return the indices of the 'rects' that should be searched. If
+        the 'prefilter_segments' parameter is set, segments with fewer
+        FAST corners than 'minimum_descriptor_count' are left out,
+        since ORB could not find enough keypoints in them to match the
+        reference image."""
+        if not self.orb_config.get_prefilter_segments():
+            return range(len(rects))
+        else:
+            counts = self.segment_keypoint_counts(rects, self.fast_points())
+            minimum = self.orb_config.get_minimum_descriptor_count()
+            return [i for (i, count) in enumerate(counts) if count >= minimum]
+
+    def segment_features_key(self):
+        """The key under which the features of every segment of this image
+        are stored in a DiskCache."""
+        return content_hash(
+            'ORB-segments', CACHE_VERSION, content_hash(self.image),
+            self.segment_width, self.segment_height,
+            self.orb_config.detection_parameters(),
+          )
+
+    def pack_segment_features(self, features):
+        """Take a list of 2-tuples (points, descriptors), one for each
+        segment, and join them into arrays to be stored in a DiskCache."""
+        return \
+          { 'points': np.concatenate([points for (points, _) in features]).reshape(-1,2),
+            'descriptors': np.concatenate([descriptors for (_, descriptors) in features]),
+            'counts': np.int64([len(points) for (points, _) in features]),
+          }
+
+    def unpack_segment_features(self, arrays):
+        """The inverse of 'pack_segment_features()', returns None if
+        'arrays' is None."""
+        if arrays is None:
+            return None
+        else:
+            bounds = np.concatenate([[0], np.cumsum(arrays['counts'])])
+            points = np.array(arrays['points'])
+            descriptors = np.array(arrays['descriptors'])
+            return \
+              [ (points[start:end], descriptors[start:end]) \
+                for (start, end) in zip(bounds[:-1], bounds[1:]) \
+              ]
+
+    def merge_duplicates(self, ref, projections):
+        """Keep only the most similar of each group of projections that
+        were found in different segments but that project the reference
+        image onto the same place in the target image, see
+        'DataPrepKit.utilities.merge_quadrilaterals()'. Projections are
+        returned in their original order."""
+        (_x, _y, width, height) = ref.get_crop_rect()
+        tolerance = self.orb_config.get_duplicate_tolerance() * min(width, height)
+        keep = util.merge_quadrilaterals(
+            [proj.get_perspective_bounds() for proj in projections],
+            [proj.get_match_score() for proj in projections],
+            tolerance,
+          )
+        return [proj for (proj, k) in zip(projections, keep) if k]
+
+    def segment_nearest_neighbors(self, ref, rect, segment_points, segment_descriptors):
+        """Match the reference descriptors against the descriptors of the
+        segment at 'rect' in the target image by brute force. The
+        'segment_points' are the positions of the keypoints of each of
+        the 'segment_descriptors' relative to the segment. Returns the
+        arguments for 'ratio_test()', see 'search_segments()'."""
+        (x, y, _w, _h) = rect
+        if len(segment_descriptors) < 2:
+            #print(f'ignore block ({x:05},{y:05}), only {len(segment_descriptors)} descriptors created')
+            return None
+        else:
+            pass
+        matches = ref.get_matcher().knnMatch(
+            ref.get_descriptors(),
+            segment_descriptors,
+            k=2
+          )
+        matches = [pair for pair in matches if len(pair) == 2]
+        query_indices = np.int32([m.queryIdx for (m, _n) in matches])
+        train_indices = np.int32([m.trainIdx for (m, _n) in matches])
+        distances = np.float32([(m.distance, n.distance) for (m, n) in matches]).reshape(-1,2)
+        return (
+            x, y,
+            len(segment_descriptors),
+            query_indices,
+            segment_points[train_indices],
+            distances[:,0],
+            distances[:,1],
+          )
+
+    def segment_neighbors_in_grid(self, ref, rect, grid, neighbors):
+        """Like 'segment_nearest_neighbors()', but rather than matching
+        descriptors in the segment at 'rect', use the 'neighbors' found
+        for every reference descriptor in the whole image by
+        'KeypointGrid.knn_search()', keeping the two nearest neighbors
+        that lie within the segment. When fewer than two of the
+        neighbors lie within the segment, the distance of the farthest
+        neighbor found is used in place of the second nearest distance,
+        which can only make the ratio test stricter."""
+        (x, y, _w, _h) = rect
+        (indices, distances) = neighbors
+        inside = np.zeros(len(grid) + 1, dtype=bool)
+        inside[grid.select_indices(rect)] = True
+        descriptor_count = np.count_nonzero(inside)
+        if descriptor_count < 2:
+            #print(f'ignore block ({x:05},{y:05}), only {descriptor_count} descriptors created')
+            return None
+        else:
+            pass
+        # Missing neighbors are -1, which selects the extra 'False'
+        # element at the end of 'inside'.
+        in_segment = inside[indices]
+        rank = np.cumsum(in_segment, axis=1)
+        has_best = rank[:,-1] >= 1
+        has_second = rank[:,-1] >= 2
+        best = np.argmax(in_segment, axis=1)
+        second = np.argmax(in_segment & (rank == 2), axis=1)
+        farthest = np.where(indices >= 0, distances, 0).max(axis=1, initial=0)
+        rows = np.arange(len(indices), dtype=np.int32)
+        best_distances = distances[rows, best]
+        second_distances = np.where(has_second, distances[rows, second], farthest)
+        train_indices = indices[rows, best]
+        return (
+            x, y,
+            descriptor_count,
+            rows[has_best],
+            grid.points[train_indices[has_best]] - np.float32([x, y]),
+            best_distances[has_best],
+            second_distances[has_best],
+          )
+
+    def ratio_test(
+            self, ref, x, y, descriptor_count,
+            query_indices, train_points, best_distances, second_distances,
+          ):
+        """Apply Lowe's ratio test to the nearest and second nearest
+        segment descriptor distances found for each of the reference
+        descriptors listed in 'query_indices', where 'train_points' are
+        the segment-relative positions of the nearest descriptors. If
+        the segment has enough descriptors ('descriptor_count') and
+        enough matches pass, construct the FeatureProjection of the
+        reference image into the segment at (x, y)."""
+        (_x, _y, width, height) = ref.get_crop_rect()
+        descriptor_threshold = self.orb_config.get_descriptor_threshold()
+        if descriptor_count < self.orb_config.get_minimum_descriptor_count():
+            #print(f'ignore block ({x:05},{y:05}), only {descriptor_count} descriptors created')
+            return None
+        else:
+            pass
+        accepted = best_distances < descriptor_threshold * second_distances
+        if np.count_nonzero(accepted) < self.orb_config.get_minimum_descriptor_count():
+            #print(f'ignore block ({x:05},{y:05}), only {np.count_nonzero(accepted)} best matches (out of {len(accepted)})')
+            return None
+        else:
+            pass
+        nsum = float(np.sum(second_distances, dtype=np.float64))
+        bestsum = float(np.sum(best_distances[accepted], dtype=np.float64))
+        reference_selection = ref.get_points()[query_indices[accepted]].reshape(-1,1,2)
+        target_selection = np.float32(train_points[accepted]).reshape(-1,1,2)
+        proj = FeatureProjection.make(
+            self.image,
+            (x, y, width, height,),
+            reference_selection,
+            target_selection,
+            (bestsum/nsum)/descriptor_threshold,
+          )
+        #if proj is None:
+        #    print(f'{self.__class__.__name__}.find_matching_points() #(({x},{y}) ignored)')
+        return proj
+
+#---------------------------------------------------------------------------------------------------
+
+class KeypointGrid():
+    """The keypoints and descriptors computed by ORB for a whole image,
+    sorted into a grid of square cells so that the keypoints within
+    any rectangle of the image can be found without searching through
+    every keypoint. This is used so that the ORB algorithm only needs
+    to run once on a target image, rather than once for every one of
+    the many overlapping segments of a SegmentedImage."""
+
+    def __init__(self, keypoints, descriptors, cell_size):
+        self.cell_size = cell_size
+        self.points = np.float32([keypoint.pt for keypoint in keypoints]).reshape(-1,2)
+        self.descriptors = descriptors if len(self.points) > 0 else np.zeros((0, 32), dtype=np.uint8)
+        self.lsh_index = None
+        cells = np.int64(self.points // cell_size)
+        self.columns = int(cells[:,0].max()) + 1 if len(cells) > 0 else 1
+        cell_ids = cells[:,1] * self.columns + cells[:,0]
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.sorted_cell_ids = cell_ids[self.order]
+
+    def __len__(self):
+        return len(self.points)
+
+    def select_indices(self, rect):
+        """Return the sorted indices of the keypoints within the rectangle
+        (x, y, width, height)."""
+        (x, y, width, height) = rect
+        (column_min, row_min) = (int(x // self.cell_size), int(y // self.cell_size))
+        column_max = min(self.columns - 1, int((x + width) // self.cell_size))
+        row_max = int((y + height) // self.cell_size)
+        selected = []
+        for row in range(row_min, row_max + 1):
+            lo = np.searchsorted(self.sorted_cell_ids, row * self.columns + column_min, side='left')
+            hi = np.searchsorted(self.sorted_cell_ids, row * self.columns + column_max, side='right')
+            selected.append(self.order[lo:hi])
+        selected = np.sort(np.concatenate(selected)) if len(selected) > 0 else np.zeros(0, dtype=np.int64)
+        points = self.points[selected]
+        inside = \
+            (points[:,0] >= x) & (points[:,0] < x + width) & \
+            (points[:,1] >= y) & (points[:,1] < y + height)
+        return selected[inside]
+
+    def select(self, rect):
+        """Return a 2-tuple (points, descriptors) for the keypoints within
+        the rectangle (x, y, width, height), with the points relative
+        to the rectangle origin. Keypoints are returned in the order
+        ORB produced them."""
+        (x, y, _w, _h) = rect
+        selected = self.select_indices(rect)
+        return (self.points[selected] - np.float32([x, y]), self.descriptors[selected])
+
+    def knn_search(self, descriptors, k):
+        """Find the approximate 'k' nearest of all keypoint descriptors to
+        each of the given 'descriptors' using a FLANN LSH index, which
+        is built the first time this method is called and reused
+        afterward. Returns a 2-tuple (indices, distances) of arrays with
+        one row for each of the 'descriptors', ordered from nearest to
+        farthest, where missing neighbors have the index -1."""
+        k = min(k, len(self))
+        if k == 0:
+            empty = np.zeros((len(descriptors), 0), dtype=np.int64)
+            return (empty, np.float32(empty))
+        elif self.lsh_index is None:
+            cv.setRNGSeed(FLANN_RNG_SEED)
+            self.lsh_index = cv.flann_Index(self.descriptors, FLANN_LSH_PARAMS)
+        else:
+            pass
+        (indices, distances) = self.lsh_index.knnSearch(descriptors, k, params=FLANN_SEARCH_PARAMS)
+        return (np.int64(indices), np.float32(distances))
 
 #---------------------------------------------------------------------------------------------------
 
@@ -444,6 +1047,10 @@ class ORBConfig():
         self.fastThreshold = 20
         self.descriptor_threshold = 0.7
         self.minimum_descriptor_count = 20
+        self.detect_whole_image = False
+        self.matcher = 'bruteforce'
+        self.duplicate_tolerance = 0.1
+        self.prefilter_segments = False
         #self.descriptor_nearest_neighbor_count = 2
 
     def __eq__(self, a):
@@ -459,7 +1066,11 @@ class ORBConfig():
             (self.patchSize == a.patchSize) and \
             (self.fastThreshold == a.fastThreshold) and \
             (self.descriptor_threshold == a.descriptor_threshold) and \
-            (self.minimum_descriptor_count == a.minimum_descriptor_count) \
+            (self.minimum_descriptor_count == a.minimum_descriptor_count) and \
+            (self.detect_whole_image == a.detect_whole_image) and \
+            (self.matcher == a.matcher) and \
+            (self.duplicate_tolerance == a.duplicate_tolerance) and \
+            (self.prefilter_segments == a.prefilter_segments) \
             #(self.descriptor_nearest_neighbor_count == a.descriptor_nearest_neighbor_count) \
           )
 
@@ -476,6 +1087,10 @@ class ORBConfig():
             'fast_threshold': self.fastThreshold,
             'descriptor_threshold': self.descriptor_threshold,
             'minimum_descriptor_count': self.minimum_descriptor_count,
+            'detect_whole_image': self.detect_whole_image,
+            'matcher': self.matcher,
+            'duplicate_tolerance': self.duplicate_tolerance,
+            'prefilter_segments': self.prefilter_segments,
             #'descriptor_nearest_neigbor_count': self.descriptor_nearest_neighbor_count,
           }
 
@@ -493,6 +1108,10 @@ class ORBConfig():
             'fast_threshold': self.set_fastThreshold,
             'descriptor_threshold': self.set_descriptor_threshold,
             'minimum_descriptor_count': self.set_minimum_descriptor_count,
+            'detect_whole_image': self.set_detect_whole_image,
+            'matcher': self.set_matcher,
+            'duplicate_tolerance': self.set_duplicate_tolerance,
+            'prefilter_segments': self.set_prefilter_segments,
           }
         used_handlers = set()
         for (key, value) in config.items():
@@ -511,6 +1130,40 @@ class ORBConfig():
     def __str__(self):
         return str(self.to_dict())
 
+    def same_detection(self, a):
+        """True if 'a' would compute the same keypoints and descriptors for
+        an image as this config, so keypoints computed with either one
+        can be reused by the other."""
+        return (a is not None) and (self.detection_parameters() == a.detection_parameters())
+
+    def same_search(self, a):
+        """True if 'a' would find the same nearest neighbor descriptors in
+        every segment of a target image as this config, meaning the two
+        can only differ in the matching parameters, which are
+        'descriptor_threshold', 'minimum_descriptor_count',
+        'duplicate_tolerance', and 'prefilter_segments'. Segments that
+        were skipped by the prefilter are searched again when needed,
+        see 'SegmentedImage.needs_search()'."""
+        return \
+            self.same_detection(a) and \
+            (self.detect_whole_image == a.detect_whole_image) and \
+            (self.matcher == a.matcher)
+
+    def detection_parameters(self):
+        """Return a tuple of the parameters that affect which keypoints
+        and descriptors ORB computes, but not how they are matched."""
+        return (
+            self.nFeatures,
+            self.scaleFactor,
+            self.nLevels,
+            self.edgeThreshold,
+            self.firstLevel,
+            self.WTA_K,
+            self.scoreType,
+            self.patchSize,
+            self.fastThreshold,
+          )
+
     def get_nFeatures(self):
         return self.nFeatures
 
@@ -593,6 +1246,66 @@ class ORBConfig():
         util.check_param('descriptor threshold', count, 4, round(self.nFeatures / 2))
         self.minimum_descriptor_count = count
 
+    def get_detect_whole_image(self):
+        return self.detect_whole_image
+
+    def set_detect_whole_image(self, detect_whole_image):
+        """If True, ORB keypoints are detected once on the whole target
+        image, and each segment uses the keypoints that lie within it,
+        rather than detecting keypoints separately in every one of the
+        overlapping segments. This is much faster on large images."""
+        if not isinstance(detect_whole_image, bool):
+            raise ValueError('"detect whole image" parameter must be true or false', detect_whole_image)
+        else:
+            self.detect_whole_image = detect_whole_image
+
+    def get_matcher(self):
+        return self.matcher
+
+    def set_matcher(self, matcher):
+        """Either 'bruteforce', which compares every reference descriptor
+        to every descriptor in each segment, or 'flann', which searches
+        an approximate nearest-neighbor index of all descriptors in the
+        target image. The 'flann' matcher always detects keypoints on
+        the whole target image, as if 'detect_whole_image' were set."""
+        if matcher not in MATCHERS:
+            raise ValueError(f'"matcher" parameter must be one of {", ".join(MATCHERS)}', matcher)
+        else:
+            self.matcher = matcher
+
+    def get_duplicate_tolerance(self):
+        return self.duplicate_tolerance
+
+    def set_duplicate_tolerance(self, tolerance):
+        """The same object in the target image is usually found in several
+        of the overlapping segments. Two matches are merged if every
+        corner of one is within this fraction of the reference image
+        size of the same corner of the other. Zero disables merging."""
+        util.check_param('duplicate tolerance', tolerance, 0.0, 1.0)
+        self.duplicate_tolerance = tolerance
+
+    def get_prefilter_segments(self):
+        return self.prefilter_segments
+
+    def set_prefilter_segments(self, prefilter_segments):
+        """If True, FAST corners are detected once on the whole target
+        image before it is searched, and segments containing fewer
+        corners than 'minimum_descriptor_count' are skipped without
+        running ORB on them. This is much faster when most of the
+        target image is blank background, but because ORB also detects
+        keypoints on scaled-down copies of each segment, a segment
+        with very few corners could, rarely, have been matched."""
+        if not isinstance(prefilter_segments, bool):
+            raise ValueError('"prefilter segments" parameter must be true or false', prefilter_segments)
+        else:
+            self.prefilter_segments = prefilter_segments
+
+    def get_descriptor_norm(self):
+        """ORB descriptors are binary strings compared by Hamming
+        distance, but when WTA_K is 3 or 4 each pair of bits encodes
+        one value, and these must be compared with NORM_HAMMING2."""
+        return cv.NORM_HAMMING if self.WTA_K == 2 else cv.NORM_HAMMING2
+
     # def get_descriptor_nearest_neigbor_count(self):
     #     return self.descriptor_nearest_neighbor_count
 
@@ -614,6 +1327,9 @@ class ORBMatcher(AbstractMatcher):
         self.last_run_orb_config = None
         self.cached_image = None
         self.reference_with_orb = None
+        self.target_features = {}
+        self.target_features_key = None
+        self.cached_reference = None
         reference = self.app_model.get_reference_image()
         if reference.get_path() is not None:
             self.update_reference_image(reference=reference)
@@ -662,7 +1378,7 @@ class ORBMatcher(AbstractMatcher):
 
     def set_reference_with_orb(self, image):
         #print(f'{self.__class__.__name__}.set_Reference_with({image})')
-        self.reference_with_orb = ImageWithORB(image, self.orb_config)
+        self.reference_with_orb = ImageWithORB(image, self.orb_config, cache=self.app_model.get_disk_cache())
         self.reference_with_orb.compute()
 
     def get_keypoints(self):
@@ -677,11 +1393,31 @@ class ORBMatcher(AbstractMatcher):
         else:
             return self.reference_with_orb.get_descriptors()
 
-    def needs_refresh(self):
+    def target_key(self, target):
+        """Identifies the target image whose keypoints are kept, by its path
+        and crop rectangle, and the modification time and size of its
+        file, so that a file changed on disk is searched again without
+        hashing every pixel of each target image."""
+        path = target.get_path()
+        try:
+            stat = os.stat(path)
+            file_key = (stat.st_mtime_ns, stat.st_size)
+        except (OSError, TypeError):
+            file_key = None
+        return (str(path), target.get_crop_rect(), file_key)
+
+    def needs_refresh(self, target=None):
+        """True if the target image must be searched from the start, that
+        is, if it has not been searched yet, or if the target or
+        reference image has changed since the last search. When only the
+        ORBConfig has changed, the SegmentedImage of the last search is
+        reused, and it decides how much needs to be computed again, see
+        'SegmentedImage.set_orb_config()'."""
+        target = target if target is not None else self.app_model.get_target_image()
         return \
-            AbstractMatcher(self) or \
-            (self.orb_config != self.last_run_orb_config) or \
-            (self.cached_image is None)
+            (self.cached_image is None) or \
+            (self.cached_reference is not self.reference_with_orb) or \
+            (self.target_features_key != self.target_key(target))
 
     def set_threshold(self, threshold):
         """This function filters the list of matched items by their threshold
@@ -707,11 +1443,24 @@ class ORBMatcher(AbstractMatcher):
 
     def match_on_file(self, image_loader=None, progress=None):
         #print(f'{self.__class__.__name__}.match_on_file()')
-        points = AbstractMatcher.get_matched_points(self)
-        if points is None or self.needs_refresh():
-            return self.force_match_on_file(image_loader, progress=progress)
+        target = image_loader if image_loader is not None else self.app_model.get_target_image()
+        if not self.reference_with_orb:
+            self.update_reference_image()
+        else:
+            pass
+        target.load_image()
+        if (AbstractMatcher.get_matched_points(self) is None) or self.needs_refresh(target):
+            return self.force_match_on_file(target, progress=progress)
         else:
-            return self.get_match_points()
+            segmented_image = self.cached_image
+            segmented_image.set_orb_config(self.orb_config)
+            if (progress is not None) and segmented_image.needs_search(self.reference_with_orb):
+                progress.add_work(self.guess_compute_steps(), label='Scanning image')
+            else:
+                pass
+            matched_points = segmented_image.find_matching_points(self.reference_with_orb)
+            AbstractMatcher._update_matched_points(self, matched_points)
+            return self.get_matched_points()
 
     def update_reference_image(self, reference=None):
         # Reference must be a CachedCVImageLoader object
@@ -720,7 +1469,10 @@ class ORBMatcher(AbstractMatcher):
             raise ValueError('reference image has not been selected')
         else:
             reference.load_image()
-            self.reference_with_orb = ImageWithORB(reference, self.orb_config)
+            self.reference_with_orb = ImageWithORB(
+                reference, self.orb_config,
+                cache=self.app_model.get_disk_cache(),
+              )
             self.reference_with_orb.compute()
             self.last_run_orb_config = self.orb_config
     
@@ -747,13 +1499,25 @@ class ORBMatcher(AbstractMatcher):
             raise ValueError('input image not selected')
         else:
             #print(f'{self.__class__.__name__}.force_match_on_file() #(construct SegmentedImage())')
+            # Keypoints detected on the whole target image are kept
+            # until another target image is searched.
+            target_features_key = self.target_key(target)
+            if target_features_key != self.target_features_key:
+                self.target_features = {}
+                self.target_features_key = target_features_key
+            else:
+                pass
             segmented_image = SegmentedImage(
                 self.orb_config,
                 target_image,
                 reference_bounds,
-                progress=progress
+                progress=progress,
+                shared=self.target_features,
+                workers=self.app_model.get_threads(),
+                cache=self.app_model.get_disk_cache(),
               )
             self.cached_image = segmented_image
+            self.cached_reference = self.reference_with_orb
             if progress is not None:
                 guess = self.guess_compute_steps()
                 progress.add_work(guess, label='Scanning image')
@@ -0,0 +1,165 @@
+from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
+import DataPrepKit.utilities as util
+
+from pathlib import PurePath
+
+#---------------------------------------------------------------------------------------------------
+
+class LabelledPattern():
+    """One reference image in a PatternLibrary. Each pattern has a label
+    which is used as the name of the directory into which the regions
+    matching this pattern are written, its own feature region (the
+    region of the reference image that is searched for), its own crop
+    regions, and its own threshold. If the threshold is None, the
+    threshold of the application is used instead."""
+
+    def __init__(self, label, path, feature_region=None, crop_regions=None, threshold=None):
+        if (not isinstance(label, str)) or (label == ''):
+            raise ValueError('pattern label must be a non-empty string', label)
+        else:
+            pass
+        self.label = label
+        self.reference = CachedCVImageLoader(path=PurePath(path), crop_rect=feature_region)
+        self.feature_region = feature_region
+        self.crop_regions = crop_regions if crop_regions is not None else {}
+        self.threshold = threshold
+
+    def get_label(self):
+        return self.label
+
+    def get_reference_image(self):
+        return self.reference
+
+    def get_feature_region(self):
+        return self.feature_region
+
+    def get_crop_regions(self):
+        return self.crop_regions
+
+    def get_threshold(self, default=None):
+        return self.threshold if self.threshold is not None else default
+
+    def load_image(self):
+        """Load the reference image and crop it to the feature region."""
+        self.reference.load_image(crop_rect=self.feature_region)
+
+    def get_size(self):
+        """Return the (width, height) of the feature region of the reference
+        image, the reference image must be loaded."""
+        image = self.reference.get_image()
+        return (image.shape[1], image.shape[0])
+
+    @staticmethod
+    def configure_from_json(config):
+        """Construct a LabelledPattern from a dictionary read from a JSON
+        config file, for example:
+
+          { "label": "capacitor",
+            "reference_image": "./patterns/capacitor.png",
+            "feature_region": [0, 0, 32, 32],
+            "crop_regions": {"top": [0, -16, 32, 16]},
+            "threshold": 0.9
+          }
+
+        Only "label" and "reference_image" are required."""
+        if not isinstance(config, dict):
+            raise ValueError('JSON parameter "patterns" must be a list of dictionaries', config)
+        else:
+            pass
+        label = None
+        path = None
+        feature_region = None
+        crop_regions = None
+        threshold = None
+        for (key, value) in config.items():
+            lkey = key.lower()
+            if lkey == 'label':
+                label = value
+            elif lkey == 'reference_image':
+                path = value
+            elif lkey == 'feature_region':
+                feature_region = util.check_rect_config(value, 'in config file, pattern "feature_region" parameter')
+            elif lkey == 'crop_regions':
+                crop_regions = util.check_region_config(value, 'in config file, pattern "crop_regions" parameter')
+            elif lkey == 'threshold':
+                if isinstance(value, int) or isinstance(value, float):
+                    threshold = value
+                else:
+                    raise ValueError('pattern "threshold" parameter is not a number', value, config)
+            else:
+                raise ValueError('pattern config, unknown parameter', key, config)
+        if label is None:
+            raise ValueError('pattern config, "label" parameter is required', config)
+        elif path is None:
+            raise ValueError('pattern config, "reference_image" parameter is required', config)
+        else:
+            return LabelledPattern(label, path, feature_region, crop_regions, threshold)
+
+    def configure_to_json(self):
+        result = \
+          { 'label': self.label,
+            'reference_image': str(self.reference.get_path()),
+          }
+        if self.feature_region is not None:
+            result['feature_region'] = util.rect_to_list(self.feature_region)
+        else:
+            pass
+        if len(self.crop_regions) > 0:
+            result['crop_regions'] = \
+                { k: util.rect_to_list(v) for (k, v) in self.crop_regions.items() }
+        else:
+            pass
+        if self.threshold is not None:
+            result['threshold'] = self.threshold
+        else:
+            pass
+        return result
+
+#---------------------------------------------------------------------------------------------------
+
+class PatternLibrary():
+    """A list of LabelledPatterns that are all searched for in each target
+    image of a batch, so that each target image only needs to be
+    loaded once regardless of how many patterns there are."""
+
+    def __init__(self):
+        self.patterns = []
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+    def add(self, pattern):
+        if not isinstance(pattern, LabelledPattern):
+            raise ValueError('expecting LabelledPattern', pattern)
+        else:
+            pass
+        for other in self.patterns:
+            if other.get_label() == pattern.get_label():
+                raise ValueError('pattern label used more than once', pattern.get_label())
+            else:
+                pass
+        self.patterns.append(pattern)
+
+    def clear(self):
+        self.patterns = []
+
+    def load_images(self):
+        """Load all reference images and return the list of patterns, in
+        the order they were added."""
+        for pattern in self.patterns:
+            pattern.load_image()
+        return list(self.patterns)
+
+    def configure_from_json(self, config):
+        if not isinstance(config, list):
+            raise ValueError('JSON parameter "patterns" must be a list of dictionaries', config)
+        else:
+            self.clear()
+            for item in config:
+                self.add(LabelledPattern.configure_from_json(item))
+
+    def configure_to_json(self):
+        return [pattern.configure_to_json() for pattern in self.patterns]
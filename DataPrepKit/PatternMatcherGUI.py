@@ -1266,8 +1266,15 @@ class InspectTab(qt.QWidget):
             'Processing all files...',
             'Cancel', 0, compute_steps,
           )
-        app_model.batch_crop_matched_patterns(progress=progress_dialog)
+        errors = app_model.batch_crop_matched_patterns(progress=progress_dialog)
         progress_dialog.accept()
+        if len(errors) > 0:
+            self.main_view.error_message(
+                f'{len(errors)} of {compute_steps} files failed:\n' +
+                '\n'.join(f'{str(path)!r}: {message}' for (path, message) in errors)
+              )
+        else:
+            pass
 
     def search_next_image(self):
         (row, count) = self.current_file_index()
@@ -1416,6 +1423,17 @@ class AlgorithmSelector(qt.QTabWidget):
         self.patchSize.editingFinished.connect(self.check_patchSize)
         self.fastThreshold = qt.QLineEdit(str(self.orb_config.get_fastThreshold()))
         self.fastThreshold.editingFinished.connect(self.check_fastThreshold)
+        self.duplicate_tolerance = qt.QLineEdit(str(self.orb_config.get_duplicate_tolerance()))
+        self.duplicate_tolerance.editingFinished.connect(self.check_duplicate_tolerance)
+        self.detect_whole_image = qt.QCheckBox()
+        self.detect_whole_image.setChecked(self.orb_config.get_detect_whole_image())
+        self.detect_whole_image.stateChanged.connect(self.check_detect_whole_image)
+        self.flann_matcher = qt.QCheckBox()
+        self.flann_matcher.setChecked(self.orb_config.get_matcher() == 'flann')
+        self.flann_matcher.stateChanged.connect(self.check_flann_matcher)
+        self.prefilter_segments = qt.QCheckBox()
+        self.prefilter_segments.setChecked(self.orb_config.get_prefilter_segments())
+        self.prefilter_segments.stateChanged.connect(self.check_prefilter_segments)
         #self.descriptor_neighbor_count = qt.QLineEdit(str(self.orb_config.get_descriptor_nearest_neigbor_count()))
         #self.descriptor_neighbor_count.editingFinished.connect(self.check_descriptor_neighbor_count)
         ## -------------------- the form layout --------------------
@@ -1432,6 +1450,10 @@ class AlgorithmSelector(qt.QTabWidget):
         self.form_layout.addRow('Patch Size (>2, <1024)', self.patchSize)
         self.form_layout.addRow('WTA Factor (>2, <4)', self.WTA_K)
         self.form_layout.addRow('FAST Threshold (>2, <100)', self.fastThreshold)
+        self.form_layout.addRow('Merge Duplicates Within (>=0.0, <1.0)', self.duplicate_tolerance)
+        self.form_layout.addRow('Detect Features on Whole Image', self.detect_whole_image)
+        self.form_layout.addRow('Approximate Matching (FLANN)', self.flann_matcher)
+        self.form_layout.addRow('Skip Segments With Few Corners', self.prefilter_segments)
         #self.form_layout.addRow('Number of Neighbor (>2, <5)', self.descriptor_neighbor_count)
         ## -------------------- Control Buttons --------------------
         self.buttons = qt.QWidget(self)
@@ -1536,6 +1558,18 @@ class AlgorithmSelector(qt.QTabWidget):
     def check_minimum_descriptor_count(self):
         self.update_field(self.minimum_descriptor_count, int, self.orb_config.set_minimum_descriptor_count)
 
+    def check_duplicate_tolerance(self):
+        self.update_field(self.duplicate_tolerance, float, self.orb_config.set_duplicate_tolerance)
+
+    def check_detect_whole_image(self):
+        self.orb_config.set_detect_whole_image(self.detect_whole_image.isChecked())
+
+    def check_flann_matcher(self):
+        self.orb_config.set_matcher('flann' if self.flann_matcher.isChecked() else 'bruteforce')
+
+    def check_prefilter_segments(self):
+        self.orb_config.set_prefilter_segments(self.prefilter_segments.isChecked())
+
     # def check_descriptor_neighbor_count(self):
     #     self.update_field(self.descriptor_neighbor_count, int, self.orb_config.set_descriptor_nearest_neigbor_count)
 
@@ -1553,6 +1587,10 @@ class AlgorithmSelector(qt.QTabWidget):
         self.reset_field(self.fastThreshold, self.orb_config.get_fastThreshold)
         self.reset_field(self.descriptor_threshold, self.orb_config.get_descriptor_threshold)
         self.reset_field(self.minimum_descriptor_count, self.orb_config.get_minimum_descriptor_count)
+        self.reset_field(self.duplicate_tolerance, self.orb_config.get_duplicate_tolerance)
+        self.detect_whole_image.setChecked(self.orb_config.get_detect_whole_image())
+        self.flann_matcher.setChecked(self.orb_config.get_matcher() == 'flann')
+        self.prefilter_segments.setChecked(self.orb_config.get_prefilter_segments())
         #self.reset_field(self.descriptor_neighbor_count, self.orb_config.get_descriptor_nearest_neigbor_count)
 
     def apply_changes_action(self):
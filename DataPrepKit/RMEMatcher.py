@@ -1,8 +1,10 @@
 from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
 from DataPrepKit.RegionSize import RegionSize
 from DataPrepKit.AbstractMatcher import AbstractMatcher, AbstractMatchCandidate
+from DataPrepKit.DiskCache import content_hash
 import DataPrepKit.utilities as util
 
+from concurrent.futures import ThreadPoolExecutor
 import math
 import os
 import os.path
@@ -15,6 +17,22 @@ import numpy as np
 ####################################################################################################
 # The pattern matcing program
 
+MINIMUM_THRESHOLD = 0.5
+  # The lowest threshold value accepted by 'DistanceMap.find_matching_points()'
+
+DEFAULT_PYRAMID_THRESHOLD = 0.5
+  # In pyramid mode, the correlation coefficient a position in the
+  # reduced-size images must have for the region around it to be
+  # searched at full resolution.
+
+CACHE_VERSION = 1
+  # Increase this whenever a change to DistanceMap changes the index it
+  # computes, so that indices computed before the change are not used.
+
+INDEX_ARRAYS = ('index_tiles', 'index_x', 'index_y', 'index_scores')
+  # The names of the fields of a DistanceMap that make up its index,
+  # these are stored in a DiskCache.
+
 class DistanceMap():
     """Construct DistanceMap() by providing a target image and a pattern
     matching image. For every point in the target image, the
@@ -30,7 +48,12 @@ class DistanceMap():
     hard-coded to be 2/3rds the size of the target's size.
     """
 
-    def __init__(self, target, pattern, write_file_suffix=None):
+    def __init__(
+            self, target, pattern, write_file_suffix=None,
+            pyramid_levels=0, pyramid_threshold=DEFAULT_PYRAMID_THRESHOLD,
+            shared=None, memory_budget=None, keep_distance_map=False,
+            workers=1, cache=None,
+          ):
         """Takes two 2D-images, NumPy arrays loaded from files by
         OpenCV. Constructing this object computes the convolution and
         square-difference distance map. The "write_file_suffix" should
@@ -38,7 +61,36 @@ class DistanceMap():
         create. The OpenCV backend for this program uses this suffix
         to decide how to encode the file, so for example "bmp" will
         construct a MS-Windows "Bitmap" encoded image file, "png" will
-        construct a PNG encoded image file."""
+        construct a PNG encoded image file.
+
+        If "pyramid_levels" is greater than zero, the distance map is
+        computed coarse-to-fine rather than exhaustively, see the
+        'pyramid_search()' method.
+
+        The "shared" argument may be a dictionary that is passed to
+        every DistanceMap constructed for the same target image (for
+        example when searching for several patterns in one image), it
+        is used to keep intermediate results computed from the target
+        image so they are not computed again for each pattern.
+
+        If "memory_budget" is a number of bytes, the distance map is
+        computed in horizontal strips small enough that each strip
+        fits within the budget, see the 'strip_search()' method. In
+        this case the whole distance map is only kept in memory (in
+        the "distance_map" field) if "keep_distance_map" is True,
+        otherwise the "distance_map" field is None.
+
+        If "workers" is greater than one, the distance map is computed
+        in strips in that many threads at once. Without a
+        "memory_budget" the whole distance map is still kept.
+
+        If "cache" is a DiskCache, the index of the local minima of
+        the distance map (see 'build_index()') is stored in it, and if
+        an index computed from the same target and pattern pixels,
+        crop rectangles, and pyramid parameters is already stored, it
+        is used instead of computing the distance map at all. In that
+        case the "distance_map" field is None. The cache is not used
+        if "keep_distance_map" is True. """
         #----------------------------------------
         # Type checking
         if not isinstance(target, CachedCVImageLoader):
@@ -52,6 +104,8 @@ class DistanceMap():
         #----------------------------------------
         self.target = target
         self.reference = pattern
+        self.target_key = (str(target.get_path()), target.get_crop_rect())
+        self.reference_key = (str(pattern.get_path()), pattern.get_crop_rect())
         reference_image = pattern.get_image()
         pat_shape = reference_image.shape
         self.reference_height = pat_shape[0]
@@ -114,35 +168,321 @@ class DistanceMap():
         # cv.TM_CCORR   cv.TM_CCORR_NORMED
         # cv.TM_SQDIFF  cv.TM_SQDIFF_NORMED
 
-        # Apply template Matching
-        pre_distance_map = cv.matchTemplate(target_image, reference_image, cv.TM_SQDIFF_NORMED)
-        pre_dist_map_height, pre_dist_map_width = pre_distance_map.shape
-        #print(f"pre_dist_map_height = {pre_dist_map_height}, pre_dist_map_width = {pre_dist_map_width}")
-
-        # Normalize result
-        np.linalg.norm(pre_distance_map)
+        # The distance map has one element for every position at which
+        # the reference image fits entirely within the target image.
+        self.pre_dist_map_height = target_image.shape[0] - self.reference_height + 1
+        self.pre_dist_map_width  = target_image.shape[1] - self.reference_width  + 1
+        #print(f"pre_dist_map_height = {self.pre_dist_map_height}, pre_dist_map_width = {self.pre_dist_map_width}")
 
         # The "search_image" is a white image that is the smallest
         # even multiple of the window size that is larger than the
         # distance_map.
-        self.distance_map = np.ones( \
-            ( pre_dist_map_height - (pre_dist_map_height % -self.window_height), \
-              pre_dist_map_width  - (pre_dist_map_width  % -self.window_width ) \
-            ), \
-            dtype=np.float32,
-          )
-        #print(f"dist_map_height = {pre_dist_map_height}, dist_map_width = {pre_dist_map_width}")
-
-        # Copy the result into the "search_image".
-        self.distance_map[0:pre_dist_map_height, 0:pre_dist_map_width] = pre_distance_map
+        self.dist_map_height = self.pre_dist_map_height - \
+            (self.pre_dist_map_height % -self.window_height)
+        self.dist_map_width  = self.pre_dist_map_width  - \
+            (self.pre_dist_map_width  % -self.window_width)
+        #print(f"dist_map_height = {self.dist_map_height}, dist_map_width = {self.dist_map_width}")
+
+        self.pyramid_levels = pyramid_levels
+        self.pyramid_threshold = pyramid_threshold
+        self.shared = shared if shared is not None else {}
+        self.memory_budget = memory_budget
+        self.workers = max(1, workers)
+        cache_key = None
+        index = None
+        if (cache is not None) and not keep_distance_map:
+            cache_key = self.cache_key()
+            index = cache.get(cache_key, INDEX_ARRAYS)
+        else:
+            pass
+        if index is not None:
+            self.distance_map = None
+            self.set_index(index)
+        elif (memory_budget is None) and (self.workers == 1):
+            self.distance_map = np.ones(
+                (self.dist_map_height, self.dist_map_width),
+                dtype=np.float32,
+              )
+            if pyramid_levels > 0:
+                self.pyramid_search(target_image, reference_image, self.distance_map)
+            else:
+                # Apply template Matching, copy the result into the
+                # "search_image".
+                self.distance_map[0:self.pre_dist_map_height, 0:self.pre_dist_map_width] = \
+                    cv.matchTemplate(target_image, reference_image, cv.TM_SQDIFF_NORMED)
+            # Every tile is searched for its local minimum only once,
+            # here, and the result is kept in an index sorted by
+            # similarity. The 'find_matching_points()' method then only
+            # needs to do a binary search on this index for each new
+            # threshold value.
+            self.build_index(select_minima(tile_minima(
+                self.distance_map,
+                self.window_width,
+                self.window_height,
+              )))
+        else:
+            self.strip_search(
+                target_image, reference_image,
+                keep_distance_map or (memory_budget is None),
+              )
+        if (cache_key is not None) and (index is None):
+            cache.put(cache_key, self.get_index())
+        else:
+            pass
 
         # The 'find_matching_points()' method will memoize it's results.
         self.memoized_regions = {}
 
+    def pyramid_search(self, target_image, reference_image, distance_map, shared_key=()):
+        """Compute the 'distance_map' coarse-to-fine. Both images are first
+        reduced in size by half 'self.pyramid_levels' times and the
+        reduced pattern is compared to every position of the reduced
+        target. Then only the blocks of the full-resolution distance
+        map near promising positions are computed at full resolution.
+        The rest of the distance map is left at 1.0 (no similarity),
+        so these positions are never selected as candidates.
+
+        The comparison at the reduced size uses the normalized
+        correlation coefficient rather than the square difference,
+        because reducing an image blurs it, which makes every region
+        of the target similar to the pattern by square difference. A
+        position is promising if its correlation coefficient is at
+        least 'self.pyramid_threshold'.
+
+        The number of levels is reduced if the pattern image would
+        become smaller than 4 pixels wide or high.
+
+        The 'distance_map' must be padded to a multiple of the window
+        size, as 'self.distance_map' is. The 'shared_key' is appended
+        to the key under which the reduced 'target_image' is shared,
+        it must be unique for each part of the target image that is
+        searched, for example the rows of a strip."""
+        levels = self.pyramid_levels
+        while (levels > 0) and \
+          ( ((self.reference_width  >> levels) < 4) or \
+            ((self.reference_height >> levels) < 4) ):
+            levels -= 1
+        (pre_dist_map_height, pre_dist_map_width) = \
+          ( target_image.shape[0] - self.reference_height + 1,
+            target_image.shape[1] - self.reference_width  + 1,
+          )
+        if levels <= 0:
+            distance_map[0:pre_dist_map_height, 0:pre_dist_map_width] = \
+                cv.matchTemplate(target_image, reference_image, cv.TM_SQDIFF_NORMED)
+            return
+        else:
+            pass
+        #----------------------------------------
+        # Match at the coarsest level of the pyramid. The reduced target
+        # image does not depend on the pattern, so it is shared with
+        # other DistanceMaps for the same target.
+        coarse_reference = reference_image
+        for _ in range(levels):
+            coarse_reference = cv.pyrDown(coarse_reference)
+        shared_key = ('pyramid', self.target_key, levels) + tuple(shared_key)
+        if shared_key in self.shared:
+            coarse_target = self.shared[shared_key]
+        else:
+            coarse_target = target_image
+            for _ in range(levels):
+                coarse_target = cv.pyrDown(coarse_target)
+            self.shared[shared_key] = coarse_target
+        coarse_map = cv.matchTemplate(coarse_target, coarse_reference, cv.TM_CCOEFF_NORMED)
+        # Positions in the coarse map are only accurate to within one
+        # coarse pixel, so every promising position is grown by one
+        # pixel in every direction before it is mapped back to the
+        # full resolution distance map.
+        promising = np.uint8(coarse_map >= self.pyramid_threshold)
+        promising = cv.dilate(promising, np.ones((3, 3), dtype=np.uint8))
+        (coarse_y, coarse_x) = np.nonzero(promising)
+        #----------------------------------------
+        # Refine at full resolution, one block of the distance map at a
+        # time. Blocks are aligned to the window grid, and are at least
+        # as large as the pattern so that the margin of target pixels
+        # around each block that the pattern overlaps does not cost
+        # more than the block itself.
+        scale = 1 << levels
+        block_height = self.window_height * \
+            math.ceil(max(4 * scale, self.reference_height) / self.window_height)
+        block_width  = self.window_width  * \
+            math.ceil(max(4 * scale, self.reference_width)  / self.window_width)
+        blocks = set()
+        for (y, x) in [(coarse_y * scale, coarse_x * scale),
+                       ((coarse_y + 1) * scale - 1, (coarse_x + 1) * scale - 1)]:
+            blocks |= set(zip(
+                (np.minimum(y, pre_dist_map_height - 1) // block_height).tolist(),
+                (np.minimum(x, pre_dist_map_width  - 1) // block_width).tolist(),
+              ))
+        for (block_y, block_x) in sorted(blocks):
+            y0 = block_y * block_height
+            x0 = block_x * block_width
+            y1 = min(y0 + block_height, pre_dist_map_height)
+            x1 = min(x0 + block_width,  pre_dist_map_width)
+            distance_map[y0:y1, x0:x1] = cv.matchTemplate(
+                target_image[
+                    y0 : y1 + self.reference_height - 1,
+                    x0 : x1 + self.reference_width  - 1,
+                  ],
+                reference_image,
+                cv.TM_SQDIFF_NORMED,
+              )
+
     def same_inputs(self, reference, target):
         return \
-            str(self.reference.get_path()) == str(reference.get_path()) and \
-            str(self.target.get_path()) == str(target.get_path())
+            (self.reference_key == (str(reference.get_path()), reference.get_crop_rect())) and \
+            (self.target_key == (str(target.get_path()), target.get_crop_rect()))
+
+    def strip_rows(self, target_image):
+        """Return the number of rows of the distance map to compute in each
+        strip. If there is a 'self.memory_budget', the memory used by
+        all strips computed at the same time (one per worker) stays
+        within it. Each row of a strip costs a row of the padded
+        distance map, a row of the result of matchTemplate() before it
+        is copied into the padded map, and a row of the target image.
+        Otherwise the distance map is divided evenly among the
+        workers. The number of rows is a multiple of the window height
+        so that no tile is cut by the seam between two strips, and is
+        never less than one window height."""
+        if self.memory_budget is not None:
+            row_bytes = (2 * self.dist_map_width * np.dtype(np.float32).itemsize) + \
+                (target_image[0].size * target_image.itemsize)
+            rows = (self.memory_budget // self.workers // row_bytes) // \
+                self.window_height * self.window_height
+        else:
+            rows = math.ceil(self.dist_map_height / self.workers / self.window_height) * \
+                self.window_height
+        return max(self.window_height, int(rows))
+
+    def iterate_strips(self, target_image):
+        """Yield a 2-tuple (y0, y1) for the range of rows of the (padded)
+        distance map covered by each strip, from top to bottom."""
+        rows = self.strip_rows(target_image)
+        for y0 in range(0, self.dist_map_height, rows):
+            yield (y0, min(y0 + rows, self.dist_map_height))
+
+    def match_strip(self, target_image, reference_image, y0, y1, strip=None):
+        """Compute rows 'y0' to 'y1' of the padded distance map. Only the
+        rows of the target image that the pattern overlaps at these
+        positions are used, that is the strip of the target image
+        extended by the pattern height minus one. The result is
+        written into 'strip' which must be filled with ones, a new
+        array is allocated if it is None. Returns the strip of the
+        distance map."""
+        if strip is None:
+            strip = np.ones((y1 - y0, self.dist_map_width), dtype=np.float32)
+        else:
+            pass
+        pre_y1 = min(y1, self.pre_dist_map_height)
+        target_strip = target_image[y0 : pre_y1 + self.reference_height - 1]
+        if self.pyramid_levels > 0:
+            self.pyramid_search(target_strip, reference_image, strip, shared_key=(y0, y1))
+        else:
+            strip[0 : pre_y1 - y0, 0 : self.pre_dist_map_width] = \
+                cv.matchTemplate(target_strip, reference_image, cv.TM_SQDIFF_NORMED)
+        return strip
+
+    def strip_minima(self, target_image, reference_image, y0, y1):
+        """Compute one strip of the distance map and return the result of
+        'select_minima()' for the tiles in the strip. If the whole
+        distance map is being kept, the strip is computed in place."""
+        strip = None if self.distance_map is None else self.distance_map[y0:y1]
+        strip = self.match_strip(target_image, reference_image, y0, y1, strip)
+        (strip_x, strip_y, similarity) = \
+            tile_minima(strip, self.window_width, self.window_height)
+        tiles_per_row = self.dist_map_width // self.window_width
+        return select_minima(
+            (strip_x, strip_y + y0, similarity),
+            first_tile=(y0 // self.window_height) * tiles_per_row,
+          )
+
+    def strip_search(self, target_image, reference_image, keep_distance_map=False):
+        """Compute the distance map one strip at a time, see
+        'strip_rows()' for how the size of each strip is chosen. The
+        local minima of each strip are computed as soon as the strip
+        is computed, after which the strip is discarded unless
+        'keep_distance_map' is True. Strips begin and end on the
+        boundaries of the tiles, so each tile is searched in exactly
+        one strip and no candidate is found twice at a seam.
+
+        If 'self.workers' is greater than one, strips are computed in
+        a pool of that many threads. OpenCV and NumPy release the
+        Python interpreter lock while they compute, so the strips are
+        computed in parallel."""
+        self.distance_map = None
+        if keep_distance_map:
+            self.distance_map = np.ones(
+                (self.dist_map_height, self.dist_map_width),
+                dtype=np.float32,
+              )
+        else:
+            pass
+        strips = list(self.iterate_strips(target_image))
+        def compute(rows):
+            return self.strip_minima(target_image, reference_image, *rows)
+        if (self.workers > 1) and (len(strips) > 1):
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                minima = list(pool.map(compute, strips))
+        else:
+            minima = [compute(rows) for rows in strips]
+        # Strips are in top to bottom order, so joining the minima of
+        # each strip keeps the tiles in row-major order.
+        self.build_index(tuple(np.concatenate(column) for column in zip(*minima)))
+
+    def build_index(self, minima):
+        """Take the 4-tuple of arrays returned by 'select_minima()' for the
+        whole distance map and store it in an index sorted by
+        similarity. The index is a set of NumPy arrays all sorted by
+        similarity in ascending order: 'index_tiles' (the row-major
+        tile number), 'index_x', 'index_y', and 'index_scores'. """
+        (tiles, global_x, global_y, similarity) = minima
+        order = np.argsort(similarity, kind='stable')
+        self.index_tiles  = tiles[order]
+        self.index_x      = global_x[order]
+        self.index_y      = global_y[order]
+        self.index_scores = similarity[order]
+        self.candidates = {}
+
+    def get_index(self):
+        """Return the index built by 'build_index()' as a dictionary of
+        arrays, one for each name in INDEX_ARRAYS."""
+        return {name: getattr(self, name) for name in INDEX_ARRAYS}
+
+    def set_index(self, index):
+        """Use an index returned by 'get_index()' rather than building one."""
+        for name in INDEX_ARRAYS:
+            setattr(self, name, index[name])
+        self.candidates = {}
+
+    def cache_key(self):
+        """The key under which the index of this distance map is stored in
+        a DiskCache. It depends on everything that changes the index,
+        but not on how the computation is divided into strips, which
+        does not."""
+        return content_hash(
+            'RME', CACHE_VERSION,
+            self.target.get_content_hash(), self.target.get_crop_rect(),
+            self.reference.get_content_hash(), self.reference.get_crop_rect(),
+            self.pyramid_levels,
+            self.pyramid_threshold if self.pyramid_levels > 0 else None,
+          )
+
+    def get_candidate(self, position):
+        """Return the RMECandidate for the tile at the given 'position' in
+        the index, construct it only if it has not been constructed
+        before."""
+        tile = int(self.index_tiles[position])
+        if tile in self.candidates:
+            return self.candidates[tile]
+        else:
+            candidate = RMECandidate(
+                ( int(self.index_x[position]), int(self.index_y[position]),
+                  self.reference_width, self.reference_height,
+                ),
+                self.index_scores[position],
+                self.target,
+              )
+            self.candidates[tile] = candidate
+            return candidate
 
     def get_target(self):
         return self.target
@@ -152,8 +492,17 @@ class DistanceMap():
 
     def save_distance_map(self, file_path):
         """Write the distance map that was computed at the time this object
-        was constructed to a grayscale PNG image file.
+        was constructed to a grayscale PNG image file. If the distance
+        map was computed in strips, it must have been kept (see the
+        "keep_distance_map" argument of the constructor).
         """
+        if self.distance_map is None:
+            raise ValueError(
+                'distance map was computed in strips and not kept',
+                self.target_key,
+              )
+        else:
+            pass
         cv.imwrite(os.fspath(file_path), util.float_to_uint32(self.distance_map))
 
     def find_matching_points(self, threshold=0.95):
@@ -162,9 +511,9 @@ class DistanceMap():
         value, return an iterator that produces all regions where the
         distance map is less or equal to the complement of the
         threshold value. """
-        if threshold < 0.5:
+        if threshold < MINIMUM_THRESHOLD:
             raise ValueError(
-                "threshold {str(threshold)} too low, minimum is 0.5",
+                f"threshold {str(threshold)} too low, minimum is {MINIMUM_THRESHOLD}",
                 {"threshold": threshold},
               )
         elif threshold in self.memoized_regions:
@@ -173,52 +522,71 @@ class DistanceMap():
         else:
             pass
 
-        # We use reshape to cut the search_image up into pieces exactly
-        # equal in size to the reference image.
-        dist_map_height, dist_map_width = self.distance_map.shape
-        window_vcount = round(dist_map_height / self.window_height)
-        window_hcount = round(dist_map_width  / self.window_width)
-
-        tiles = self.distance_map.reshape(
-            window_vcount, self.window_height,
-            window_hcount, self.window_width
+        #print(f'{self.__class__.__name__}.find_matching_points(threshold={threshold}) #(searching index)')
+        # The threshold is converted to the same type as the index so
+        # that the comparison is the same as "similarity >= threshold".
+        start = np.searchsorted(
+            self.index_scores,
+            self.index_scores.dtype.type(threshold),
+            side='left',
           )
-
-        #print(f'{self.__class__.__name__}.find_matching_points(threshold={threshold}) #(searching image)')
-        results = []  # used to memoize these results
-        for y in range(window_vcount):
-            for x in range(window_hcount):
-                tile = tiles[y, :, x, :]
-                (min_y, min_x) = np.unravel_index(
-                    np.argmin(tile),
-                    (self.window_height, self.window_width),
-                  )
-                global_y = y * self.window_height + min_y
-                global_x = x * self.window_width  + min_x
-                similarity = 1.0 - tile[min_y, min_x]
-                if similarity >= threshold:
-                    results.append(
-                        RMECandidate(
-                            ( global_x, global_y,
-                              self.reference_width, self.reference_height,
-                            ),
-                            similarity,
-                            self.target
-                          ),
-                      )
-                    # RegionSize(
-                    #     global_x, global_y,
-                    #     self.reference_width, self.reference_height,
-                    #   )
-                else:
-                    pass
-
+        # Results are returned in the order of the tiles, not in the
+        # order of similarity.
+        positions = start + np.argsort(self.index_tiles[start:], kind='stable')
+        results = [self.get_candidate(position) for position in positions]
         self.memoized_regions[threshold] = results
         #print(f'{self.__class__.__name__}.find_matching_points(threshold={threshold}) #(memoized list of {len(results)} results)')
         return results
 
 #---------------------------------------------------------------------------------------------------
 
+def tile_minima(distance_map, window_width, window_height):
+    """Cut the 'distance_map' into tiles of size 'window_width' by
+    'window_height' and find the position of the minimum value within
+    every tile all at once. The 'distance_map' dimensions must be an
+    even multiple of the window size.
+
+    Returns a 3-tuple of flat NumPy arrays (global_x, global_y,
+    similarity), one element per tile, in row-major tile order (the
+    same order in which tiles would be visited by a nested loop over
+    rows then columns). The similarity is 1.0 minus the minimum
+    distance value found in each tile. When a tile contains more than
+    one minimum, the first one in row-major order within the tile is
+    chosen, as 'np.argmin()' would. """
+    (dist_map_height, dist_map_width) = distance_map.shape
+    window_vcount = round(dist_map_height / window_height)
+    window_hcount = round(dist_map_width  / window_width)
+    # We use reshape to cut the distance map up into tiles exactly
+    # equal in size to the window, then move the two window axes to
+    # the end and flatten them so a single reduction can be run over
+    # every tile.
+    tiles = distance_map \
+        .reshape(window_vcount, window_height, window_hcount, window_width) \
+        .transpose(0, 2, 1, 3) \
+        .reshape(window_vcount, window_hcount, window_height * window_width)
+    flat_index = np.argmin(tiles, axis=2)
+    minimum = np.take_along_axis(tiles, flat_index[:, :, np.newaxis], axis=2)
+    (min_y, min_x) = np.divmod(flat_index, window_width)
+    tile_y = np.arange(window_vcount, dtype=np.int64).reshape(-1, 1) * window_height
+    tile_x = np.arange(window_hcount, dtype=np.int64).reshape(1, -1) * window_width
+    global_y = (tile_y + min_y).reshape(-1)
+    global_x = (tile_x + min_x).reshape(-1)
+    similarity = 1.0 - minimum.reshape(-1)
+    return (global_x, global_y, similarity)
+
+def select_minima(minima, first_tile=0):
+    """Take the 3-tuple of arrays returned by 'tile_minima()' and keep
+    only the tiles that are at least as similar as the minimum
+    threshold value, since the others are never selected by
+    'DistanceMap.find_matching_points()'. Returns a 4-tuple of arrays
+    (tiles, global_x, global_y, similarity) where 'tiles' is the
+    row-major number of each tile kept, counting from 'first_tile'."""
+    (global_x, global_y, similarity) = minima
+    tiles = np.flatnonzero(similarity >= MINIMUM_THRESHOLD)
+    return (tiles + first_tile, global_x[tiles], global_y[tiles], similarity[tiles])
+
+#---------------------------------------------------------------------------------------------------
+
 class RMECandidate(AbstractMatchCandidate):
     """Object instances of this class contain references to candidate
     matching points in the target image."""
@@ -297,10 +665,11 @@ class RMECandidate(AbstractMatchCandidate):
                  },
               )
 
-    def crop_write_images(self, crop_rects, output_path):
+    def crop_write_images(self, crop_rects, output_path, writer=None, source=None, infos=None):
         """See documentation for AbstractMatchCandidate.crop_write_image()."""
         #print(f'{self.__class__.__name__}.crop_write_images({crop_rects!r}), {str(output_path)!r})')
         (x0, y0, _width, _height) = self.rect
+        written = {}
         for (label, rect) in crop_rects.items():
             (x_off, y_off, width, height) = rect
             image_ID = self.get_string_id(rect=(round(x0+x_off), round(y0+y_off), width, height,))
@@ -308,7 +677,12 @@ class RMECandidate(AbstractMatchCandidate):
             outpath = str(output_path).format(label=label, image_ID=image_ID)
             image = self.crop_image(relative_rect=rect)
             #print(f'{self.__class__.__name__}.crop_write_images() #(imwrite({str(outpath)!r}))')
-            cv.imwrite(outpath, image)
+            if writer is not None:
+                writer.write(outpath, image, source=source, info=None if infos is None else infos[label])
+            else:
+                cv.imwrite(outpath, image)
+            written[label] = outpath
+        return written
 
 #---------------------------------------------------------------------------------------------------
 
@@ -325,10 +699,22 @@ class RMEMatcher(AbstractMatcher):
         self.app_model = app_model
         self.distance_map = None
         self.target_matched_points = None
+        self.pyramid_levels = 0
+        self.pyramid_threshold = DEFAULT_PYRAMID_THRESHOLD
+        self.memory_budget = None
 
     def configure_to_json(self):
         threshold = self.app_model.get_threshold()
-        return {'threshold': threshold}
+        result = \
+          { 'threshold': threshold,
+            'pyramid_levels': self.pyramid_levels,
+            'pyramid_threshold': self.pyramid_threshold,
+          }
+        if self.memory_budget is not None:
+            result['memory_budget'] = self.memory_budget
+        else:
+            pass
+        return result
 
     def configure_from_json(self, config):
         if isinstance(config, dict):
@@ -339,6 +725,18 @@ class RMEMatcher(AbstractMatcher):
                         self.app_model.set_threshold(value)
                     else:
                         raise ValueError('RME algorithm config parameter "threshold" is not a number', value, config)
+                elif lkey == 'pyramid_levels':
+                    if isinstance(value, int):
+                        self.set_pyramid_levels(value)
+                    else:
+                        raise ValueError('RME algorithm config parameter "pyramid_levels" is not an integer', value, config)
+                elif lkey == 'pyramid_threshold':
+                    if isinstance(value, int) or isinstance(value, float):
+                        self.set_pyramid_threshold(value)
+                    else:
+                        raise ValueError('RME algorithm config parameter "pyramid_threshold" is not a number', value, config)
+                elif lkey == 'memory_budget':
+                    self.set_memory_budget(None if value is None else util.byte_size(value))
                 else:
                     raise ValueError('RME algorithm config, unknown parameter', key, config)
         else:
@@ -347,6 +745,53 @@ class RMEMatcher(AbstractMatcher):
     def get_reference_image(self):
         return self.app_model.get_reference()
 
+    def get_pyramid_levels(self):
+        return self.pyramid_levels
+
+    def set_pyramid_levels(self, levels):
+        """Set the number of times the images are reduced by half in size
+        for the coarse pass of the coarse-to-fine search. Set to zero
+        to compute the distance map exhaustively at full resolution. """
+        util.check_param('pyramid levels', levels, 0, 8)
+        if levels != self.pyramid_levels:
+            self.pyramid_levels = levels
+            self.distance_map = None
+        else:
+            pass
+
+    def get_pyramid_threshold(self):
+        return self.pyramid_threshold
+
+    def set_pyramid_threshold(self, threshold):
+        """Set the minimum correlation coefficient of a position in the
+        reduced-size images for the region around it to be searched at
+        full resolution. Lower values find more matches but take
+        longer. """
+        util.check_param('pyramid threshold', threshold, -1.0, 1.0)
+        if threshold != self.pyramid_threshold:
+            self.pyramid_threshold = threshold
+            self.distance_map = None
+        else:
+            pass
+
+    def get_memory_budget(self):
+        return self.memory_budget
+
+    def set_memory_budget(self, budget):
+        """Set the number of bytes of memory the distance map may use, in
+        which case it is computed in strips that fit within this
+        budget. Set to None to compute the whole distance map at
+        once. """
+        if budget is not None:
+            util.check_param('memory budget', budget, 1, float('inf'))
+        else:
+            pass
+        if budget != self.memory_budget:
+            self.memory_budget = budget
+            self.distance_map = None
+        else:
+            pass
+
     def set_reference_image(self, reference):
         """Does not need to do anything, the reference is taken from self.app_model on demand."""
         pass
@@ -387,7 +832,15 @@ class RMEMatcher(AbstractMatcher):
         reference.assert_parameter('Pattern image')
         target.assert_parameter('Input image')
         self._update_inputs(target, reference)
-        self.distance_map = DistanceMap(target, reference, suffix)
+        self.distance_map = DistanceMap(
+            target, reference, suffix,
+            pyramid_levels=self.pyramid_levels,
+            pyramid_threshold=self.pyramid_threshold,
+            memory_budget=self.memory_budget,
+            keep_distance_map=self.app_model.save_distance_map,
+            workers=self.app_model.get_threads(),
+            cache=self.app_model.get_disk_cache(),
+          )
         if progress is not None:
             progress.update_progress(1)
         else:
@@ -397,12 +850,60 @@ class RMEMatcher(AbstractMatcher):
             self.distance_map.find_matching_points(threshold),
           )
 
+    def match_patterns(self, patterns, image_loader, progress=None):
+        """Match every pattern in a PatternLibrary against a single target
+        image. The 'patterns' argument is the list of LabelledPatterns
+        returned by 'PatternLibrary.load_images()'. The target image is
+        loaded once and each DistanceMap is constructed with the same
+        'shared' dictionary so that work done on the target image alone
+        (such as reducing it for the pyramid search) is only done once
+        per target. Returns a list of 2-tuples (pattern, candidates) in
+        the order of the 'patterns'."""
+        image_loader.load_image()
+        image_loader.assert_parameter('Input image')
+        suffix = self.app_model.get_file_encoding()
+        default_threshold = self.app_model.get_threshold()
+        shared = {}
+        results = []
+        for pattern in patterns:
+            reference = pattern.get_reference_image()
+            reference.assert_parameter(f'Pattern image {pattern.get_label()!r}')
+            distance_map = DistanceMap(
+                image_loader, reference, suffix,
+                pyramid_levels=self.pyramid_levels,
+                pyramid_threshold=self.pyramid_threshold,
+                shared=shared,
+                memory_budget=self.memory_budget,
+                workers=self.app_model.get_threads(),
+                cache=self.app_model.get_disk_cache(),
+              )
+            threshold = pattern.get_threshold(default_threshold)
+            results.append((pattern, distance_map.find_matching_points(threshold)))
+        if progress is not None:
+            progress.update_progress(1)
+        else:
+            pass
+        return results
+
     def get_matched_points(self):
         """See documentation for DataPrepKit.AbstractMatcher.get_matched_points()."""
         return AbstractMatcher.get_matched_points(self)
 
-    def set_threshold(self, _threshold):
-        return self.match_on_file()
+    def set_threshold(self, threshold):
+        """If the distance map has already been computed for the current
+        target and reference images, only the index of the distance
+        map is searched for the points matching the new threshold,
+        otherwise the whole match is computed with 'match_on_file()'."""
+        reference = self.app_model.get_reference_image()
+        target = self.app_model.get_target_image()
+        if (self.distance_map is not None) and \
+          self.distance_map.same_inputs(reference, target):
+            return AbstractMatcher._update_matched_points(
+                self,
+                self.distance_map.find_matching_points(threshold),
+              )
+        else:
+            return self.match_on_file()
 
     def save_calculations(self):
         """See documentation for DataPrepKit.AbstractMatcher.save_calculations."""
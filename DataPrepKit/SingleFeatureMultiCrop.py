@@ -2,8 +2,23 @@ import DataPrepKit.FileSet as fs
 from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
 from DataPrepKit.RMEMatcher import RMEMatcher
 from DataPrepKit.ORBMatcher import ORBMatcher
+from DataPrepKit.PatternLibrary import PatternLibrary
+from DataPrepKit.DiskCache import DiskCache
+from DataPrepKit.ImagePrefetcher import ImagePrefetcher, DEFAULT_PREFETCH_BUDGET
+from DataPrepKit.ImageWriter import ImageWriter
+from DataPrepKit.BatchManifest import BatchManifest, file_fingerprint
+from DataPrepKit.DiskCache import content_hash
+from DataPrepKit.MatchRecords import MatchRecordFile, match_record, record_format
+from DataPrepKit.Annotations import AnnotationWriter, annotation_format, category_name
+from DataPrepKit.TarShards import TarShardWriter
+from DataPrepKit.ArrayDataset import ArrayDatasetWriter
+from DataPrepKit.ImageCache import image_cache
 from pathlib import Path, PurePath
 import DataPrepKit.utilities as util
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import multiprocessing
 import sys
 import traceback
 import json
@@ -22,6 +37,129 @@ def algorithm_name(name, get_constr=False):
 
 #---------------------------------------------------------------------------------------------------
 
+BATCH_CONFIG_IGNORED = \
+  [ 'output_directory', 'input_images', 'threads', 'jobs', 'prefetch_budget',
+    'cache_directory', 'cache_size', 'image_cache_size', 'manifest', 'manifest_hash',
+    'match_records',
+  ]
+  # The parameters of 'configure_to_json()' that do not change which
+  # files a batch writes, see 'batch_config_hash()'.
+
+BATCH_ALGORITHM_CONFIG_IGNORED = ['memory_budget', 'threads']
+  # The parameters of each algorithm in the "algorithms" parameter that
+  # only change how fast or in how much memory an image is searched,
+  # not which regions are found, see 'batch_config_hash()'.
+
+BATCH_JOBS_AHEAD = 2
+  # The number of images per job that a batch submits to the pool of
+  # processes ahead of the image whose result is being written.
+
+class BatchResult():
+    """The result of searching one target image of a batch, see
+    'SingleFeatureMultiCrop.batch_crop_result()'. The last three fields
+    are only set by a batch worker process, where the images are
+    written before the result is sent to the parent process."""
+
+    def __init__(self, error, records, size):
+        self.error = error
+          # None if the image was searched, or a string describing why
+          # it failed.
+        self.records = records
+          # The list of match records of the regions cropped, or None if
+          # records are not being collected.
+        self.size = size
+          # The (width, height) of the whole image, or None if it could
+          # not be loaded.
+        self.write_errors = []
+          # The 3-tuples (source, path, error) returned by
+          # 'ImageWriter.flush()'.
+        self.written = None
+          # The list of paths of the files written.
+        self.sink_files = None
+          # The 3-tuples (path, data, info) to pass to the sink of the
+          # parent process, if there is one.
+
+class BatchOutputs():
+    """Everything a batch writes other than the cropped images, and the
+    errors collected while writing, see
+    'SingleFeatureMultiCrop.open_batch_outputs()'."""
+
+    def __init__(self, images, output_dir):
+        self.images = images
+        self.output_dir = output_dir
+        self.manifest = None
+        self.fingerprints = None
+          # The fingerprint of each image in 'images' when the
+          # 'manifest' is used.
+        self.record_file = None
+        self.annotations = None
+        self.sink_writer = None
+          # The TarShardWriter or ArrayDatasetWriter that the images are
+          # written to instead of files, if any.
+        self.offset = (0, 0)
+          # The corner of the crop rectangle of the target images.
+        self.recorded = 0
+          # The number of images whose match records were passed to the
+          # 'record_file'.
+        self.errors = []
+          # The 2-tuples (image, message) of the images that failed.
+        self.write_errors = []
+          # The 3-tuples (source, path, message) of the files that
+          # could not be written.
+
+batch_worker = None
+  # In a batch worker process, the 3-tuple (app_model, patterns,
+  # sink_files) used to search each target image, see
+  # 'batch_worker_init()'.
+
+def bounded_map(pool, function, window, *iterables):
+    """Like 'pool.map()', but yields the results in order while keeping at
+    most 'window' calls submitted and not yet yielded, so the results
+    that are done but not yet consumed, which may hold every image
+    cropped from a target image, never take more than that many."""
+    pending = deque()
+    for args in zip(*iterables):
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        else:
+            pass
+        pending.append(pool.submit(function, *args))
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+def batch_worker_init(state):
+    global batch_worker
+    app_model = SingleFeatureMultiCrop.from_batch_state(state)
+    if state['sink'] is not None:
+        # Images are sent to the parent process, which writes them into
+        # the tar shards or the arrays.
+        sink_files = []
+        app_model.image_writer = ImageWriter(
+            sink=lambda path, data, info: sink_files.append((path, data, info)),
+            raw=(state['sink'] == 'raw'),
+          )
+    else:
+        sink_files = None
+        app_model.image_writer = ImageWriter()
+    batch_worker = (app_model, app_model.prepare_batch(), sink_files)
+
+def batch_worker_crop_file(image, output_dir):
+    """Search one target image in a batch worker process, and write its
+    matched regions before returning its BatchResult."""
+    (app_model, patterns, sink_files) = batch_worker
+    result = app_model.batch_crop_result(image, output_dir, patterns)
+    result.written = []
+    app_model.image_writer.after_writes(image, lambda paths, _errors: result.written.extend(paths))
+    result.write_errors = app_model.image_writer.flush()
+    if sink_files is not None:
+        result.sink_files = list(sink_files)
+        sink_files.clear()
+    else:
+        pass
+    return result
+
+#---------------------------------------------------------------------------------------------------
+
 class SingleFeatureMultiCrop():
     """This object is used to configure all of the parameters for the
     pattern matching computation. You can configure the computation by
@@ -32,7 +170,7 @@ class SingleFeatureMultiCrop():
     """
 
     def __init__(self, cli_config=None):
-        self.config_file_path = cli_config.config_file_path
+        self.config_file_path = cli_config.config_file_path if cli_config is not None else None
         self.feature_region = None
         self.crop_regions = {}
         self.file_encoding = 'png'
@@ -44,7 +182,23 @@ class SingleFeatureMultiCrop():
         self.target_matched_points = []
         self.target_image = CachedCVImageLoader()
         self.reference_image = CachedCVImageLoader()
+        self.pattern_library = PatternLibrary()
         self.threshold = 0.92
+        self.threads = 1
+        self.jobs = 1
+        self.prefetch_budget = DEFAULT_PREFETCH_BUDGET
+        self.image_writer = None
+        self.manifest = False
+        self.manifest_hash = False
+        self.match_records_path = None
+        self.match_records = None
+        self.annotations = None
+        self.batch_annotations = False
+        self.tar_shards = None
+        self.array_dataset = False
+        self.overlap_ok = False
+        self.disk_cache = None
+        self.image_cache_size = None
         self.rme_matcher = RMEMatcher(self)
         self.orb_matcher = ORBMatcher(self)
         self.algorithm = None
@@ -87,6 +241,64 @@ class SingleFeatureMultiCrop():
             self.crop_regions = config.crop_regions_json
         else:
             pass
+        if config.pyramid_levels is not None:
+            self.rme_matcher.set_pyramid_levels(config.pyramid_levels)
+        else:
+            pass
+        if config.memory_budget is not None:
+            self.rme_matcher.set_memory_budget(config.memory_budget)
+        else:
+            pass
+        if config.threads is not None:
+            self.set_threads(config.threads)
+        else:
+            pass
+        if config.jobs is not None:
+            self.set_jobs(config.jobs)
+        else:
+            pass
+        if config.prefetch_budget is not None:
+            self.set_prefetch_budget(config.prefetch_budget)
+        else:
+            pass
+        if config.overlap_ok:
+            self.set_overlap_ok(True)
+        else:
+            pass
+        if config.manifest:
+            self.set_manifest(True)
+        else:
+            pass
+        if config.manifest_hash:
+            self.set_manifest(True, content_hash=True)
+        else:
+            pass
+        if config.match_records is not None:
+            self.set_match_records(config.match_records)
+        else:
+            pass
+        if config.annotations is not None:
+            self.set_annotations(config.annotations)
+        else:
+            pass
+        if config.tar_shards is not None:
+            self.set_tar_shards(config.tar_shards)
+        else:
+            pass
+        if config.array_dataset:
+            self.set_array_dataset(True)
+        else:
+            pass
+        if config.cache_dir is not None:
+            self.set_disk_cache(config.cache_dir, config.cache_size)
+        elif config.cache_size is not None:
+            self.set_disk_cache_size(config.cache_size)
+        else:
+            pass
+        if config.image_cache_size is not None:
+            self.set_image_cache_size(config.image_cache_size)
+        else:
+            pass
         self.set_algorithm(str(config.algorithm).upper())
 
     def set_default_config_file(self, path):
@@ -145,7 +357,7 @@ class SingleFeatureMultiCrop():
             #   "algorithms":
             #    {"use_algorithm": "ORB",
             #     "ORB": {... ORB parameters ...},
-            #     "RME": { "threshold":92.0 }
+            #     "RME": { "threshold":92.0, "pyramid_levels":0, "memory_budget":"512M" }
             #    },
             #   ...: ...
             # }
@@ -189,6 +401,93 @@ class SingleFeatureMultiCrop():
             self.set_crop_regions(regions)
         else:
             pass
+        if 'patterns' in json_config:
+            # A list of labelled patterns, each with its own reference
+            # image, feature region, crop regions, and threshold:
+            # "patterns":
+            #  [ {"label": "...", "reference_image": "...",
+            #     "feature_region": [x,y,w,h], "crop_regions": {...},
+            #     "threshold": 0.92},
+            #    ...
+            #  ]
+            self.pattern_library.configure_from_json(json_config['patterns'])
+        else:
+            pass
+        if 'threads' in json_config:
+            threads = json_config['threads']
+            if isinstance(threads, int):
+                self.set_threads(threads)
+            else:
+                raise ValueError('config file "threads" parameter must be an integer', threads)
+        else:
+            pass
+        if 'jobs' in json_config:
+            jobs = json_config['jobs']
+            if isinstance(jobs, int):
+                self.set_jobs(jobs)
+            else:
+                raise ValueError('config file "jobs" parameter must be an integer', jobs)
+        else:
+            pass
+        if 'prefetch_budget' in json_config:
+            self.set_prefetch_budget(json_config['prefetch_budget'])
+        else:
+            pass
+        if 'overlap_ok' in json_config:
+            overlap_ok = json_config['overlap_ok']
+            if isinstance(overlap_ok, bool):
+                self.set_overlap_ok(overlap_ok)
+            else:
+                raise ValueError('config file "overlap_ok" parameter must be true or false', overlap_ok)
+        else:
+            pass
+        if 'manifest' in json_config:
+            manifest = json_config['manifest']
+            if isinstance(manifest, bool):
+                self.set_manifest(manifest, content_hash=self.manifest_hash)
+            else:
+                raise ValueError('config file "manifest" parameter must be true or false', manifest)
+        else:
+            pass
+        if 'manifest_hash' in json_config:
+            manifest_hash = json_config['manifest_hash']
+            if isinstance(manifest_hash, bool):
+                self.set_manifest(self.manifest or manifest_hash, content_hash=manifest_hash)
+            else:
+                raise ValueError('config file "manifest_hash" parameter must be true or false', manifest_hash)
+        else:
+            pass
+        if 'match_records' in json_config:
+            match_records = json_config['match_records']
+            if (match_records is None) or isinstance(match_records, str):
+                self.set_match_records(match_records)
+            else:
+                raise ValueError('config file "match_records" parameter must be a file path', match_records)
+        else:
+            pass
+        if 'annotations' in json_config:
+            self.set_annotations(json_config['annotations'])
+        else:
+            pass
+        if 'tar_shards' in json_config:
+            self.set_tar_shards(json_config['tar_shards'])
+        else:
+            pass
+        if 'array_dataset' in json_config:
+            self.set_array_dataset(json_config['array_dataset'])
+        else:
+            pass
+        if 'cache_directory' in json_config:
+            self.set_disk_cache(
+                json_config['cache_directory'],
+                json_config.get('cache_size', None),
+              )
+        else:
+            pass
+        if 'image_cache_size' in json_config:
+            self.set_image_cache_size(json_config['image_cache_size'])
+        else:
+            pass
         if 'input_images' in json_config:
             inputs = json_config['input_images']
             fileset = self.get_target_fileset()
@@ -218,7 +517,7 @@ class SingleFeatureMultiCrop():
         if value is not None:
             value = value.get_path()
             if value is not None:
-                result['reference_image'] = value
+                result['reference_image'] = str(value)
             else:
                 pass
         else:
@@ -230,10 +529,51 @@ class SingleFeatureMultiCrop():
             pass
         value = self.get_crop_regions()
         if value is not None:
-            value = { k: util.rect_to_list(v) for k,v in value }
+            value = { k: util.rect_to_list(v) for k,v in value.items() }
             result['crop_regions'] = value
         else:
             pass
+        value = self.get_pattern_library()
+        if len(value) > 0:
+            result['patterns'] = value.configure_to_json()
+        else:
+            pass
+        result['threads'] = self.get_threads()
+        result['jobs'] = self.get_jobs()
+        result['prefetch_budget'] = self.get_prefetch_budget()
+        result['overlap_ok'] = self.get_overlap_ok()
+        result['manifest'] = self.get_manifest()
+        result['manifest_hash'] = self.manifest_hash
+        value = self.get_match_records()
+        if value is not None:
+            result['match_records'] = str(value)
+        else:
+            pass
+        value = self.get_annotations()
+        if value is not None:
+            result['annotations'] = value
+        else:
+            pass
+        value = self.get_tar_shards()
+        if value is not None:
+            result['tar_shards'] = value
+        else:
+            pass
+        if self.get_array_dataset():
+            result['array_dataset'] = True
+        else:
+            pass
+        value = self.get_disk_cache()
+        if value is not None:
+            result['cache_directory'] = str(value.get_directory())
+            result['cache_size'] = value.get_max_bytes()
+        else:
+            pass
+        value = self.get_image_cache_size()
+        if value is not None:
+            result['image_cache_size'] = value
+        else:
+            pass
         value = self.get_target_fileset()
         if (value is not None) or (len(value) > 0):
             result['input_images'] = list(iter(value))
@@ -309,6 +649,188 @@ class SingleFeatureMultiCrop():
             else:
                 return None
 
+    def get_threads(self):
+        return self.threads
+
+    def set_threads(self, threads):
+        """Set the number of threads the pattern matching algorithms may
+        use to search a single target image."""
+        util.check_param('threads', threads, 1, 1024)
+        self.threads = threads
+
+    def get_jobs(self):
+        return self.jobs
+
+    def set_jobs(self, jobs):
+        """Set the number of processes that search the target images of a
+        batch at the same time, see 'batch_crop_matched_patterns()'."""
+        util.check_param('jobs', jobs, 1, 1024)
+        self.jobs = jobs
+
+    def get_prefetch_budget(self):
+        return self.prefetch_budget
+
+    def set_prefetch_budget(self, budget):
+        """Set the number of bytes of decoded target images that may be
+        loaded ahead of the one being searched in a batch, see
+        'DataPrepKit.ImagePrefetcher'."""
+        self.prefetch_budget = util.byte_size(budget)
+
+    def get_overlap_ok(self):
+        return self.overlap_ok
+
+    def set_overlap_ok(self, overlap_ok):
+        """If False (the default), matched regions that overlap a more
+        similar matched region are not saved."""
+        self.overlap_ok = overlap_ok
+
+    def get_manifest(self):
+        return self.manifest
+
+    def set_manifest(self, manifest, content_hash=False):
+        """If True, a batch records each input image it searches in a
+        DataPrepKit.BatchManifest in the output directory, and skips the
+        input images recorded by an earlier batch that have not changed
+        since, as long as the configuration is the same. Input images
+        are compared by size and modification time, and also by a hash
+        of their content if 'content_hash' is True."""
+        self.manifest = manifest
+        self.manifest_hash = content_hash
+
+    def get_match_records(self):
+        return self.match_records_path
+
+    def set_match_records(self, path):
+        """Set the path of a file to which a batch writes one record for
+        each region it crops, see DataPrepKit.MatchRecords. The suffix
+        of the path, ".jsonl" or ".csv", selects the format. Set to None
+        to not write match records."""
+        if path is None:
+            self.match_records_path = None
+        else:
+            record_format(path)
+            self.match_records_path = Path(path)
+
+    def get_annotations(self):
+        return self.annotations
+
+    def set_annotations(self, format):
+        """Set the format, "coco" or "yolo", of the annotations a batch
+        writes into the output directory instead of cropping the matched
+        regions into image files, see DataPrepKit.Annotations. Set to
+        None to write image files."""
+        self.annotations = None if format is None else annotation_format(format)
+
+    def batch_writes_files(self):
+        """False when the images cropped during a batch are not written as
+        separate files, so no sub-directories need to be created."""
+        return not self.batch_annotations and \
+          ((self.image_writer is None) or (self.image_writer.sink is None))
+
+    def get_tar_shards(self):
+        return self.tar_shards
+
+    def set_tar_shards(self, max_bytes):
+        """Set the maximum size in bytes of the tar archives into which a
+        batch writes the matched regions, rather than writing each one
+        as a separate file, see DataPrepKit.TarShards. Set to None to
+        write separate files."""
+        self.tar_shards = None if max_bytes is None else util.byte_size(max_bytes)
+
+    def get_array_dataset(self):
+        return self.array_dataset
+
+    def set_array_dataset(self, boolean):
+        """If True, a batch appends the matched regions to one array per crop
+        region, rather than writing each one as a separate file, see
+        DataPrepKit.ArrayDataset."""
+        self.array_dataset = bool(boolean)
+
+    def annotation_categories(self):
+        """Return the category names of every kind of region that can be
+        matched, in the order they are numbered in the annotations."""
+        if len(self.pattern_library) > 0:
+            return \
+              [ category_name(pattern.get_label(), label) \
+                for pattern in self.pattern_library \
+                for label in (pattern.get_crop_regions() or {'': None}) \
+              ]
+        else:
+            return [category_name('', label) for label in (self.crop_regions or {'': None})]
+
+    def batch_config_hash(self):
+        """Return a hash of every parameter that changes which files a
+        batch writes, used to decide whether an input image recorded in
+        the manifest must be searched again. The reference images are
+        included by their size and modification time."""
+        config = self.configure_to_json()
+        for key in BATCH_CONFIG_IGNORED:
+            config.pop(key, None)
+        for algorithm_config in config.get('algorithms', {}).values():
+            if isinstance(algorithm_config, dict):
+                for key in BATCH_ALGORITHM_CONFIG_IGNORED:
+                    algorithm_config.pop(key, None)
+            else:
+                pass
+        references = [self.reference_image.get_path()] + \
+            [pattern.get_reference_image().get_path() for pattern in self.pattern_library]
+        references = \
+          [ (str(path), file_fingerprint(path)) \
+            for path in references if path is not None \
+          ]
+        return content_hash(
+            json.dumps(config, sort_keys=True),
+            references,
+            self.threshold,
+            self.file_encoding,
+            self.save_distance_map,
+          )
+
+    def select_candidates(self, matcher, match_item_list):
+        """Return the candidates in 'match_item_list' that should be saved,
+        that is all of them if overlapping regions are allowed, or
+        otherwise only those that do not overlap a more similar
+        candidate."""
+        if self.overlap_ok:
+            return match_item_list
+        else:
+            return matcher.suppress_overlaps(match_item_list)
+
+    def get_disk_cache(self):
+        return self.disk_cache
+
+    def set_disk_cache(self, directory, max_bytes=None):
+        """Store the results of pattern matching in the given directory so
+        that they do not need to be computed again for the same
+        images. The least recently used results are deleted when the
+        directory holds more than 'max_bytes'. Set 'directory' to None
+        to not use a cache."""
+        if directory is None:
+            self.disk_cache = None
+        elif max_bytes is None:
+            self.disk_cache = DiskCache(directory)
+        else:
+            self.disk_cache = DiskCache(directory, max_bytes)
+
+    def set_disk_cache_size(self, max_bytes):
+        if self.disk_cache is not None:
+            self.set_disk_cache(self.disk_cache.get_directory(), max_bytes)
+        else:
+            raise ValueError('cache size given but no cache directory')
+
+    def get_image_cache_size(self):
+        return self.image_cache_size
+
+    def set_image_cache_size(self, max_bytes):
+        """Set the maximum number of bytes of decoded images kept in memory
+        by the DataPrepKit.ImageCache.image_cache, which is shared by
+        the whole process. Set to None to leave it unchanged."""
+        if max_bytes is None:
+            self.image_cache_size = None
+        else:
+            self.image_cache_size = util.byte_size(max_bytes)
+            image_cache.set_max_bytes(self.image_cache_size)
+
     def get_file_encoding(self):
         return self.file_encoding
 
@@ -363,6 +885,9 @@ class SingleFeatureMultiCrop():
         else:
             pass
 
+    def get_pattern_library(self):
+        return self.pattern_library
+
     def get_output_dir(self):
         return self.output_dir
 
@@ -540,7 +1065,10 @@ class SingleFeatureMultiCrop():
 
     def save_selected(self, target_image=None, crop_regions=None, output_dir=None):
         #print(f'{self.__class__.__name__}.save_selected()')
-        match_item_list = self.algorithm.match_on_file(image_loader=target_image)
+        match_item_list = self.select_candidates(
+            self.algorithm,
+            self.algorithm.match_on_file(image_loader=target_image),
+          )
         #print(f'{self.__class__.__name__}.save_selected() #(match_on_file() -> {len(match_item_list)} matches)')
         #for (i, pt) in zip(range(0,len(match_item_list)), match_item_list):
         #    print(f'    {i}: {pt}')
@@ -548,11 +1076,11 @@ class SingleFeatureMultiCrop():
         target_image = self.target_image if target_image is None else target_image
         output_dir = self.get_output_dir() if output_dir is None else output_dir
         if not output_dir.is_dir():
-            self.output_dir.mkdir(parents=True, exist_ok=True)
+            output_dir.mkdir(parents=True, exist_ok=True)
         else:
             pass
         crop_regions = self.get_crop_regions() if crop_regions is None else crop_regions
-        if crop_regions is not None:
+        if (crop_regions is not None) and self.batch_writes_files():
             for key in crop_regions.keys():
                 output_subdir = output_dir / Path(key)
                 if not output_subdir.is_dir():
@@ -565,8 +1093,31 @@ class SingleFeatureMultiCrop():
             self.algorithm.save_calculation(target_image)
         else:
             pass
-        #print(f'{self.__class__.__name__}.save_selected() #({len(match_item_list)} matches, output_dir = {str(output_dir)!r})')
-        target_image_path = target_image.get_path()
+        self.write_match_crops(
+            match_item_list,
+            target_image.get_path(),
+            self.reference_image.get_crop_rect(),
+            crop_regions,
+            output_dir,
+          )
+
+    def write_match_crops(self, match_item_list, target_image_path, feature_region, crop_regions, output_dir, pattern=''):
+        """Write the regions of the target image selected by each item of
+        'match_item_list' into 'output_dir'. If 'crop_regions' is None
+        or empty, the 'feature_region' is written directly into
+        'output_dir', otherwise each crop region is written into a
+        sub-directory of 'output_dir' named after the crop region's
+        label. The sub-directories must already exist.
+
+        During a batch, the images are written by the 'image_writer',
+        which also collects any errors, otherwise they are written
+        before this method returns and errors are printed. If the
+        'match_records' are enabled, a record is appended to them for
+        each region written, labeled with the given 'pattern'. When the
+        batch writes annotations, no image files are written, but the
+        records are still appended."""
+        writer = self.image_writer
+        #print(f'{self.__class__.__name__}.write_match_crops() #({len(match_item_list)} matches, output_dir = {str(output_dir)!r})')
         for match_item in match_item_list:
             # Here we make use of the "iterate_crop_regions()" method
             # inherited from the "SingleFeatureMultiCrop" class.
@@ -574,39 +1125,237 @@ class SingleFeatureMultiCrop():
             suffix = self.get_file_encoding()
             suffix = target_image_path.suffix \
                 if (suffix == '(same)') or (suffix is None) else f'.{suffix}'
-            #print(f'{self.__class__.__name__}.save_selected() #({type(match_item)} -> {match_item.get_string_id()})')
+            #print(f'{self.__class__.__name__}.write_match_crops() #({type(match_item)} -> {match_item.get_string_id()})')
             try:
                 if (crop_regions is None) or (len(crop_regions) == 0):
                     output_path = output_dir / PurePath(
                         target_image_path.stem + '_{image_ID}' + suffix
                       )
-                    feature_region = self.reference_image.get_crop_rect()
-                    #print(f'{self.__class__.__name__}.save_selected() #(output_dir = {str(output_path)!r})')
-                    match_item.crop_write_images({'': feature_region}, str(output_path))
+                    #print(f'{self.__class__.__name__}.write_match_crops() #(output_dir = {str(output_path)!r})')
+                    rects = {'': feature_region}
                 else:
                     output_path = output_dir / PurePath('{label}') / PurePath(
                         target_image_path.stem + '_{image_ID}' + suffix
                       )
-                    #print(f'{self.__class__.__name__}.save_selected() #(output_dir = {str(output_path)!r})')
-                    match_item.crop_write_images(crop_regions, str(output_path))
-            except OSError as err:
-                traceback.print_exception(err)
-            except ValueError as err:
-                traceback.print_exception(err)
+                    #print(f'{self.__class__.__name__}.write_match_crops() #(output_dir = {str(output_path)!r})')
+                    rects = crop_regions
+                if (self.match_records is not None) or ((writer is not None) and (writer.sink is not None)):
+                    records = \
+                      { label: match_record(target_image_path, pattern, label, match_item, rect, None) \
+                        for (label, rect) in rects.items() \
+                      }
+                else:
+                    records = None
+                if self.batch_annotations:
+                    written = {label: None for label in rects}
+                else:
+                    # A writer with a sink describes each image with its
+                    # record, for example in the index of a tar shard.
+                    written = match_item.crop_write_images(
+                        rects, str(output_path),
+                        writer=writer, source=target_image_path,
+                        infos=None if records is None else \
+                          { label: {key: value for (key, value) in record.items() if key != 'output'} \
+                            for (label, record) in records.items() \
+                          },
+                      )
+                if self.match_records is not None:
+                    for (label, path) in written.items():
+                        records[label]['output'] = path
+                        self.match_records.append(records[label])
+                else:
+                    pass
+            except (OSError, ValueError) as err:
+                if writer is not None:
+                    writer.report(target_image_path, str(output_path), str(err))
+                else:
+                    traceback.print_exception(err)
+
+    def save_pattern_matches(self, target_image, output_dir=None, patterns=None):
+        """Search for every pattern in the pattern library in the given
+        'target_image' and write the matching regions for each pattern
+        into a sub-directory of 'output_dir' named after the pattern's
+        label, that is 'output_dir/<pattern>/' if the pattern has no
+        crop regions, or 'output_dir/<pattern>/<crop region>/'
+        otherwise. Crop regions of a pattern are given in the
+        coordinates of its reference image, just like the feature
+        region. Pass the 'patterns' returned by
+        'PatternLibrary.load_images()' to avoid loading them again for
+        every target image."""
+        output_dir = self.get_output_dir() if output_dir is None else output_dir
+        if patterns is None:
+            patterns = self.pattern_library.load_images()
+        else:
+            pass
+        results = self.rme_matcher.match_patterns(patterns, target_image)
+        for (pattern, match_item_list) in results:
+            match_item_list = self.select_candidates(self.rme_matcher, match_item_list)
+            pattern_dir = output_dir / PurePath(pattern.get_label())
+            (width, height) = pattern.get_size()
+            (x0, y0, _width, _height) = pattern.get_feature_region() \
+                if pattern.get_feature_region() is not None else (0, 0, width, height)
+            crop_regions = \
+              { label: (x - x0, y - y0, w, h) \
+                for (label, (x, y, w, h)) in pattern.get_crop_regions().items() \
+              }
+            for subdir in [pattern_dir] + [pattern_dir / Path(key) for key in crop_regions.keys()]:
+                if not self.batch_writes_files():
+                    pass
+                elif not subdir.is_dir():
+                    subdir.mkdir(parents=True, exist_ok=True)
+                else:
+                    pass
+            self.write_match_crops(
+                match_item_list,
+                target_image.get_path(),
+                (0, 0, width, height),
+                crop_regions,
+                pattern_dir,
+                pattern=pattern.get_label(),
+              )
 
     def crop_matched_references(self, target_image_path=None, output_dir=None):
+        """Search a target image and save the matched regions. The
+        'target_image_path' may also be a CachedCVImageLoader, for
+        example one that was loaded ahead of time by an
+        ImagePrefetcher."""
         # Create results directory if it does not exist
         #print(f'{self.__class__.__name__}.crop_matched_references({target_image_path!r}) #(after clean-up self.crop_regions)')
         target_image = None
         if target_image_path is None:
             target_image = self.target
+        elif isinstance(target_image_path, CachedCVImageLoader):
+            target_image = target_image_path
         else:
             target_image = CachedCVImageLoader(
                 path=target_image_path,
                 crop_rect=self.target.get_crop_rect(),
               )
         #self.print_state()
-        self.save_selected(target_image, output_dir)
+        self.save_selected(target_image, output_dir=output_dir)
+
+    def prepare_batch(self):
+        """Load everything that is used to search every target image of a
+        batch, so that it is done only once. Returns the patterns to
+        pass to 'save_pattern_matches()' when a pattern library is
+        configured, or None otherwise."""
+        # When a pattern library is configured, every pattern in the
+        # library is matched against each target image, and each
+        # target image is loaded only once for all patterns.
+        if len(self.pattern_library) > 0:
+            if self.algorithm is not self.rme_matcher:
+                raise ValueError('"patterns" can only be matched with the RME algorithm')
+            else:
+                pass
+            return self.pattern_library.load_images()
+        else:
+            self.reference_image.load_image(crop_rect=self.feature_region)
+            if self.algorithm is self.orb_matcher:
+                self.orb_matcher.update_reference_image(self.reference_image)
+            else:
+                pass
+            return None
+
+    def batch_crop_file(self, image, output_dir, patterns):
+        """Search a single target 'image' of a batch, either a path or a
+        CachedCVImageLoader, and save the matched regions. Returns None
+        if it succeeds, or a string describing the error if it fails,
+        so that one bad file does not stop the rest of the batch."""
+        try:
+            if isinstance(image, CachedCVImageLoader):
+                target_image = image
+            else:
+                target_image = CachedCVImageLoader(path=image, crop_rect=self.target.get_crop_rect(), cache=False)
+            if patterns is not None:
+                self.save_pattern_matches(target_image, output_dir, patterns)
+            else:
+                self.crop_matched_references(target_image, output_dir)
+            return None
+        except Exception as err:
+            return ''.join(traceback.format_exception_only(err)).strip()
+
+    def batch_crop_result(self, image, output_dir, patterns):
+        """Like 'batch_crop_file()', but returns a BatchResult with the error,
+        the match records of the image if 'match_records' are being
+        collected, and the size of the image."""
+        if isinstance(image, CachedCVImageLoader):
+            target_image = image
+        else:
+            target_image = CachedCVImageLoader(path=image, crop_rect=self.target.get_crop_rect(), cache=False)
+        error = self.batch_crop_file(target_image, output_dir, patterns)
+        records = self.match_records
+        if records is not None:
+            self.match_records = []
+        else:
+            pass
+        raw_image = target_image.get_raw_image()
+        size = None if raw_image is None else (raw_image.shape[1], raw_image.shape[0])
+        return BatchResult(error, records, size)
+
+    def batch_state(self):
+        """Return a dictionary of every parameter used by
+        'batch_crop_file()', which can be sent to another process to
+        construct an identical SingleFeatureMultiCrop object with
+        'from_batch_state()'. Images, and anything computed from them,
+        are not included."""
+        disk_cache = self.get_disk_cache()
+        return \
+          { 'algorithm': 'RME' if self.algorithm is self.rme_matcher else 'ORB',
+            'orb_config': self.orb_matcher.get_orb_config(),
+            'rme_config': self.rme_matcher.configure_to_json(),
+            'threshold': self.threshold,
+            'threads': self.threads,
+            'overlap_ok': self.overlap_ok,
+            'file_encoding': self.file_encoding,
+            'save_distance_map': self.save_distance_map,
+            'output_dir': self.output_dir,
+            'reference_image': self.reference_image.get_path(),
+            'feature_region': self.feature_region,
+            'target_crop_rect': self.target.crop_rect,
+            'crop_regions': dict(self.crop_regions),
+            'patterns': self.pattern_library.configure_to_json(),
+            'cache_directory': None if disk_cache is None else disk_cache.get_directory(),
+            'cache_size': None if disk_cache is None else disk_cache.get_max_bytes(),
+            'image_cache_size': self.image_cache_size,
+            'match_records': (self.match_records_path is not None) or (self.annotations is not None),
+            'annotations': self.annotations is not None,
+            'sink': \
+              'raw' if self.array_dataset else \
+              'encoded' if self.tar_shards is not None else \
+              None,
+          }
+
+    @staticmethod
+    def from_batch_state(state):
+        """The inverse of 'batch_state()'."""
+        app_model = SingleFeatureMultiCrop()
+        app_model.set_algorithm(state['algorithm'])
+        app_model.orb_matcher.set_orb_config(state['orb_config'])
+        app_model.rme_matcher.configure_from_json(state['rme_config'])
+        app_model.threshold = state['threshold']
+        app_model.threads = state['threads']
+        app_model.overlap_ok = state['overlap_ok']
+        app_model.file_encoding = state['file_encoding']
+        app_model.save_distance_map = state['save_distance_map']
+        app_model.output_dir = state['output_dir']
+        app_model.reference_image = CachedCVImageLoader(path=state['reference_image'])
+        app_model.feature_region = state['feature_region']
+        app_model.target.set_crop_rect(state['target_crop_rect'])
+        app_model.crop_regions = state['crop_regions']
+        if len(state['patterns']) > 0:
+            app_model.pattern_library.configure_from_json(state['patterns'])
+        else:
+            pass
+        if state['cache_directory'] is not None:
+            app_model.set_disk_cache(state['cache_directory'], state['cache_size'])
+        else:
+            pass
+        app_model.set_image_cache_size(state['image_cache_size'])
+        # Records are collected for each target image and written by
+        # the parent process.
+        app_model.match_records = [] if state['match_records'] else None
+        app_model.batch_annotations = state['annotations']
+        return app_model
 
     def batch_crop_matched_patterns(self, target_fileset=None, output_dir=None, progress=None):
         """Pass an optional 'FileSet' object, the 'target_fileset' field of
@@ -614,33 +1363,275 @@ class SingleFeatureMultiCrop():
         file path, the (output_dir' field is used by default. This
         method will run pattern matching on each image in the fileset,
         and then crop and save all matched images to a result
-        directory. """
+        directory.
+
+        If the number of 'jobs' is more than 1, the images are searched
+        by a pool of that many processes, each of which loads the
+        reference image and computes its features only once. The files
+        written are the same regardless of the number of jobs.
+        Otherwise, the next few images are decoded by an
+        ImagePrefetcher while each image is searched.
+
+        The matched regions are encoded and written by an ImageWriter,
+        while the next image is searched.
+
+        If 'annotations' is set, no image files are written, instead the
+        matched regions of every image are written as annotations of
+        that image into the output directory, see
+        DataPrepKit.Annotations. Rectangles are given in the coordinates
+        of the whole image.
+
+        If 'tar_shards' is set, the matched regions are written into tar
+        archives of at most that many bytes in the output directory,
+        rather than as separate files, see DataPrepKit.TarShards. Each
+        file in a shard is described in the index of the shard by its
+        match record, see DataPrepKit.MatchRecords.
+
+        If 'array_dataset' is set, the matched regions are appended to
+        one array per crop region in the output directory, see
+        DataPrepKit.ArrayDataset, and 'tar_shards' is ignored.
+
+        If 'match_records' is set, a record of each region written is
+        appended to that file as soon as the regions of each image are
+        written, in the order of the fileset. The 'output' of a region
+        that failed to be written is None. If the 'manifest' is also enabled, the
+        records are added to the end of an existing file, since the
+        images that are skipped are not searched again.
+
+        If the 'manifest' is enabled, each image is recorded in a
+        BatchManifest in the output directory once its matched regions
+        are written, and images recorded by an earlier batch are skipped
+        if neither they nor the configuration have changed, see
+        'set_manifest()'.
+
+        An image that fails does not stop the batch. Returns a list of
+        2-tuples (path, message), one for each image that failed to be
+        searched or each matched region that failed to be written, in
+        the order of the fileset."""
         target_fileset = self.target_fileset if target_fileset is None else target_fileset
-        self.reference_image.load_image(crop_rect=self.feature_region)
-        #print(f'{self.__class__.__name__}.batch_crop_matched_patterns() #(will operate on {len(self.target_fileset)} image files)')
-        for image in target_fileset:
-            #print(
-            #    f'image = {image!s}\n'
-            #    f'output_dir = {self.output_dir}\n'
-            #    f'threshold = {self.threshold}\n'
-            #    f'save_distance_map = {self.save_distance_map}',
-            #  )
-            try:
-                self.crop_matched_references(image, output_dir)
-                if progress is not None:
-                    progress.update_progress(1, label=f'{str(image)!r}')
-                else:
-                    pass
-            except Exception as err:
+        images = list(target_fileset)
+        #print(f'{self.__class__.__name__}.batch_crop_matched_patterns() #(will operate on {len(images)} image files)')
+        output_dir = self.get_output_dir() if output_dir is None else output_dir
+        outputs = BatchOutputs(images, output_dir)
+        results = None
+        try:
+            self.open_batch_outputs(outputs)
+            searched = self.batch_searched(outputs, progress)
+            results = self.batch_results(outputs, searched)
+            for (index, result) in zip(searched, results):
+                #print(
+                #    f'image = {images[index]!s}\n'
+                #    f'output_dir = {self.output_dir}\n'
+                #    f'threshold = {self.threshold}\n'
+                #    f'save_distance_map = {self.save_distance_map}',
+                #  )
+                self.record_batch_result(outputs, index, result)
                 if progress is not None:
-                    progress.reject()
+                    progress.update_progress(1, label=f'{str(images[index])!r}')
                 else:
                     pass
-                raise err
+        except Exception as err:
+            if progress is not None:
+                progress.reject()
+            else:
+                pass
+            raise err
+        finally:
+            if results is not None:
+                # If the progress dialog was canceled, do not wait for
+                # the remaining images to be searched.
+                results.close()
+            else:
+                pass
+            self.close_batch_outputs(outputs)
+        errors = outputs.errors + \
+          [(source, f'{path}: {message}') for (source, path, message) in outputs.write_errors]
+        order = {image: i for (i, image) in enumerate(images)}
+        errors.sort(key=lambda error: order.get(error[0], len(images)))
         if progress is not None:
             progress.accept()
         else:
             pass
+        return errors
+
+    def open_batch_outputs(self, outputs):
+        """Open the manifest, the match records file, the annotations, and
+        the tar shards or arrays of a batch into the fields of the
+        BatchOutputs 'outputs', as configured."""
+        if self.manifest:
+            outputs.manifest = BatchManifest(
+                outputs.output_dir,
+                self.batch_config_hash(),
+                content_hash=self.manifest_hash,
+              )
+            outputs.fingerprints = [outputs.manifest.fingerprint(image) for image in outputs.images]
+        else:
+            pass
+        if self.match_records_path is not None:
+            outputs.record_file = MatchRecordFile(self.match_records_path, append=self.manifest)
+        else:
+            pass
+        if self.annotations is not None:
+            outputs.annotations = AnnotationWriter(
+                outputs.output_dir, self.annotations,
+                categories=self.annotation_categories(),
+                append=self.manifest,
+                inputs=outputs.images,
+              )
+            self.batch_annotations = True
+        else:
+            pass
+        if (outputs.record_file is not None) or (outputs.annotations is not None):
+            # Records are collected for each image, see 'batch_crop_result()'.
+            self.match_records = []
+        else:
+            pass
+        if outputs.annotations is not None:
+            pass
+        elif self.array_dataset:
+            outputs.sink_writer = ArrayDatasetWriter(outputs.output_dir)
+        elif self.tar_shards is not None:
+            outputs.sink_writer = TarShardWriter(outputs.output_dir, self.tar_shards)
+        else:
+            pass
+        if self.target.crop_rect is not None:
+            outputs.offset = tuple(self.target.crop_rect[0:2])
+        else:
+            pass
+
+    def batch_searched(self, outputs, progress):
+        """Return the indices of the images of a batch to search, which is
+        all of them, unless the manifest records that an image is done,
+        in which case it is skipped."""
+        if outputs.manifest is None:
+            return list(range(len(outputs.images)))
+        else:
+            # Skip the images that are already done, but keep the index
+            # of each image in the manifest.
+            searched = []
+            for (index, image) in enumerate(outputs.images):
+                if outputs.manifest.is_done(image, outputs.fingerprints[index]):
+                    outputs.manifest.skip(index)
+                    if progress is not None:
+                        progress.update_progress(1, label=f'{str(image)!r}')
+                    else:
+                        pass
+                else:
+                    searched.append(index)
+            return searched
+
+    def batch_results(self, outputs, searched):
+        """Yield the BatchResult of searching each image of a batch at the
+        indices 'searched', in order. Closing this generator stops the
+        search of the remaining images."""
+        images = [outputs.images[index] for index in searched]
+        jobs = min(self.jobs, len(images))
+        if jobs > 1:
+            # Worker processes are started from scratch rather than
+            # forked, since this process may be running threads.
+            pool = ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=batch_worker_init,
+                initargs=(self.batch_state(),),
+              )
+            try:
+                yield from bounded_map(
+                    pool, batch_worker_crop_file, BATCH_JOBS_AHEAD * jobs,
+                    images, [outputs.output_dir] * len(images),
+                  )
+            finally:
+                pool.shutdown(cancel_futures=True)
+        elif len(images) > 0:
+            patterns = self.prepare_batch()
+            sink_writer = outputs.sink_writer
+            self.image_writer = ImageWriter(
+                sink=None if sink_writer is None else sink_writer.add,
+                raw=self.array_dataset,
+                track_sources=(outputs.record_file is not None) or (outputs.manifest is not None),
+              )
+            prefetcher = ImagePrefetcher(
+                images,
+                crop_rect=self.target.get_crop_rect(),
+                memory_budget=self.prefetch_budget,
+              )
+            try:
+                for image in prefetcher:
+                    yield self.batch_crop_result(image, outputs.output_dir, patterns)
+            finally:
+                prefetcher.close()
+        else:
+            pass
+
+    def record_batch_result(self, outputs, index, result):
+        """Write the BatchResult of the image at 'index' of a batch to the
+        BatchOutputs 'outputs', and collect its errors."""
+        image = outputs.images[index]
+        if result.sink_files is not None:
+            for (path, data, info) in result.sink_files:
+                try:
+                    outputs.sink_writer.add(path, data, info)
+                except (OSError, ValueError) as err:
+                    result.write_errors.append((image, path, str(err)))
+                    result.written.remove(path)
+        else:
+            pass
+        if result.error is not None:
+            outputs.errors.append((image, result.error))
+        else:
+            pass
+        outputs.write_errors += result.write_errors
+        if outputs.record_file is None:
+            pass
+        elif result.written is not None:
+            outputs.record_file.record(
+                outputs.recorded, result.records, result.written,
+                [(path, message) for (_source, path, message) in result.write_errors],
+              )
+        else:
+            # Recorded once the matched regions are written, so that the
+            # records do not refer to files that failed to be written.
+            self.image_writer.after_writes(
+                image,
+                functools.partial(outputs.record_file.record, outputs.recorded, result.records),
+              )
+        outputs.recorded += 1
+        if (outputs.annotations is not None) and (result.size is not None):
+            outputs.annotations.add_image(image, result.size, result.records, offset=outputs.offset)
+        else:
+            pass
+        manifest = outputs.manifest
+        if manifest is None:
+            pass
+        elif result.written is not None:
+            manifest.record(
+                index, image, outputs.fingerprints[index], result.error, result.written,
+                [(path, message) for (_source, path, message) in result.write_errors],
+              )
+        else:
+            # Recorded once the matched regions are written, the write
+            # errors are collected by 'flush()'.
+            self.image_writer.after_writes(
+                image,
+                functools.partial(manifest.record, index, image, outputs.fingerprints[index], result.error),
+              )
+
+    def close_batch_outputs(self, outputs):
+        """Wait for the images of a batch to be written, and close everything
+        opened by 'open_batch_outputs()'."""
+        if self.image_writer is not None:
+            outputs.write_errors += self.image_writer.flush()
+            self.image_writer.close()
+            self.image_writer = None
+        else:
+            pass
+        for output in [outputs.manifest, outputs.sink_writer, outputs.record_file, outputs.annotations]:
+            if output is not None:
+                output.close()
+            else:
+                pass
+        self.match_records = None
+        self.batch_annotations = False
 
     ###############  Debugging methods  ###############
 
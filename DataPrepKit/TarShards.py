@@ -0,0 +1,150 @@
+import DataPrepKit.utilities as util
+
+import io
+import json
+import os
+from pathlib import Path, PurePath
+import re
+import tarfile
+import time
+
+#---------------------------------------------------------------------------------------------------
+
+DEFAULT_SHARD_SIZE = 1 << 30
+  # The default maximum number of bytes of a shard.
+
+SHARD_PREFIX = 'shard'
+
+#---------------------------------------------------------------------------------------------------
+
+class TarShardWriter():
+    """Write files into a sequence of tar archives, called shards, in
+    'output_dir' rather than as separate files, so that millions of
+    small image files can be stored and copied as a few large files.
+    The shards are named "shard-000000.tar", "shard-000001.tar", and so
+    on, and a new shard is started when adding a file would make the
+    current one larger than 'max_bytes', unless it is empty. Numbering
+    starts after the shards already in 'output_dir', so running a
+    batch again never overwrites a shard.
+
+    Next to each shard is an index "shard-000000.jsonl" with one JSON
+    object per file, with the 'name' of the file in the shard, the
+    'offset' and 'size' of its content in the shard (so it can be read
+    without reading the whole shard), and the fields of the 'info'
+    dictionary passed to 'add()'.
+
+    Files are named by their path relative to 'output_dir', so a
+    shard contains the same directory layout as the files that would
+    otherwise have been written. The shards and their indices are
+    flushed after every file, so all of the files added before a
+    batch is interrupted can be read, although the tar archive is not
+    properly terminated. This class is not thread-safe, see the 'sink'
+    of DataPrepKit.ImageWriter.ImageWriter."""
+
+    def __init__(self, output_dir, max_bytes=DEFAULT_SHARD_SIZE, prefix=SHARD_PREFIX):
+        self.output_dir = Path(output_dir)
+        self.max_bytes = util.byte_size(max_bytes)
+        self.prefix = prefix
+        self.number = self.next_number()
+        self.tar = None
+        self.index = None
+        self.paths = []
+
+    def next_number(self):
+        """Return the number of the first shard not already in 'output_dir'."""
+        pattern = re.compile(re.escape(self.prefix) + r'-(\d+)\.tar')
+        numbers = [-1]
+        if self.output_dir.is_dir():
+            for path in self.output_dir.iterdir():
+                match = pattern.fullmatch(path.name)
+                if match is not None:
+                    numbers.append(int(match.group(1)))
+                else:
+                    pass
+        else:
+            pass
+        return max(numbers) + 1
+
+    def shard_path(self, number, suffix='.tar'):
+        return self.output_dir / f'{self.prefix}-{number:06}{suffix}'
+
+    def get_shard_paths(self):
+        """Return the paths of the shards written so far, not including the
+        shards that were already in 'output_dir'."""
+        return list(self.paths)
+
+    def open(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.tar = tarfile.open(self.shard_path(self.number), 'w', format=tarfile.PAX_FORMAT)
+        self.index = open(self.shard_path(self.number, '.jsonl'), 'w', encoding='utf8')
+        self.paths.append(self.shard_path(self.number))
+
+    def close_shard(self):
+        if self.tar is not None:
+            end = self.tar.offset + 2 * tarfile.BLOCKSIZE
+            self.tar.close()
+            # The tarfile module pads the archive to a whole record of 20
+            # blocks, which tar readers do not need, and which would make
+            # a small shard larger than 'max_bytes'.
+            os.truncate(self.shard_path(self.number), end)
+            self.index.close()
+            self.tar = None
+            self.index = None
+            self.number += 1
+        else:
+            pass
+
+    def member_name(self, path):
+        path = PurePath(path)
+        try:
+            return path.relative_to(self.output_dir).as_posix()
+        except ValueError:
+            return path.as_posix()
+
+    def add(self, path, data, info=None):
+        """Add a file named by its 'path' with the content 'data' (bytes)
+        to the current shard, and describe it in the index with the
+        fields of the dictionary 'info'. Returns the name of the file
+        in the shard."""
+        name = self.member_name(path)
+        member = tarfile.TarInfo(name)
+        member.size = len(data)
+        member.mtime = int(time.time())
+        # The content is padded to a whole number of tar blocks, and an
+        # archive ends with two empty blocks.
+        data_blocks = -(-len(data) // tarfile.BLOCKSIZE)
+        if (self.tar is not None) and \
+           (self.tar.offset > 0) and \
+           (self.tar.offset + len(member.tobuf(tarfile.PAX_FORMAT)) + \
+            data_blocks * tarfile.BLOCKSIZE + 2 * tarfile.BLOCKSIZE > self.max_bytes):
+            self.close_shard()
+        else:
+            pass
+        if self.tar is None:
+            self.open()
+        else:
+            pass
+        self.tar.addfile(member, io.BytesIO(data))
+        self.tar.fileobj.flush()
+        offset = self.tar.offset - data_blocks * tarfile.BLOCKSIZE
+        entry = {'name': name, 'offset': offset, 'size': len(data)}
+        if info is not None:
+            entry.update(info)
+        else:
+            pass
+        self.index.write(json.dumps(entry) + '\n')
+        self.index.flush()
+        return name
+
+    def close(self):
+        self.close_shard()
+
+#---------------------------------------------------------------------------------------------------
+
+def read_shard_file(shard_path, entry):
+    """Return the content of the file described by an 'entry' of the index
+    of the shard at 'shard_path', without reading the rest of the
+    shard."""
+    with open(shard_path, 'rb') as f:
+        f.seek(entry['offset'])
+        return f.read(entry['size'])
@@ -25,7 +25,7 @@ def check_rect_config(r, err_msg):
 
 def check_region_config(d, err_msg):
     result = dict()
-    for k,v in d:
+    for k,v in d.items():
         if isinstance(k, str):
             result[k] = check_rect_config(v, f'{err_msg}, (key={k!r})')
         else:
@@ -72,6 +72,27 @@ def threshold(val):
     else:
         raise ValueError("threshold must be percentage value between 0 and 100")
 
+byte_size_units = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+def byte_size(val):
+    """Parse a number of bytes, either an integer or a string such as
+    "512M" or "2G" with a binary unit suffix (K, M, G, or T, with an
+    optional trailing "B" or "iB")."""
+    if isinstance(val, int):
+        size = val
+    elif isinstance(val, str):
+        match = re.fullmatch(r'\s*([0-9]+(?:\.[0-9]*)?)\s*([KkMmGgTt]?)(?:i?[Bb])?\s*', val)
+        if match is None:
+            raise ValueError(f'invalid byte size {val!r}, expecting a number with an optional K/M/G/T suffix')
+        else:
+            size = int(float(match.group(1)) * byte_size_units[match.group(2).upper()])
+    else:
+        raise ValueError('byte size must be an integer or a string', val)
+    if size <= 0:
+        raise ValueError('byte size must be greater than zero', val)
+    else:
+        return size
+
 def check_param(label, param, gte, lte):
     """This function is used mostly when setting arguments taken from the
     GUI. It raises a ValueError if the parameter is out of the bounds
@@ -187,6 +208,141 @@ def bounding_rect(rect_list):
     y = min(y_list)
     return (x, y, max(x_list) - x, max(y_list) - y)
 
+def overlapping_rect_pairs(rects):
+    """Take an Nx4 array of rectangles (x, y, width, height) and return
+    a 3-tuple of arrays (i, j, intersection) for every pair of
+    rectangles whose intersection has a positive area. Every pair
+    appears only once, either as (i, j) or as (j, i).
+
+    Rather than comparing every rectangle to every other rectangle,
+    the rectangles are sorted into a grid of cells at least as large
+    as the largest rectangle, so that a rectangle can only overlap
+    rectangles in the same cell as it or in one of the eight cells
+    around it. This keeps the number of pairs compared close to the
+    number of pairs that actually overlap. Only half of the cells
+    around each cell are visited, since the other half visit it. """
+    rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+    x0 = rects[:,0]
+    y0 = rects[:,1]
+    x1 = x0 + rects[:,2]
+    y1 = y0 + rects[:,3]
+    cell_w = max(1.0, float(rects[:,2].max()))
+    cell_h = max(1.0, float(rects[:,3].max()))
+    cx = np.int64(np.floor(x0 / cell_w))
+    cy = np.int64(np.floor(y0 / cell_h))
+    cx -= cx.min()
+    cy -= cy.min()
+    # Each cell gets a unique number, with a margin of one cell on
+    # every side so that the numbers of the cells around it are also
+    # unique.
+    stride = int(cy.max()) + 3
+    cell = (cx + 1) * stride + (cy + 1)
+    by_cell = np.argsort(cell, kind='stable')
+    sorted_cell = cell[by_cell]
+    pairs_i = []
+    pairs_j = []
+    for (dx, dy) in [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]:
+        neighbor = cell + (dx * stride + dy)
+        lo = np.searchsorted(sorted_cell, neighbor, side='left')
+        hi = np.searchsorted(sorted_cell, neighbor, side='right')
+        counts = hi - lo
+        # Expand each rectangle into one element per rectangle in
+        # the neighboring cell.
+        i = np.repeat(np.arange(len(rects)), counts)
+        offset = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = by_cell[np.repeat(lo, counts) + offset]
+        pairs_i.append(i)
+        pairs_j.append(j)
+    i = np.concatenate(pairs_i)
+    j = np.concatenate(pairs_j)
+    # Rectangles in the same cell are paired with each other in both
+    # orders, and with themselves.
+    keep = (i < j) | (cell[i] != cell[j])
+    (i, j) = (i[keep], j[keep])
+    width  = np.minimum(x1[i], x1[j]) - np.maximum(x0[i], x0[j])
+    height = np.minimum(y1[i], y1[j]) - np.maximum(y0[i], y0[j])
+    keep = (width > 0) & (height > 0)
+    return (i[keep], j[keep], (width * height)[keep])
+
+def non_maximum_suppression(rects, scores, max_overlap=0.0):
+    """Take an Nx4 array of rectangles (x, y, width, height) and an array
+    of N scores and return a boolean array of N elements that is True
+    for each rectangle that should be kept. Rectangles are considered
+    from the highest score to the lowest (the first of equal scores
+    first), and a rectangle is removed if the intersection over union
+    of it and a higher scoring rectangle that was kept is greater than
+    'max_overlap'. With 'max_overlap' set to zero, a rectangle is
+    removed if it overlaps a kept rectangle at all."""
+    rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    count = len(rects)
+    keep = np.ones(count, dtype=bool)
+    if count < 2:
+        return keep
+    else:
+        pass
+    (i, j, intersection) = overlapping_rect_pairs(rects)
+    area = rects[:,2] * rects[:,3]
+    union = area[i] + area[j] - intersection
+    suppress = intersection > max_overlap * union
+    return suppress_pairs(scores, i[suppress], j[suppress])
+
+def suppress_pairs(scores, i, j):
+    """Take an array of N scores and two arrays 'i' and 'j' listing the
+    pairs of items that conflict with each other, and return a boolean
+    array of N elements that is True for each item that should be
+    kept. Items are considered from the highest score to the lowest
+    (the first of equal scores first), and an item is removed if it
+    conflicts with a higher scoring item that was kept."""
+    count = len(scores)
+    keep = np.ones(count, dtype=bool)
+    order = np.argsort(-scores, kind='stable')
+    rank = np.empty(count, dtype=np.int64)
+    rank[order] = np.arange(count)
+    # Order each pair so that 'j' has a higher rank than 'i', only 'j'
+    # can cause 'i' to be removed.
+    swap = rank[j] > rank[i]
+    (i, j) = (np.where(swap, j, i), np.where(swap, i, j))
+    # Group the pairs by the rank of 'i', then visit each item that can
+    # be removed in rank order. Every 'j' has a lower rank than its
+    # 'i', so whether it was kept is already decided.
+    by_rank = np.argsort(rank[i], kind='stable')
+    (i, j) = (i[by_rank], j[by_rank])
+    bounds = np.flatnonzero(np.diff(i, prepend=-1, append=-1))
+    for (start, end) in zip(bounds[:-1], bounds[1:]):
+        if keep[j[start:end]].any():
+            keep[i[start]] = False
+        else:
+            pass
+    return keep
+
+def merge_quadrilaterals(quads, scores, tolerance):
+    """Take an Nx4x2 array of quadrilaterals, each being the four
+    corners of a rectangle after a perspective transformation, and
+    an array of N scores, and return a boolean array of N elements
+    that is True for each quadrilateral that should be kept. Two
+    quadrilaterals are duplicates if every corner of one is within
+    'tolerance' of the same corner of the other, and of each group of
+    duplicates only the highest scoring one is kept, see
+    'suppress_pairs()'."""
+    quads = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 2)
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    if (len(quads) < 2) or (tolerance <= 0):
+        return np.ones(len(quads), dtype=bool)
+    else:
+        pass
+    # Duplicates have centers closer than 'tolerance', so squares of
+    # that size around the centers of duplicates must overlap.
+    centers = quads.mean(axis=1)
+    squares = np.concatenate(
+        [centers - (tolerance / 2), np.full((len(quads), 2), float(tolerance))],
+        axis=1,
+      )
+    (i, j, _intersection) = overlapping_rect_pairs(squares)
+    corner_distance = np.sqrt(((quads[i] - quads[j]) ** 2).sum(axis=2)).max(axis=1)
+    duplicate = corner_distance < tolerance
+    return suppress_pairs(scores, i[duplicate], j[duplicate])
+
 def rect_to_lines_matrix(rect):
     """Transform a rectangle encoded as a tuple(x,y,width,height) into a
     matrix of float32 2D points, each encoded as a np.float32 array.
@@ -0,0 +1,344 @@
+#! /usr/bin/env python3
+
+"""Benchmarks for the ORB pattern matching algorithm. These are not
+unit tests, run this script directly to print a report of how long
+the ORB search takes on large synthetic images.
+"""
+
+from DataPrepKit.DiskCache import DiskCache
+from DataPrepKit.ORBMatcher import ImageWithORB, KeypointGrid, ORBConfig, SegmentedImage
+from DataPrepKit.utilities import merge_quadrilaterals
+
+import argparse
+from copy import deepcopy
+from pathlib import Path
+import tempfile
+import time
+
+import cv2 as cv
+import numpy as np
+
+####################################################################################################
+
+def loop_select_keypoints(points, rect):
+    """Return the indices of the 'points' (an Nx2 array) that lie within
+    'rect', checking every point. This is the baseline that
+    KeypointGrid.select() is checked against."""
+    (x, y, width, height) = rect
+    return np.int64(
+        [ i for (i, (px, py)) in enumerate(points) \
+          if (x <= px < x + width) and (y <= py < y + height) \
+        ],
+      )
+
+def loop_merge_quadrilaterals(quads, scores, tolerance):
+    """Compare every pair of quadrilaterals, the baseline that
+    'merge_quadrilaterals()' is checked against."""
+    order = sorted(range(len(quads)), key=lambda k: -scores[k])
+    keep = np.ones(len(quads), dtype=bool)
+    for (rank, k) in enumerate(order):
+        for other in order[:rank]:
+            if keep[other] and \
+              np.sqrt(((quads[k] - quads[other]) ** 2).sum(axis=1)).max() < tolerance:
+                keep[k] = False
+                break
+            else:
+                pass
+    return keep
+
+def synthetic_quadrilaterals(count, extent, size, seed=0):
+    """Construct 'count' squares of 'size' at random places within
+    'extent', each with one to four slightly moved copies, and random
+    scores for all of them."""
+    rng = np.random.default_rng(seed)
+    square = np.float64([[0, 0], [size, 0], [size, size], [0, size]])
+    quads = []
+    for corner in rng.uniform(0, extent - size, (count, 2)):
+        for _ in range(int(rng.integers(1, 5))):
+            quads.append(square + corner + rng.normal(0, size / 20, (4, 2)))
+    quads = np.float64(quads)
+    return (quads, rng.uniform(0, 1, len(quads)))
+
+def synthetic_keypoints(count, width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    keypoints = \
+      [ cv.KeyPoint(float(px), float(py), 31.0) \
+        for (px, py) in zip(rng.uniform(0, width, count), rng.uniform(0, height, count)) \
+      ]
+    descriptors = rng.integers(0, 256, (count, 32), dtype=np.uint8)
+    return (keypoints, descriptors)
+
+def synthetic_orb_target(width, height, pattern_size, count, seed=0, textured=True):
+    """Construct a textured random background image and paste 'count'
+    rotated copies of a textured random pattern image into it. Returns
+    a 3-tuple (target, pattern, centers) where 'centers' is the list of
+    (x, y) positions of the center of each pasted pattern. If
+    'textured' is False the background is a flat gray."""
+    rng = np.random.default_rng(seed)
+    def texture(w, h):
+        noise = rng.integers(0, 256, (h, w), dtype=np.uint8)
+        return cv.cvtColor(cv.GaussianBlur(noise, (0, 0), 1.5), cv.COLOR_GRAY2BGR)
+    pattern = cv.normalize(texture(pattern_size, pattern_size), None, 0, 255, cv.NORM_MINMAX)
+    target = texture(width, height) if textured else np.full((height, width, 3), 128, dtype=np.uint8)
+    centers = []
+    cells = max(1, int(np.sqrt(count)))
+    (cell_w, cell_h) = (width // cells, height // cells)
+    for i in range(count):
+        (cx, cy) = ((i % cells) * cell_w, ((i // cells) % cells) * cell_h)
+        x = cx + int(rng.integers(0, max(1, cell_w - pattern_size)))
+        y = cy + int(rng.integers(0, max(1, cell_h - pattern_size)))
+        rotation = cv.getRotationMatrix2D((pattern_size / 2, pattern_size / 2), float(rng.uniform(-20, 20)), 1.0)
+        copy = cv.warpAffine(pattern, rotation, (pattern_size, pattern_size), borderMode=cv.BORDER_REFLECT)
+        target[y:y+pattern_size, x:x+pattern_size] = copy
+        centers.append((x + pattern_size / 2, y + pattern_size / 2))
+    return (target, pattern, centers)
+
+def loop_segment_keypoint_counts(rects, points):
+    """Count the 'points' within each of the 'rects' one rectangle at a
+    time. This is the baseline that
+    SegmentedImage.segment_keypoint_counts() is checked against."""
+    return np.int64([len(loop_select_keypoints(points, rect)) for rect in rects])
+
+def time_call(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return (time.perf_counter() - start, result)
+
+def orb_search(target, pattern, orb_config, workers=1, cache=None):
+    reference = ImageWithORB(pattern, orb_config, cache=cache)
+    segmented = SegmentedImage(
+        orb_config, target, reference.get_crop_rect(),
+        workers=workers, cache=cache,
+      )
+    return segmented.find_matching_points(reference)
+
+def count_found(projections, centers, pattern_size):
+    """Count how many of the 'centers' have a projection centered within
+    a quarter of the pattern size of them."""
+    found = 0
+    for (cx, cy) in centers:
+        for proj in projections:
+            (px, py) = np.float32(proj.get_perspective_bounds()).mean(axis=0)
+            if abs(px - cx) < pattern_size / 4 and abs(py - cy) < pattern_size / 4:
+                found += 1
+                break
+            else:
+                pass
+    return found
+
+def bench_keypoint_grid(counts, extent=8192, segment_size=256):
+    print(f'# keypoint grid lookup, {segment_size}x{segment_size} segments within {extent}x{extent}')
+    print(f'{"keypoints":>10} {"selected":>9} {"loop (s)":>10} {"grid (s)":>10} {"speedup":>8}')
+    rects = \
+      [ (x, y, segment_size, segment_size) \
+        for y in range(0, extent - segment_size, segment_size) \
+        for x in range(0, extent - segment_size, segment_size) \
+      ][:64]
+    for count in counts:
+        (keypoints, descriptors) = synthetic_keypoints(count, extent, extent)
+        grid = KeypointGrid(keypoints, descriptors, segment_size // 4)
+        (loop_time, expected) = time_call(
+            lambda: [loop_select_keypoints(grid.points, rect) for rect in rects],
+          )
+        (grid_time, result) = time_call(lambda: [grid.select(rect) for rect in rects])
+        for (rect, indices, (points, _descriptors)) in zip(rects, expected, result):
+            if not np.array_equal(grid.points[indices] - np.float32(rect[:2]), points):
+                raise ValueError('KeypointGrid.select() result differs from loop baseline', count, rect)
+            else:
+                pass
+        selected = sum(len(points) for (points, _) in result)
+        print(
+            f'{count:>10} {selected:>9} {loop_time:>10.3f}'
+            f' {grid_time:>10.4f} {loop_time/grid_time:>7.1f}x'
+          )
+
+def detect_per_segment(segmented, orb_config):
+    for ((_x, _y, _w, _h), segment) in segmented.foreach():
+        segment_orb = ImageWithORB(segment, orb_config)
+        segment_orb.compute()
+
+def detect_whole_image(segmented, reference):
+    grid = segmented.whole_image_orb(reference)
+    for (rect, _segment) in segmented.foreach():
+        grid.select(rect)
+
+def bench_detection(sizes, pattern_size):
+    print(f'# ORB keypoint detection only, per segment vs. once on the whole image, pattern {pattern_size}x{pattern_size}')
+    print(f'{"target":>13} {"segments":>9} {"segment (s)":>12} {"whole (s)":>10} {"speedup":>8}')
+    for size in sizes:
+        (target, pattern, _centers) = synthetic_orb_target(size, size, pattern_size, 1)
+        orb_config = ORBConfig()
+        reference = ImageWithORB(pattern, orb_config)
+        reference.compute()
+        segmented = SegmentedImage(orb_config, target, reference.get_crop_rect())
+        (base_time, _) = time_call(detect_per_segment, segmented, orb_config)
+        (elapsed, _) = time_call(detect_whole_image, segmented, reference)
+        print(
+            f'{size:>6}x{size:<6} {segmented.guess_compute_steps():>9} {base_time:>12.3f}'
+            f' {elapsed:>10.3f} {base_time/elapsed:>7.1f}x'
+          )
+
+def bench_merge_quadrilaterals(counts, size=128, extent=30000, tolerance=12.8):
+    print(f'# merging duplicate {size}x{size} projections within {extent}x{extent}, tolerance {tolerance}')
+    print(f'{"projections":>11} {"kept":>8} {"loop (s)":>10} {"array (s)":>10} {"speedup":>8}')
+    for count in counts:
+        (quads, scores) = synthetic_quadrilaterals(count, extent, size)
+        (array_time, result) = time_call(merge_quadrilaterals, quads, scores, tolerance)
+        (loop_time, expected) = time_call(loop_merge_quadrilaterals, quads, scores, tolerance)
+        if not np.array_equal(expected, result):
+            raise ValueError('merge_quadrilaterals() result differs from loop baseline', count)
+        else:
+            pass
+        print(
+            f'{len(quads):>11} {result.sum():>8} {loop_time:>10.3f}'
+            f' {array_time:>10.4f} {loop_time/array_time:>7.1f}x'
+          )
+
+def orb_configs():
+    """The ORB search modes that are compared by 'bench_search()'."""
+    segment = ORBConfig()
+    whole = deepcopy(segment)
+    whole.set_detect_whole_image(True)
+    flann = deepcopy(segment)
+    flann.set_matcher('flann')
+    return [('segment', segment), ('whole', whole), ('flann', flann)]
+
+def bench_search(sizes, pattern_size):
+    print(f'# ORB search, keypoints detected per segment or on the whole image, pattern {pattern_size}x{pattern_size}')
+    print(f'{"target":>13} {"mode":>8} {"time (s)":>9} {"matches":>8} {"found":>8} {"speedup":>8}')
+    for size in sizes:
+        count = max(1, (size // 512) ** 2)
+        (target, pattern, centers) = synthetic_orb_target(size, size, pattern_size, count)
+        base_time = None
+        for (label, orb_config) in orb_configs():
+            (elapsed, projections) = time_call(orb_search, target, pattern, orb_config)
+            base_time = elapsed if base_time is None else base_time
+            print(
+                f'{size:>6}x{size:<6} {label:>8} {elapsed:>9.3f} {len(projections):>8}'
+                f' {count_found(projections, centers, pattern_size):>4}/{count:<3}'
+                f' {base_time/elapsed:>7.1f}x'
+              )
+
+def bench_rematch(sizes, pattern_size):
+    print(f'# ORB search again after changing only the descriptor threshold, pattern {pattern_size}x{pattern_size}')
+    print(f'{"target":>13} {"mode":>8} {"search (s)":>11} {"rematch (s)":>12} {"matches":>8} {"speedup":>8}')
+    for size in sizes:
+        (target, pattern, _centers) = synthetic_orb_target(size, size, pattern_size, max(1, (size // 512) ** 2))
+        for (label, orb_config) in orb_configs():
+            reference = ImageWithORB(pattern, orb_config)
+            segmented = SegmentedImage(orb_config, target, reference.get_crop_rect())
+            (base_time, _) = time_call(segmented.find_matching_points, reference)
+            orb_config = deepcopy(orb_config)
+            orb_config.set_descriptor_threshold(0.6)
+            reference.set_orb_config(orb_config)
+            segmented.set_orb_config(orb_config)
+            (elapsed, projections) = time_call(segmented.find_matching_points, reference)
+            print(
+                f'{size:>6}x{size:<6} {label:>8} {base_time:>11.3f} {elapsed:>12.3f}'
+                f' {len(projections):>8} {base_time/elapsed:>7.1f}x'
+              )
+
+def bench_prefilter(sizes, pattern_size):
+    print(f'# ORB search of a flat background skipping segments with few FAST corners, pattern {pattern_size}x{pattern_size}')
+    print(f'{"target":>13} {"mode":>8} {"segments":>9} {"searched":>9} {"time (s)":>9} {"prefilter (s)":>14} {"same":>5} {"speedup":>8}')
+    for size in sizes:
+        (target, pattern, _centers) = synthetic_orb_target(
+            size, size, pattern_size, max(1, (size // 1024) ** 2), textured=False,
+          )
+        for (label, orb_config) in orb_configs():
+            (base_time, expected) = time_call(orb_search, target, pattern, orb_config)
+            orb_config = deepcopy(orb_config)
+            orb_config.set_prefilter_segments(True)
+            (elapsed, projections) = time_call(orb_search, target, pattern, orb_config)
+            segmented = SegmentedImage(orb_config, target, (0, 0, pattern_size, pattern_size))
+            segments = len(list(segmented.segment_rects()))
+            searched = segmented.guess_compute_steps()
+            same = [proj.get_rect() for proj in expected] == [proj.get_rect() for proj in projections]
+            print(
+                f'{size:>6}x{size:<6} {label:>8} {segments:>9} {searched:>9} {base_time:>9.3f}'
+                f' {elapsed:>14.3f} {str(same):>5} {base_time/elapsed:>7.1f}x'
+              )
+
+def bench_cache(sizes, pattern_size):
+    print(f'# ORB search with features stored in a DiskCache, pattern {pattern_size}x{pattern_size}')
+    print(f'{"target":>13} {"mode":>8} {"cold (s)":>9} {"warm (s)":>9} {"matches":>8} {"same":>5} {"speedup":>8}')
+    for size in sizes:
+        (target, pattern, _centers) = synthetic_orb_target(size, size, pattern_size, max(1, (size // 512) ** 2))
+        for (label, orb_config) in orb_configs():
+            with tempfile.TemporaryDirectory() as directory:
+                cache = DiskCache(Path(directory))
+                (base_time, expected) = time_call(orb_search, target, pattern, orb_config, 1, cache)
+                (elapsed, projections) = time_call(orb_search, target, pattern, orb_config, 1, cache)
+            expected = [proj.get_rect() for proj in expected]
+            found = [proj.get_rect() for proj in projections]
+            print(
+                f'{size:>6}x{size:<6} {label:>8} {base_time:>9.3f} {elapsed:>9.3f} {len(found):>8}'
+                f' {str(found == expected):>5} {base_time/elapsed:>7.1f}x'
+              )
+
+def bench_workers(sizes, pattern_size, workers_list):
+    print(f'# ORB search of segments by a pool of threads, pattern {pattern_size}x{pattern_size}')
+    print(f'{"target":>13} {"mode":>8} {"workers":>8} {"time (s)":>9} {"matches":>8} {"same":>5} {"speedup":>8}')
+    for size in sizes:
+        (target, pattern, _centers) = synthetic_orb_target(size, size, pattern_size, max(1, (size // 512) ** 2))
+        for (label, orb_config) in orb_configs():
+            (base_time, expected) = time_call(orb_search, target, pattern, orb_config)
+            expected = [proj.get_rect() for proj in expected]
+            for workers in workers_list:
+                (elapsed, projections) = time_call(orb_search, target, pattern, orb_config, workers)
+                found = [proj.get_rect() for proj in projections]
+                print(
+                    f'{size:>6}x{size:<6} {label:>8} {workers:>8} {elapsed:>9.3f} {len(found):>8}'
+                    f' {str(found == expected):>5} {base_time/elapsed:>7.1f}x'
+                  )
+
+####################################################################################################
+
+arper = argparse.ArgumentParser(description='Benchmark the ORB pattern matching algorithm.')
+
+arper.add_argument(
+    '--sizes',
+    dest='sizes',
+    nargs='+',
+    type=int,
+    default=[1024, 2048, 4096],
+    help='Width (and height) of each synthetic target image.',
+  )
+
+arper.add_argument(
+    '--pattern-size',
+    dest='pattern_size',
+    type=int,
+    default=128,
+    help='Width (and height) of the synthetic pattern image.',
+  )
+
+arper.add_argument(
+    '--workers',
+    dest='workers',
+    nargs='+',
+    type=int,
+    default=[2, 4, 8],
+    help='Numbers of threads to compare against searching segments in one thread.',
+  )
+
+def main():
+    args = arper.parse_args()
+    bench_keypoint_grid([10000, 100000])
+    print()
+    bench_merge_quadrilaterals([100, 300])
+    print()
+    bench_detection(args.sizes, args.pattern_size)
+    print()
+    bench_search(args.sizes, args.pattern_size)
+    print()
+    bench_rematch(args.sizes, args.pattern_size)
+    print()
+    bench_prefilter(args.sizes, args.pattern_size)
+    print()
+    bench_cache(args.sizes, args.pattern_size)
+    print()
+    bench_workers(args.sizes, args.pattern_size, args.workers)
+
+if __name__ == '__main__':
+    main()
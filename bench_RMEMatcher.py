@@ -0,0 +1,333 @@
+#! /usr/bin/env python3
+
+"""Benchmarks for the RME pattern matching algorithm. These are not
+unit tests, run this script directly to print a report of how long
+each stage of the RME algorithm takes on large synthetic images.
+"""
+
+from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
+from DataPrepKit.RMEMatcher import DistanceMap, tile_minima
+from DataPrepKit.utilities import byte_size, non_maximum_suppression
+
+import argparse
+import math
+from pathlib import Path, PurePath
+import time
+import tracemalloc
+
+import cv2 as cv
+import numpy as np
+
+####################################################################################################
+
+def loop_tile_minima(distance_map, window_width, window_height):
+    """The original nested-loop tile search that was used by
+    'DistanceMap.find_matching_points()', kept here as the baseline to
+    which 'tile_minima()' is compared. Returns the same 3-tuple of
+    arrays as 'tile_minima()'."""
+    (dist_map_height, dist_map_width) = distance_map.shape
+    window_vcount = round(dist_map_height / window_height)
+    window_hcount = round(dist_map_width  / window_width)
+    tiles = distance_map.reshape(
+        window_vcount, window_height,
+        window_hcount, window_width
+      )
+    xs = []
+    ys = []
+    scores = []
+    for y in range(window_vcount):
+        for x in range(window_hcount):
+            tile = tiles[y, :, x, :]
+            (min_y, min_x) = np.unravel_index(
+                np.argmin(tile),
+                (window_height, window_width),
+              )
+            ys.append(y * window_height + min_y)
+            xs.append(x * window_width  + min_x)
+            scores.append(1.0 - tile[min_y, min_x])
+    return (np.array(xs), np.array(ys), np.array(scores, dtype=np.float32))
+
+def loop_non_maximum_suppression(rects, scores, max_overlap=0.0):
+    """A simple greedy non-maximum suppression that compares every
+    candidate to every candidate kept before it, kept here as the
+    baseline to which 'utilities.non_maximum_suppression()' is
+    compared. Returns the same boolean array."""
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable')
+    keep = np.zeros(len(rects), dtype=bool)
+    kept = []
+    for a in order:
+        (x, y, w, h) = rects[a]
+        overlaps = False
+        for b in kept:
+            (bx, by, bw, bh) = rects[b]
+            width  = min(x + w, bx + bw) - max(x, bx)
+            height = min(y + h, by + bh) - max(y, by)
+            if (width > 0) and (height > 0):
+                intersection = width * height
+                if intersection > max_overlap * (w * h + bw * bh - intersection):
+                    overlaps = True
+                    break
+                else:
+                    pass
+            else:
+                pass
+        if not overlaps:
+            kept.append(a)
+            keep[a] = True
+        else:
+            pass
+    return keep
+
+def synthetic_rects(count, extent, size, seed=0):
+    """Construct 'count' random square rectangles of the given 'size'
+    within a square of the given 'extent', and a random score for
+    each."""
+    rng = np.random.default_rng(seed)
+    rects = np.column_stack([
+        rng.integers(0, extent, count),
+        rng.integers(0, extent, count),
+        np.full(count, size),
+        np.full(count, size),
+      ]).astype(np.float64)
+    return (rects, rng.random(count))
+
+def synthetic_distance_map(width, height, window_width, window_height, seed=0):
+    """Construct a random distance map padded to an even multiple of the
+    window size, the same as 'DistanceMap.__init__()' would do."""
+    rng = np.random.default_rng(seed)
+    return rng.random(
+        ( height - (height % -window_height),
+          width  - (width  % -window_width),
+        ),
+        dtype=np.float32,
+      )
+
+def time_call(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return (time.perf_counter() - start, result)
+
+def bench_tile_minima(sizes, pattern_size):
+    window = math.ceil(pattern_size / 2) if pattern_size >= 4 else pattern_size
+    print(f'# tile minimum search, pattern {pattern_size}x{pattern_size}, window {window}x{window}')
+    print(f'{"target":>13} {"tiles":>10} {"loop (s)":>10} {"array (s)":>10} {"speedup":>8}')
+    for size in sizes:
+        distance_map = synthetic_distance_map(size, size, window, window)
+        (loop_time, expected) = time_call(loop_tile_minima, distance_map, window, window)
+        (array_time, result) = time_call(tile_minima, distance_map, window, window)
+        for (a, b) in zip(expected, result):
+            if not np.array_equal(a, b):
+                raise ValueError('tile_minima() result differs from loop baseline', size)
+            else:
+                pass
+        tile_count = len(result[0])
+        print(
+            f'{size:>6}x{size:<6} {tile_count:>10} {loop_time:>10.3f}'
+            f' {array_time:>10.4f} {loop_time/array_time:>7.1f}x'
+          )
+
+def bench_non_maximum_suppression(counts, pattern_size=64, extent=30000):
+    print(f'# non-maximum suppression, {pattern_size}x{pattern_size} rectangles within {extent}x{extent}')
+    print(f'{"candidates":>10} {"kept":>8} {"loop (s)":>10} {"array (s)":>10} {"speedup":>8}')
+    for count in counts:
+        (rects, scores) = synthetic_rects(count, extent, pattern_size)
+        (array_time, result) = time_call(non_maximum_suppression, rects, scores)
+        if count <= 2000:
+            (loop_time, expected) = time_call(loop_non_maximum_suppression, rects, scores)
+            if not np.array_equal(expected, result):
+                raise ValueError('non_maximum_suppression() result differs from loop baseline', count)
+            else:
+                pass
+            print(
+                f'{count:>10} {result.sum():>8} {loop_time:>10.3f}'
+                f' {array_time:>10.4f} {loop_time/array_time:>7.1f}x'
+              )
+        else:
+            print(f'{count:>10} {result.sum():>8} {"":>10} {array_time:>10.4f} {"":>8}')
+
+#---------------------------------------------------------------------------------------------------
+
+def synthetic_target(width, height, pattern_size, count, seed=0):
+    """Construct a smooth random background image and paste 'count'
+    slightly noisy copies of a random pattern image into it. Returns a
+    2-tuple (target, pattern) of OpenCV images. """
+    rng = np.random.default_rng(seed)
+    def smooth_noise(w, h):
+        noise = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        return cv.GaussianBlur(noise, (0, 0), 3)
+    pattern = cv.normalize(smooth_noise(pattern_size, pattern_size), None, 0, 255, cv.NORM_MINMAX)
+    target = smooth_noise(width, height)
+    for _ in range(count):
+        x = int(rng.integers(0, width  - pattern_size))
+        y = int(rng.integers(0, height - pattern_size))
+        noise = rng.integers(-4, 5, pattern.shape)
+        target[y:y+pattern_size, x:x+pattern_size] = np.uint8(np.clip(pattern + noise, 0, 255))
+    return (target, pattern)
+
+def image_loader(path, image):
+    loader = CachedCVImageLoader()
+    loader.set_image(path, image)
+    return loader
+
+def bench_pyramid_case(label, target, pattern, levels_list, threshold):
+    (exhaustive_time, exhaustive) = time_call(DistanceMap, target, pattern)
+    expected = {c.get_rect()[0:2] for c in exhaustive.find_matching_points(threshold)}
+    print(f'{label:>24} {"exhaustive":>10} {exhaustive_time:>9.3f} {len(expected):>8} {"":>7} {"":>8}')
+    for levels in levels_list:
+        (pyramid_time, pyramid) = time_call(
+            lambda: DistanceMap(target, pattern, pyramid_levels=levels),
+          )
+        found = {c.get_rect()[0:2] for c in pyramid.find_matching_points(threshold)}
+        recall = (len(expected & found) / len(expected)) if len(expected) > 0 else 1.0
+        print(
+            f'{"":>24} {f"levels={levels}":>10} {pyramid_time:>9.3f} {len(found):>8}'
+            f' {recall:>7.1%} {exhaustive_time/pyramid_time:>7.1f}x'
+          )
+
+def bench_pyramid(sizes, levels_list, threshold, fixtures_dir=Path('./tests/fixtures')):
+    print(f'# coarse-to-fine (pyramid) search compared to exhaustive search, threshold {threshold:.0%}')
+    print(f'{"target":>24} {"mode":>10} {"time (s)":>9} {"found":>8} {"recall":>7} {"speedup":>8}')
+    pattern_path = fixtures_dir / 'pattern.png'
+    if pattern_path.exists():
+        pattern = CachedCVImageLoader()
+        pattern.load_image(path=pattern_path)
+        for path in sorted(fixtures_dir.glob('target*.png')):
+            target = CachedCVImageLoader()
+            target.load_image(path=path)
+            bench_pyramid_case(path.name, target, pattern, [1], threshold)
+    else:
+        pass
+    for size in sizes:
+        (target, pattern) = synthetic_target(size, size, 64, max(1, (size // 256) ** 2 // 4))
+        bench_pyramid_case(
+            f'synthetic {size}x{size}',
+            image_loader(PurePath(f'synthetic-{size}.png'), target),
+            image_loader(PurePath('synthetic-pattern.png'), pattern),
+            levels_list,
+            threshold,
+          )
+
+#---------------------------------------------------------------------------------------------------
+
+def traced_call(f, *args):
+    """Like 'time_call()' but also returns the peak number of bytes
+    allocated by NumPy while 'f' runs (memory allocated internally by
+    OpenCV is not traced)."""
+    tracemalloc.start()
+    try:
+        (elapsed, result) = time_call(f, *args)
+        (_current, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (elapsed, peak, result)
+
+def bench_strips(sizes, budgets, threshold):
+    print(f'# distance map computed in strips, threshold {threshold:.0%}')
+    print(f'{"target":>13} {"budget":>10} {"time (s)":>9} {"peak (MiB)":>11} {"found":>8} {"same":>5}')
+    for size in sizes:
+        (target, pattern) = synthetic_target(size, size, 64, max(1, (size // 256) ** 2 // 4))
+        target = image_loader(PurePath(f'synthetic-{size}.png'), target)
+        pattern = image_loader(PurePath('synthetic-pattern.png'), pattern)
+        expected = None
+        for budget in [None] + budgets:
+            (elapsed, peak, distance_map) = traced_call(
+                lambda: DistanceMap(target, pattern, memory_budget=budget),
+              )
+            found = [c.get_rect() for c in distance_map.find_matching_points(threshold)]
+            expected = found if expected is None else expected
+            label = 'whole' if budget is None else f'{budget >> 20}M'
+            print(
+                f'{size:>6}x{size:<6} {label:>10} {elapsed:>9.3f} {peak / (1 << 20):>11.1f}'
+                f' {len(found):>8} {str(found == expected):>5}'
+              )
+            del distance_map
+
+def bench_workers(sizes, workers_list, threshold):
+    print(f'# distance map computed in strips by a pool of threads, threshold {threshold:.0%}')
+    print(f'{"target":>13} {"workers":>8} {"time (s)":>9} {"found":>8} {"same":>5} {"speedup":>8}')
+    for size in sizes:
+        (target, pattern) = synthetic_target(size, size, 64, max(1, (size // 256) ** 2 // 4))
+        target = image_loader(PurePath(f'synthetic-{size}.png'), target)
+        pattern = image_loader(PurePath('synthetic-pattern.png'), pattern)
+        (base_time, distance_map) = time_call(DistanceMap, target, pattern)
+        expected = [c.get_rect() for c in distance_map.find_matching_points(threshold)]
+        for workers in workers_list:
+            (elapsed, distance_map) = time_call(
+                lambda: DistanceMap(target, pattern, workers=workers),
+              )
+            found = [c.get_rect() for c in distance_map.find_matching_points(threshold)]
+            print(
+                f'{size:>6}x{size:<6} {workers:>8} {elapsed:>9.3f} {len(found):>8}'
+                f' {str(found == expected):>5} {base_time/elapsed:>7.1f}x'
+              )
+
+####################################################################################################
+
+arper = argparse.ArgumentParser(description='Benchmark the RME pattern matching algorithm.')
+
+arper.add_argument(
+    '--sizes',
+    dest='sizes',
+    nargs='+',
+    type=int,
+    default=[1024, 2048, 4096, 6400],
+    help='Width (and height) of each synthetic target image.',
+  )
+
+arper.add_argument(
+    '--pattern-size',
+    dest='pattern_size',
+    type=int,
+    default=16,
+    help='Width (and height) of the synthetic pattern image.',
+  )
+
+arper.add_argument(
+    '--pyramid-levels',
+    dest='pyramid_levels',
+    nargs='+',
+    type=int,
+    default=[1, 2, 3],
+    help='Pyramid levels to compare against exhaustive search.',
+  )
+
+arper.add_argument(
+    '--threshold',
+    dest='threshold',
+    type=float,
+    default=0.9,
+    help='Similarity threshold (between 0.5 and 1.0) used to measure recall.',
+  )
+
+arper.add_argument(
+    '--memory-budgets',
+    dest='memory_budgets',
+    nargs='+',
+    type=byte_size,
+    default=[64 << 20, 16 << 20],
+    help='Memory budgets (e.g. "64M") to compare against computing the whole distance map.',
+  )
+
+arper.add_argument(
+    '--workers',
+    dest='workers',
+    nargs='+',
+    type=int,
+    default=[2, 4, 8],
+    help='Numbers of threads to compare against computing the distance map in one thread.',
+  )
+
+def main():
+    args = arper.parse_args()
+    bench_tile_minima(args.sizes, args.pattern_size)
+    print()
+    bench_non_maximum_suppression([1000, 2000, 20000, 50000])
+    print()
+    bench_pyramid(args.sizes, args.pyramid_levels, args.threshold)
+    print()
+    bench_strips(args.sizes, args.memory_budgets, args.threshold)
+    print()
+    bench_workers(args.sizes, args.workers, args.threshold)
+
+if __name__ == '__main__':
+    main()
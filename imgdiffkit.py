@@ -3,6 +3,7 @@
 import DataPrepKit.ImageDiffGUI as gui
 from DataPrepKit.ImageDiff import ImageDiff
 
+import argparse
 import sys
 
 import PyQt5.QtWidgets as qt
@@ -10,8 +11,36 @@ import PyQt5.QtWidgets as qt
 ####################################################################################################
 
 def main():
+    arper = argparse.ArgumentParser(
+        description="""
+          Compare images to a reference image, pixel by pixel, in a GUI.
+          """,
+        exit_on_error=False,
+      )
+
+    arper.add_argument(
+        '--tar-shards',
+        dest='tar_shards',
+        action='store',
+        type=str,
+        default=None,
+        help="""
+          The maximum size in bytes, with an optional K, M or G
+          suffix, of each tar archive written by the "Save diff image
+          for every file into tar shards" action, which writes the
+          difference images into a few large archives rather than as
+          separate files.
+          """,
+      )
+
+    (config, remaining_argv) = arper.parse_known_args()
+
     app_model = ImageDiff()
-    app = qt.QApplication(sys.argv)
+    if config.tar_shards is not None:
+        app_model.set_tar_shards(config.tar_shards)
+    else:
+        pass
+    app = qt.QApplication([sys.argv[0]] + remaining_argv)
     app_window = gui.ImageDiffGUI(app_model)
     app_window.show()
     sys.exit(app.exec_())
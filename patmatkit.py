@@ -170,6 +170,235 @@ arper.add_argument(
       """
   )
 
+arper.add_argument(
+    '--pyramid-levels',
+    dest='pyramid_levels',
+    action='store',
+    default=None,
+    type=int,
+    help="""
+        For the  RME algorithm only. By  default the pattern  image is
+        compared  to  every  position  in the  input  image  at  full
+        resolution.  Set this  to a  number greater  than zero  to run
+        coarse-to-fine instead:  both images are reduced  in size by
+        half this many times, and only regions of the input image that
+        are similar  to the pattern  at the reduced size  are searched
+        again at full resolution. This  is much faster on large input
+        images,  but  matches  that  are only  barely  similar  to  the
+        pattern might be missed.
+      """,
+  )
+
+arper.add_argument(
+    '--memory-budget',
+    dest='memory_budget',
+    action='store',
+    default=None,
+    type=util.byte_size,
+    help="""
+        For the  RME algorithm only. By default  the distance map for
+        the whole input image is  computed at once, which needs about
+        eight bytes per pixel  of the input image. Set this to a number
+        of bytes  (for example "512M" or  "2G") to compute  the distance
+        map in horizontal  strips that each fit within  this budget, so
+        that very large input images can be searched.
+      """,
+  )
+
+arper.add_argument(
+    '--threads',
+    dest='threads',
+    action='store',
+    default=None,
+    type=int,
+    help="""
+        The number of threads used to search each input image. For the
+        RME algorithm, the input image is  divided into this many strips
+        which  are searched  at the  same time.  The default  is 1. In
+        the JSON config file this is the top-level "threads" parameter.
+      """,
+  )
+
+arper.add_argument(
+    '-j', '--jobs',
+    dest='jobs',
+    action='store',
+    default=None,
+    type=int,
+    help="""
+        The number of processes that search  input images at the same
+        time in batch mode. Each  process loads the pattern image only
+        once, and  the  files  written  are the  same  for  any number
+        of jobs. Each  process may  also  use "--threads"  threads.  The
+        default is 1.  In the JSON config file  this is the top-level
+        "jobs" parameter.
+      """,
+  )
+
+arper.add_argument(
+    '--prefetch-budget',
+    dest='prefetch_budget',
+    action='store',
+    default=None,
+    type=util.byte_size,
+    help="""
+        In batch mode, the next  few input images are decoded while the
+        current one  is searched. This  is the  maximum number of bytes
+        (for example "512M" or  "2G") of decoded images that may be
+        waiting  to be  searched.  At least  one image  is  always
+        decoded ahead. The  default  is 256M. In  the  JSON  config file
+        this is the top-level "prefetch_budget" parameter.
+      """,
+  )
+
+arper.add_argument(
+    '--manifest',
+    dest='manifest',
+    action='store_true',
+    default=False,
+    help="""
+        In batch mode,  record each input image that  is searched in a
+        file "manifest.jsonl" in the output directory, along with the
+        size  and  modification  time  of  the input  image,  a  hash  of
+        the configuration,  and the files written.  When the batch is
+        run  again,  input images  that  were  already searched without
+        errors are skipped,  unless they or the configuration  changed.
+        An interrupted batch  run again resumes where  it stopped.  In
+        the JSON config file this is the top-level "manifest" parameter.
+      """,
+  )
+
+arper.add_argument(
+    '--manifest-hash',
+    dest='manifest_hash',
+    action='store_true',
+    default=False,
+    help="""
+        Like "--manifest",  but  also compare  input  images by a  hash
+        of their content, which  means reading every input image even
+        if it is skipped. In the  JSON config file this is the top-level
+        "manifest_hash" parameter.
+      """,
+  )
+
+arper.add_argument(
+    '--annotations',
+    dest='annotations',
+    action='store',
+    default=None,
+    choices=['coco', 'yolo'],
+    help="""
+        In batch mode, do not  write any image files, instead write the
+        matched regions as object detection annotations of each input
+        image  into the  output directory, which  is  much  faster when
+        only  the bounding  boxes are needed.  With "coco",  a  single
+        file "annotations.json" is written when the batch is done. With
+        "yolo",  a file  "labels/<input>.txt" is  written for  each input
+        image, in sub-directories like those of the inputs, and the class
+        names are written to "classes.txt". Each
+        crop region is  a category.  In the  JSON config  file this is
+        the top-level "annotations" parameter.
+      """,
+  )
+
+arper.add_argument(
+    '--tar-shards',
+    dest='tar_shards',
+    action='store',
+    default=None,
+    type=util.byte_size,
+    help="""
+        In batch mode, write the cropped images into tar archives of at
+        most this many bytes (e.g. "1G") in the output directory, named
+        "shard-000000.tar", "shard-000001.tar", and so on, rather than
+        as separate files. Next to each archive is an index ".jsonl"
+        with the offset, size and match record of each image in it. In
+        the JSON config file this is the top-level "tar_shards"
+        parameter.
+      """,
+  )
+
+arper.add_argument(
+    '--array-dataset',
+    dest='array_dataset',
+    action='store_true',
+    default=False,
+    help="""
+        In batch mode, append the cropped images to one array for each
+        crop region, "<label>/crops.npy" in the output directory, rather
+        than writing them as separate files, so that they can be loaded
+        without decoding with "numpy.load(path, mmap_mode='r')". Next to
+        each array, "metadata.npy" holds the number of the input image
+        in "sources.txt", the position and the match score of each crop.
+        In the JSON config file this is the top-level "array_dataset"
+        parameter.
+      """,
+  )
+
+arper.add_argument(
+    '--match-records',
+    dest='match_records',
+    action='store',
+    default=None,
+    type=Path,
+    help="""
+        In batch mode, write one record  for each region cropped from an
+        input image to this file, as  soon as each input image has been
+        searched. Each record holds the input image, the pattern and crop
+        region labels, the match score, the four corners of the region
+        in the input image and its bounding rectangle, the homography
+        for  the ORB algorithm,  and  the path  of  the file  written.  A
+        file ending in ".jsonl" holds one JSON object per line, a file
+        ending in ".csv" holds comma-separated values.  In the JSON config
+        file this is the top-level "match_records" parameter.
+      """,
+  )
+
+arper.add_argument(
+    '--cache-dir',
+    dest='cache_dir',
+    action='store',
+    default=None,
+    type=Path,
+    help="""
+        A directory  in which the  results of pattern matching  on each
+        input image are stored. If the same input image is searched for
+        the same  pattern again, for  example with a  different threshold
+        or different crop regions, the stored result is used rather than
+        computing it again. By default no results are stored.
+      """,
+  )
+
+arper.add_argument(
+    '--cache-size',
+    dest='cache_size',
+    action='store',
+    default=None,
+    type=util.byte_size,
+    help="""
+        The  maximum number  of bytes  (for example  "512M" or  "2G") the
+        "--cache-dir" may hold. When it holds more, the results that
+        were least recently used are deleted. The default is 1G.
+      """,
+  )
+
+arper.add_argument(
+    '--image-cache-size',
+    dest='image_cache_size',
+    action='store',
+    default=None,
+    type=util.byte_size,
+    help="""
+        The maximum number of bytes (for example "512M" or "2G") of
+        decoded images kept in memory, so that an image file used again,
+        such as the pattern image on every input image, is not decoded
+        again unless it changes on disk. When more is needed, the images
+        least recently used are forgotten. The default is 512M. In the
+        JSON config file this is the top-level "image_cache_size"
+        parameter.
+      """,
+  )
+
 arper.add_argument(
     '--encoding',
     dest='encoding',
@@ -231,7 +460,13 @@ def main():
         appWindow.show()
         sys.exit(app.exec_())
     else:
-        app_model.batch_crop_matched_patterns()
+        errors = app_model.batch_crop_matched_patterns()
+        for (path, message) in errors:
+            sys.stderr.write(f'{str(path)!r}: {message}\n')
+        if len(errors) > 0:
+            sys.exit(1)
+        else:
+            pass
 
 ####################################################################################################
 
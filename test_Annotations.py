@@ -0,0 +1,142 @@
+import unittest
+from pathlib import Path
+import json
+import tempfile
+
+from DataPrepKit.Annotations import AnnotationWriter, clip_box
+from test_CLIBatchModeRME import CLIBatchModeRME
+import test_CLIBatchJobs
+
+class TestAnnotations(unittest.TestCase):
+    """Checks that a batch run with "--annotations" writes the same
+    regions as the image files it would otherwise write, and no image
+    files."""
+
+    def run_batch(self, output_dir, directory, extra_args=()):
+        """Run the RME batch into 'output_dir', writing the match records
+        into 'directory'."""
+        self.assertEqual([], CLIBatchModeRME.run_batch(
+            CLIBatchModeRME.rme_args(
+                output_dir, [f'--match-records={directory / "records.jsonl"!s}'] + list(extra_args),
+              ),
+          ))
+
+    def crop_boxes(self, directory):
+        """Run the batch writing image files, and return the boxes of the
+        match records of the files written."""
+        self.run_batch(directory / 'crops', directory)
+        records = [json.loads(line) for line in (directory / 'records.jsonl').read_text().splitlines()]
+        return sorted(
+            (Path(record['source']).name, record['label'], [record[key] for key in ['x', 'y', 'width', 'height']]) \
+            for record in records
+          )
+
+    def test_coco(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            expected = self.crop_boxes(directory)
+            output_dir = directory / 'coco'
+            self.run_batch(output_dir, directory, ['--annotations=coco'])
+            self.assertEqual([output_dir / 'annotations.json'], list(output_dir.glob('**/*.*')))
+            coco = json.loads((output_dir / 'annotations.json').read_text())
+            self.assertEqual(['left', 'right'], [category['name'] for category in coco['categories']])
+            self.assertEqual(
+                sorted(Path(path).name for path in CLIBatchModeRME.input_images),
+                sorted(Path(image['file_name']).name for image in coco['images']),
+              )
+            names = {image['id']: Path(image['file_name']).name for image in coco['images']}
+            categories = {category['id']: category['name'] for category in coco['categories']}
+            self.assertEqual(
+                expected,
+                sorted(
+                    (names[annotation['image_id']], categories[annotation['category_id']], annotation['bbox']) \
+                    for annotation in coco['annotations']
+                  ),
+              )
+            # No file was written, so the records have no output path.
+            records = [json.loads(line) for line in (directory / 'records.jsonl').read_text().splitlines()]
+            self.assertEqual({None}, {record['output'] for record in records})
+
+    def test_yolo_jobs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            expected = self.crop_boxes(directory)
+            output_dir = directory / 'yolo'
+            self.run_batch(output_dir, directory, ['--annotations=yolo', '--jobs=2'])
+            self.assertEqual('left\nright\n', (output_dir / 'classes.txt').read_text())
+            boxes = []
+            for path in CLIBatchModeRME.input_images:
+                label_path = output_dir / 'labels' / (Path(path).stem + '.txt')
+                self.assertTrue(label_path.exists())
+                for line in label_path.read_text().splitlines():
+                    (category, cx, cy, w, h) = line.split()
+                    boxes.append((Path(path).name, ['left', 'right'][int(category)], [float(v) for v in (cx, cy, w, h)]))
+            self.assertEqual(len(expected), len(boxes))
+            self.assertEqual(
+                [(name, label) for (name, label, _box) in expected],
+                sorted((name, label) for (name, label, _box) in boxes),
+              )
+
+    def test_orb_coco(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            (pattern, inputs) = test_CLIBatchJobs.TestCLI_BatchJobs.write_orb_fixtures(None, directory)
+            output_dir = directory / 'coco'
+            errors = CLIBatchModeRME.run_batch(
+                [ '--algorithm=ORB', '--threshold=50', f'--pattern={pattern}',
+                  f'--output-dir={output_dir!s}', '--annotations=coco',
+                ] + inputs
+              )
+            self.assertEqual([], errors)
+            coco = json.loads((output_dir / 'annotations.json').read_text())
+            self.assertEqual(['match'], [category['name'] for category in coco['categories']])
+            self.assertGreater(len(coco['annotations']), 0)
+            for annotation in coco['annotations']:
+                self.assertEqual(8, len(annotation['segmentation'][0]))
+                self.assertGreater(annotation['area'], 0)
+
+    def test_clip_box(self):
+        record = {'x': -5.0, 'y': 90.0, 'width': 20.0, 'height': 20.0}
+        self.assertEqual((0, 90.0, 15.0, 10.0), clip_box(record, (100, 100)))
+        self.assertEqual((5.0, 100.0, 20.0, 10.0), clip_box(record, (200, 110), offset=(10, 10)))
+        self.assertIsNone(clip_box(record, (100, 100), offset=(0, 20)))
+
+    def test_coco_append(self):
+        record = \
+          { 'x': 1.0, 'y': 2.0, 'width': 3.0, 'height': 4.0, 'score': 0.5,
+            'pattern': '', 'label': 'b', 'quad': [[1, 2], [4, 2], [4, 6], [1, 6]],
+          }
+        with tempfile.TemporaryDirectory() as directory:
+            writer = AnnotationWriter(directory, 'coco', categories=['a', 'b'])
+            writer.add_image('one.png', (10, 10), [record])
+            writer.add_image('two.png', (10, 10), [record, record])
+            writer.close()
+            writer = AnnotationWriter(directory, 'coco', categories=['b', 'c'], append=True)
+            writer.add_image('two.png', (10, 10), [])
+            writer.close()
+            coco = json.loads((Path(directory) / 'annotations.json').read_text())
+            self.assertEqual(['a', 'b', 'c'], [category['name'] for category in coco['categories']])
+            self.assertEqual(['one.png', 'two.png'], [image['file_name'] for image in coco['images']])
+            self.assertEqual(1, len(coco['annotations']))
+            self.assertEqual(1, coco['annotations'][0]['category_id'])
+
+    def test_yolo_same_names(self):
+        record = \
+          { 'x': 1.0, 'y': 2.0, 'width': 3.0, 'height': 4.0, 'score': 0.5,
+            'pattern': '', 'label': 'b', 'quad': [[1, 2], [4, 2], [4, 6], [1, 6]],
+          }
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            output_dir = directory / 'yolo'
+            # Inputs with the same name in different directories each get
+            # their own label file.
+            inputs = [str(directory / 'a' / 'one.png'), str(directory / 'b' / 'one.png')]
+            writer = AnnotationWriter(output_dir, 'yolo', categories=['b'], inputs=inputs)
+            writer.add_image(inputs[0], (10, 10), [record])
+            writer.add_image(inputs[1], (10, 10), [])
+            writer.close()
+            self.assertEqual(1, len((output_dir / 'labels' / 'a' / 'one.txt').read_text().splitlines()))
+            self.assertEqual('', (output_dir / 'labels' / 'b' / 'one.txt').read_text())
+            # Inputs that only differ by their suffix cannot.
+            with self.assertRaises(ValueError):
+                AnnotationWriter(output_dir, 'yolo', inputs=[inputs[0], str(directory / 'a' / 'one.jpg')])
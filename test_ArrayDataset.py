@@ -0,0 +1,71 @@
+import unittest
+from pathlib import Path
+import json
+import tempfile
+
+import cv2 as cv
+import numpy as np
+
+from DataPrepKit.ArrayDataset import GrowableArray, load_array_dataset
+from test_CLIBatchModeRME import CLIBatchModeRME
+
+class TestArrayDataset(unittest.TestCase):
+    """Checks that a batch run with "--array-dataset" appends the same
+    images to the arrays of each crop region as it would otherwise
+    write as separate files."""
+
+    def test_batch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            records_path = directory / 'records.jsonl'
+            self.assertEqual([], CLIBatchModeRME.run_batch(
+                CLIBatchModeRME.rme_args(directory / 'files', [f'--match-records={records_path!s}']),
+              ))
+            records = [json.loads(line) for line in records_path.read_text().splitlines()]
+            self.assertGreater(len(records), 0)
+            for jobs in [1, 2]:
+                with self.subTest(jobs=jobs):
+                    arrays_dir = directory / f'arrays-{jobs}'
+                    self.assertEqual([], CLIBatchModeRME.run_batch(
+                        CLIBatchModeRME.rme_args(arrays_dir, ['--array-dataset', f'--jobs={jobs}']),
+                      ))
+                    self.assertEqual([], list(arrays_dir.glob('**/*.png')))
+                    count = 0
+                    for label in ['left', 'right']:
+                        (crops, metadata, sources) = load_array_dataset(arrays_dir, label)
+                        self.assertIsInstance(crops, np.memmap)
+                        self.assertEqual(len(crops), len(metadata))
+                        count += len(crops)
+                        # Each crop is the same image that would have been
+                        # written to a file.
+                        expected = \
+                          { (record['source'], round(record['x']), round(record['y'])): record \
+                            for record in records if record['label'] == label \
+                          }
+                        for (crop, row) in zip(crops, metadata):
+                            record = expected[(sources[row['source']], round(row['x']), round(row['y']))]
+                            self.assertEqual(record['score'], row['score'])
+                            self.assertTrue((cv.imread(record['output']) == crop).all())
+                    self.assertEqual(len(records), count)
+
+    def test_growable_array(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'a' / 'rows.npy'
+            rows = np.arange(5 * 2 * 3, dtype=np.uint16).reshape(5, 2, 3)
+            array = GrowableArray(path, (2, 3), np.uint16)
+            self.assertEqual(0, len(np.load(path)))
+            for row in rows[:3]:
+                array.append(row)
+            # The file can be loaded while rows are still being added.
+            self.assertTrue((rows[:3] == np.load(path, mmap_mode='r')).all())
+            with self.assertRaises(ValueError):
+                array.append(np.zeros((3, 2), dtype=np.uint16))
+            array.close()
+            # Rows are added to the end of an existing array.
+            array = GrowableArray(path, (2, 3), np.uint16)
+            for row in rows[3:]:
+                array.append(row)
+            array.close()
+            self.assertTrue((rows == np.load(path)).all())
+            with self.assertRaises(ValueError):
+                GrowableArray(path, (2, 3), np.uint8)
@@ -0,0 +1,114 @@
+import unittest
+from unittest import mock
+from pathlib import Path
+import json
+import os
+import shutil
+import tempfile
+
+import patmatkit
+from DataPrepKit.SingleFeatureMultiCrop import SingleFeatureMultiCrop
+from DataPrepKit.BatchManifest import MANIFEST_FILE
+from test_CLIBatchModeRME import CLIBatchModeRME
+
+class TestBatchManifest(unittest.TestCase):
+    """Checks that a batch run with "--manifest" searches again only the
+    input images that are new, changed, failed, or were searched with
+    a different configuration."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        directory = Path(self.directory.name)
+        self.inputs = []
+        for image in CLIBatchModeRME.input_images:
+            path = directory / 'inputs' / Path(image).name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(image, path)
+            self.inputs.append(str(path))
+        self.output_dir = directory / 'outputs'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_batch(self, extra_args=[]):
+        """Returns the list of input images that were searched."""
+        cli_config = patmatkit.arper.parse_args(
+            [ '--algorithm=RME', '--threshold=90', '--manifest',
+              f'--pattern={CLIBatchModeRME.pattern_image}',
+              f'--crop-regions={CLIBatchModeRME.crop_regions}',
+              f'--output-dir={self.output_dir!s}',
+            ] + extra_args + self.inputs
+          )
+        app_model = SingleFeatureMultiCrop(cli_config)
+        with mock.patch.object(
+                SingleFeatureMultiCrop, 'batch_crop_file',
+                autospec=True, side_effect=SingleFeatureMultiCrop.batch_crop_file,
+              ) as batch_crop_file:
+            self.assertEqual([], app_model.batch_crop_matched_patterns())
+        # In one process, each image is passed as a loaded CachedCVImageLoader.
+        return [str(call.args[1].get_path()) for call in batch_crop_file.call_args_list]
+
+    def manifest_lines(self):
+        return (self.output_dir / MANIFEST_FILE).read_text().splitlines()
+
+    def test_rerun(self):
+        # The order of the input images is not defined by the FileSet.
+        self.assertEqual(sorted(self.inputs), sorted(self.run_batch()))
+        entries = [json.loads(line) for line in self.manifest_lines()]
+        self.assertEqual(sorted(self.inputs), sorted(entry['input'] for entry in entries))
+        outputs = [output for entry in entries for output in entry['outputs']]
+        self.assertGreater(len(outputs), 0)
+        self.assertEqual(
+            sorted(outputs),
+            sorted(path.relative_to(self.output_dir).as_posix() \
+                   for path in self.output_dir.glob('*/*.png')),
+          )
+        self.assertEqual([], self.run_batch())
+        self.assertEqual(len(self.inputs), len(self.manifest_lines()))
+
+    def test_changed_input(self):
+        self.run_batch()
+        stat = os.stat(self.inputs[1])
+        os.utime(self.inputs[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertEqual([self.inputs[1]], self.run_batch())
+        self.assertEqual([], self.run_batch())
+
+    def test_content_hash(self):
+        self.run_batch(['--manifest-hash'])
+        # Same size and modification time, different content.
+        stat = os.stat(self.inputs[0])
+        shutil.copyfile(self.inputs[2], self.inputs[0])
+        os.utime(self.inputs[0], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual([self.inputs[0]], self.run_batch(['--manifest-hash']))
+
+    def test_changed_config(self):
+        self.run_batch()
+        self.assertEqual(sorted(self.inputs), sorted(self.run_batch(['--overlap'])))
+        self.assertEqual([], self.run_batch(['--overlap', '--jobs=2', '--threads=2']))
+        # The memory budget is in the "RME" algorithm config.
+        self.assertEqual([], self.run_batch(['--overlap', '--memory-budget=64K']))
+
+    def test_interrupted(self):
+        self.run_batch()
+        # Cut the manifest in the middle of the last line, as if the
+        # batch was stopped while writing it.
+        last = json.loads(self.manifest_lines()[-1])['input']
+        text = (self.output_dir / MANIFEST_FILE).read_text()
+        (self.output_dir / MANIFEST_FILE).write_text(text[:-20])
+        self.assertEqual([last], self.run_batch())
+        self.assertEqual([], self.run_batch())
+        self.assertEqual(last, json.loads(self.manifest_lines()[-1])['input'])
+
+    def test_jobs(self):
+        self.run_batch()
+        entries = [json.loads(line) for line in self.manifest_lines()]
+        shutil.rmtree(self.output_dir)
+        # Input images searched by the worker processes are recorded
+        # with the same outputs.
+        self.run_batch(['--jobs=2'])
+        key = lambda entry: entry['input']
+        self.assertEqual(
+            sorted(entries, key=key),
+            sorted((json.loads(line) for line in self.manifest_lines()), key=key),
+          )
+        self.assertEqual([], self.run_batch())
@@ -0,0 +1,94 @@
+import unittest
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import shutil
+import tempfile
+import threading
+
+import cv2 as cv
+
+from DataPrepKit.SingleFeatureMultiCrop import bounded_map
+from test_CLIBatchModeRME import CLIBatchModeRME
+from bench_ORBMatcher import synthetic_orb_target
+
+class TestCLI_BatchJobs(unittest.TestCase):
+    """Checks that searching input images with a pool of processes
+    ("--jobs") writes exactly the same files as searching them one at a
+    time, and that a file which fails does not stop the batch."""
+
+    def dir_contents(self, output_dir):
+        return \
+          { path.relative_to(output_dir): path.read_bytes() \
+            for path in output_dir.glob('**/*') if path.is_file() \
+          }
+
+    def write_orb_fixtures(self, directory):
+        """The RME fixtures are too small for ORB to find any features, so
+        write a few synthetic target images containing copies of the
+        same pattern."""
+        inputs = []
+        for count in [1, 2, 4]:
+            (target, pattern, _centers) = synthetic_orb_target(512, 512, 128, count)
+            path = directory / f'target{count}.png'
+            cv.imwrite(str(path), target)
+            inputs.append(str(path))
+        cv.imwrite(str(directory / 'pattern.png'), pattern)
+        return (str(directory / 'pattern.png'), inputs)
+
+    def test_jobs_same_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            (orb_pattern, orb_inputs) = self.write_orb_fixtures(directory)
+            rme_args = [f'--pattern={CLIBatchModeRME.pattern_image}'] + CLIBatchModeRME.input_images
+            cases = [
+                ('RME', ['--algorithm=RME', '--threshold=90'] + rme_args),
+                ('RME-regions', ['--algorithm=RME', '--threshold=90', f'--crop-regions={CLIBatchModeRME.crop_regions}'] + rme_args),
+                ('ORB', ['--algorithm=ORB', '--threshold=50', f'--pattern={orb_pattern}'] + orb_inputs),
+              ]
+            for (label, args) in cases:
+                with self.subTest(case=label):
+                    outputs = []
+                    for jobs in [1, 2]:
+                        output_dir = directory / label / f'jobs-{jobs}'
+                        errors = CLIBatchModeRME.run_batch(args + [f'--jobs={jobs}', f'--output-dir={output_dir!s}'])
+                        self.assertEqual([], errors)
+                        outputs.append(self.dir_contents(output_dir))
+                    self.assertGreater(len(outputs[0]), 0)
+                    self.assertEqual(outputs[0], outputs[1])
+
+    def test_jobs_collect_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            inputs = directory / 'inputs'
+            inputs.mkdir()
+            for path in CLIBatchModeRME.input_images:
+                shutil.copy(path, inputs)
+            broken = inputs / 'broken.png'
+            broken.write_bytes(b'not an image')
+            for jobs in [1, 2]:
+                with self.subTest(jobs=jobs):
+                    output_dir = directory / f'jobs-{jobs}'
+                    errors = CLIBatchModeRME.run_batch(
+                        [ '--algorithm=RME', '--threshold=90',
+                          f'--pattern={CLIBatchModeRME.pattern_image}',
+                          f'--jobs={jobs}', f'--output-dir={output_dir!s}', str(inputs),
+                        ],
+                      )
+                    self.assertEqual([broken.name], [Path(path).name for (path, _) in errors])
+                    self.assertIn('Failed to load image file', errors[0][1])
+                    self.assertGreater(len(self.dir_contents(output_dir)), 0)
+
+    def test_bounded_map(self):
+        lock = threading.Lock()
+        started = []
+        def square(x):
+            with lock:
+                started.append(x)
+            return x * x
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = bounded_map(pool, square, 3, range(10))
+            for (i, result) in enumerate(results):
+                self.assertEqual(i * i, result)
+                # No more than the window is submitted ahead of the result
+                # being consumed.
+                self.assertLessEqual(len(started), i + 3)
@@ -79,10 +79,27 @@ class CLIBatchModeRME():
     def __str__(self):
         return repr(self)
 
-    def run(self, args):
+    @staticmethod
+    def rme_args(output_dir, extra_args=()):
+        """The CLI arguments of a batch run of the RME algorithm on the
+        test fixtures, cropping the fixture crop regions into
+        'output_dir', used by the tests of the other batch options."""
+        return \
+          [ '--algorithm=RME', '--threshold=90',
+            f'--pattern={CLIBatchModeRME.pattern_image}',
+            f'--crop-regions={CLIBatchModeRME.crop_regions}',
+            f'--output-dir={output_dir!s}',
+          ] + list(extra_args) + CLIBatchModeRME.input_images
+
+    @staticmethod
+    def run_batch(args):
+        """Run a batch with the CLI 'args', return the list of errors."""
         cli_config = patmatkit.arper.parse_args(args)
         app_model = SingleFeatureMultiCrop(cli_config)
-        app_model.batch_crop_matched_patterns()
+        return app_model.batch_crop_matched_patterns()
+
+    def run(self, args):
+        CLIBatchModeRME.run_batch(args)
 
     def compare_dir_contents(self, output_dir, compare_dir):
         output_tree = { f for f in output_dir.glob('**/*') if f.is_file() }
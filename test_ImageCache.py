@@ -0,0 +1,111 @@
+import unittest
+from unittest import mock
+from pathlib import Path
+import os
+import tempfile
+
+import cv2 as cv
+import numpy as np
+
+import DataPrepKit.ImageCache as image_cache_module
+from DataPrepKit.ImageCache import ImageCache, image_cache
+from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
+from test_CLIBatchModeRME import CLIBatchModeRME
+
+class TestImageCache(unittest.TestCase):
+    """Checks that an image file is decoded only once while it is in the
+    cache and unchanged, and that the cache stays within its budget."""
+
+    def write_images(self, directory, count, size=32):
+        rng = np.random.default_rng(0)
+        paths = []
+        for i in range(count):
+            path = directory / f'{i}.png'
+            cv.imwrite(str(path), rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+            paths.append(path)
+        return paths
+
+    def test_shared_loaders(self):
+        with tempfile.TemporaryDirectory() as directory:
+            (path,) = self.write_images(Path(directory), 1)
+            with mock.patch.object(image_cache_module.cv, 'imread', wraps=cv.imread) as imread:
+                loaders = [CachedCVImageLoader(path=path) for _ in range(3)]
+                for loader in loaders:
+                    loader.load_image()
+                self.assertEqual(1, imread.call_count)
+            self.assertIs(loaders[0].get_raw_image(), loaders[2].get_raw_image())
+            self.assertFalse(loaders[0].get_raw_image().flags.writeable)
+            # A file that changes on disk is decoded again.
+            changed = np.zeros((16, 16, 3), dtype=np.uint8)
+            cv.imwrite(str(path), changed)
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+            loader = CachedCVImageLoader(path=path)
+            loader.load_image()
+            self.assertTrue((changed == loader.get_image()).all())
+            # So is a file already held by a loader.
+            loaders[0].load_image()
+            self.assertIs(loader.get_raw_image(), loaders[0].get_raw_image())
+
+    def test_uncached_loader(self):
+        with tempfile.TemporaryDirectory() as directory:
+            (path,) = self.write_images(Path(directory), 1)
+            image_cache.clear()
+            loader = CachedCVImageLoader(path=path, cache=False)
+            with mock.patch.object(image_cache_module.cv, 'imread', wraps=cv.imread) as imread:
+                loader.load_image()
+                loader.load_image()
+                self.assertEqual(1, imread.call_count)
+                changed = np.zeros((16, 16, 3), dtype=np.uint8)
+                cv.imwrite(str(path), changed)
+                stat = os.stat(path)
+                os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+                loader.load_image()
+                self.assertEqual(2, imread.call_count)
+            self.assertTrue((changed == loader.get_image()).all())
+            self.assertEqual(0, image_cache.get_total_bytes())
+
+    def test_budget(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = self.write_images(Path(directory), 4)
+            image_bytes = 32 * 32 * 3
+            cache = ImageCache(max_bytes=3 * image_bytes)
+            for path in paths[:3]:
+                cache.load(path)
+            # Use the first image, so the second is least recently used.
+            cache.load(paths[0])
+            cache.load(paths[3])
+            self.assertEqual(3 * image_bytes, cache.get_total_bytes())
+            self.assertEqual((1, 4), (cache.hits, cache.misses))
+            for path in [paths[0], paths[2], paths[3]]:
+                cache.load(path)
+            self.assertEqual((4, 4), (cache.hits, cache.misses))
+            cache.load(paths[1])
+            self.assertEqual((4, 5), (cache.hits, cache.misses))
+            cache.set_max_bytes(image_bytes)
+            self.assertEqual(image_bytes, cache.get_total_bytes())
+            # An image larger than the budget is returned but not kept.
+            cache.set_max_bytes(image_bytes - 1)
+            self.assertIsNotNone(cache.load(paths[0]))
+            self.assertEqual(0, cache.get_total_bytes())
+
+    def test_missing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ImageCache()
+            self.assertIsNone(cache.load(Path(directory) / 'missing.png'))
+            (Path(directory) / 'bad.png').write_bytes(b'not an image')
+            self.assertIsNone(cache.load(Path(directory) / 'bad.png'))
+            with self.assertRaises(ValueError):
+                CachedCVImageLoader().load_image(path=Path(directory) / 'missing.png')
+
+    def test_batch_targets_not_kept(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for jobs in [1, 2]:
+                with self.subTest(jobs=jobs):
+                    image_cache.clear()
+                    self.assertEqual([], CLIBatchModeRME.run_batch(
+                        CLIBatchModeRME.rme_args(Path(directory) / str(jobs), [f'--jobs={jobs}']),
+                      ))
+                    # Only the reference image is kept, not the target images.
+                    reference = cv.imread(str(CLIBatchModeRME.pattern_image))
+                    self.assertEqual(reference.nbytes, image_cache.get_total_bytes())
@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+from pathlib import Path
+import tempfile
+
+import cv2 as cv
+import numpy as np
+
+import DataPrepKit.ImageCache as image_cache_module
+from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
+from DataPrepKit.ImagePrefetcher import ImagePrefetcher
+
+class TestImagePrefetcher(unittest.TestCase):
+    """Checks that images decoded ahead of time are yielded in order,
+    within the memory budget, and are not decoded again when used."""
+
+    def write_images(self, directory, count, size=64):
+        rng = np.random.default_rng(0)
+        images = []
+        paths = []
+        for i in range(count):
+            image = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+            path = directory / f'image{i:02}.png'
+            cv.imwrite(str(path), image)
+            images.append(image)
+            paths.append(path)
+        return (paths, images)
+
+    def test_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            (paths, images) = self.write_images(Path(directory), 10)
+            loaders = list(ImagePrefetcher(paths, memory_budget=1 << 20))
+            self.assertEqual(paths, [loader.get_path() for loader in loaders])
+            for (image, loader) in zip(images, loaders):
+                self.assertTrue((image == loader.get_image()).all())
+
+    def test_memory_budget(self):
+        with tempfile.TemporaryDirectory() as directory:
+            (paths, images) = self.write_images(Path(directory), 10)
+            image_bytes = images[0].nbytes
+            for ahead in [1, 3]:
+                with self.subTest(ahead=ahead):
+                    prefetcher = ImagePrefetcher(paths, memory_budget=ahead * image_bytes)
+                    count = 0
+                    for loader in prefetcher:
+                        self.assertLessEqual(len(prefetcher.pending), ahead)
+                        self.assertLessEqual(prefetcher.queued_bytes(), ahead * image_bytes)
+                        count += 1
+                    self.assertEqual(len(paths), count)
+
+    def test_failed_image(self):
+        with tempfile.TemporaryDirectory() as directory:
+            (paths, _images) = self.write_images(Path(directory), 3)
+            broken = Path(directory) / 'broken.png'
+            broken.write_bytes(b'not an image')
+            loaders = list(ImagePrefetcher(paths[:1] + [broken] + paths[1:]))
+            self.assertEqual(4, len(loaders))
+            self.assertIsNone(loaders[1].get_image())
+            with self.assertRaises(ValueError):
+                loaders[1].load_image()
+            self.assertIsNotNone(loaders[2].get_image())
+
+    def test_load_image_reuse(self):
+        with tempfile.TemporaryDirectory() as directory:
+            (paths, _images) = self.write_images(Path(directory), 1)
+            loader = CachedCVImageLoader(path=paths[0])
+            with mock.patch.object(image_cache_module.cv, 'imread', wraps=cv.imread) as imread:
+                loader.load_image()
+                loader.load_image()
+                loader.load_image(path=paths[0])
+                self.assertEqual(1, imread.call_count)
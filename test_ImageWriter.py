@@ -0,0 +1,92 @@
+import unittest
+from pathlib import Path
+import tempfile
+
+import cv2 as cv
+import numpy as np
+
+from DataPrepKit.ImageWriter import ImageWriter
+
+class TestImageWriter(unittest.TestCase):
+    """Checks that images written on the encoder threads are complete
+    when 'flush()' returns, and that errors are returned with the
+    path and source of the image that failed."""
+
+    def test_write(self):
+        rng = np.random.default_rng(0)
+        image = rng.integers(0, 256, (200, 300, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            for max_bytes in [1, 1 << 20]:
+                with self.subTest(max_bytes=max_bytes):
+                    writer = ImageWriter(workers=3, max_bytes=max_bytes)
+                    paths = []
+                    for i in range(20):
+                        path = directory / f'{max_bytes}-{i:02}.png'
+                        # Views into the same image are written without copying.
+                        writer.write(path, image[i:i+50, i:i+60], source='image')
+                        paths.append(path)
+                    self.assertEqual([], writer.flush())
+                    for (i, path) in enumerate(paths):
+                        self.assertTrue((image[i:i+50, i:i+60] == cv.imread(str(path))).all())
+                    writer.close()
+
+    def test_errors(self):
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            writer = ImageWriter()
+            writer.write(directory / 'good.png', image, source='a')
+            writer.write(directory / 'missing' / 'bad.png', image, source='b')
+            writer.report('c', str(directory / 'other.png'), 'crop region out of bounds')
+            writer.write(directory / 'missing' / 'bad.png', image, source='d')
+            errors = writer.flush()
+            self.assertEqual(['b', 'c', 'd'], [source for (source, _path, _error) in errors])
+            self.assertEqual(str(directory / 'missing' / 'bad.png'), errors[0][1])
+            self.assertEqual([], writer.flush())
+            self.assertTrue((directory / 'good.png').exists())
+            writer.close()
+
+    def test_after_writes(self):
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            writer = ImageWriter(workers=2)
+            done = {}
+            def callback(source):
+                return lambda written, errors: done.setdefault(source, (sorted(written), errors))
+            writer.write(directory / 'a1.png', image, source='a')
+            writer.write(directory / 'a2.png', image, source='a')
+            writer.write(directory / 'missing' / 'b.png', image, source='b')
+            writer.after_writes('a', callback('a'))
+            writer.after_writes('b', callback('b'))
+            writer.after_writes('c', callback('c'))
+            # A source with no images is done right away.
+            self.assertEqual(([], []), done['c'])
+            writer.flush()
+            self.assertEqual(
+                [str(directory / 'a1.png'), str(directory / 'a2.png')],
+                done['a'][0],
+              )
+            self.assertEqual([], done['a'][1])
+            self.assertEqual([], done['b'][0])
+            self.assertEqual(str(directory / 'missing' / 'b.png'), done['b'][1][0][0])
+            writer.close()
+
+    def test_untracked_sources(self):
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            writer = ImageWriter(workers=2, track_sources=False)
+            for i in range(5):
+                writer.write(directory / f'{i}.png', image, source=i)
+            writer.write(directory / 'missing' / 'bad.png', image, source='b')
+            with writer.condition:
+                while writer.queued_count > 0:
+                    writer.condition.wait()
+                # Nothing is kept about the images that were written.
+                self.assertEqual({}, writer.sources)
+            with self.assertRaises(ValueError):
+                writer.after_writes(0, lambda written, errors: None)
+            self.assertEqual(['b'], [source for (source, _path, _error) in writer.flush()])
+            writer.close()
@@ -0,0 +1,133 @@
+import unittest
+from pathlib import Path
+import csv
+import json
+import tempfile
+from unittest import mock
+
+import cv2 as cv
+import numpy as np
+
+import DataPrepKit.ImageWriter as image_writer_module
+from DataPrepKit.MatchRecords import MatchRecordFile
+from DataPrepKit.SingleFeatureMultiCrop import SingleFeatureMultiCrop
+from test_CLIBatchModeRME import CLIBatchModeRME
+import test_CLIBatchJobs
+
+class TestMatchRecords(unittest.TestCase):
+    """Checks that a batch run with "--match-records" writes one record
+    for each file written, describing the region that was cropped."""
+
+    def read_jsonl(self, path):
+        return [json.loads(line) for line in Path(path).read_text().splitlines()]
+
+    def run_batch(self, output_dir, records, extra_args=()):
+        """Run the RME batch into 'output_dir', writing the match records
+        to the file 'records', and return the list of errors."""
+        return CLIBatchModeRME.run_batch(
+            CLIBatchModeRME.rme_args(output_dir, [f'--match-records={records!s}'] + list(extra_args)),
+          )
+
+    def test_rme_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            output_dir = directory / 'outputs'
+            self.assertEqual([], self.run_batch(output_dir, directory / 'records.jsonl'))
+            records = self.read_jsonl(directory / 'records.jsonl')
+            self.assertGreater(len(records), 0)
+            self.assertEqual(
+                sorted(str(path) for path in output_dir.glob('*/*.png')),
+                sorted(record['output'] for record in records),
+              )
+            # Each match is recorded once for each crop region.
+            ids = [(record['source'], record['id']) for record in records]
+            self.assertEqual(2 * len(set(ids)), len(ids))
+            for record in records:
+                self.assertIn(record['label'], ['left', 'right'])
+                self.assertGreaterEqual(record['score'], 0.9)
+                self.assertIsNone(record['homography'])
+                # The RME algorithm crops the rectangle as it is.
+                (x, y, width, height) = [round(record[key]) for key in ['x', 'y', 'width', 'height']]
+                source = cv.imread(record['source'])
+                self.assertTrue((source[y:y+height, x:x+width] == cv.imread(record['output'])).all())
+
+    def test_csv_jobs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            self.assertEqual([], self.run_batch(directory / 'outputs', directory / 'records.jsonl'))
+            expected = self.read_jsonl(directory / 'records.jsonl')
+            self.assertEqual([], self.run_batch(directory / 'outputs', directory / 'records.csv', ['--jobs=2']))
+            with open(directory / 'records.csv', newline='') as f:
+                rows = list(csv.DictReader(f))
+            key = lambda record: record['output']
+            expected.sort(key=key)
+            rows.sort(key=key)
+            self.assertEqual([record['output'] for record in expected], [row['output'] for row in rows])
+            for (record, row) in zip(expected, rows):
+                self.assertEqual(record['quad'], json.loads(row['quad']))
+                self.assertEqual(record['score'], float(row['score']))
+                self.assertEqual('', row['homography'])
+
+    def test_orb_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            (pattern, inputs) = test_CLIBatchJobs.TestCLI_BatchJobs.write_orb_fixtures(None, directory)
+            errors = CLIBatchModeRME.run_batch(
+                [ '--algorithm=ORB', '--threshold=50', f'--pattern={pattern}',
+                  f'--output-dir={directory / "outputs"!s}',
+                  f'--match-records={directory / "records.jsonl"!s}',
+                ] + inputs
+              )
+            self.assertEqual([], errors)
+            records = self.read_jsonl(directory / 'records.jsonl')
+            self.assertGreater(len(records), 0)
+            for record in records:
+                self.assertTrue(Path(record['output']).exists())
+                homography = np.float64(record['homography'])
+                self.assertEqual((3, 3), homography.shape)
+                quad = np.float64(record['quad'])
+                self.assertEqual((4, 2), quad.shape)
+                # The first corner of the quadrilateral is the projection
+                # of the corner of the pattern.
+                (x, y, w) = homography @ np.float64([0, 0, 1])
+                self.assertAlmostEqual(x / w, quad[0,0], places=3)
+                self.assertAlmostEqual(y / w, quad[0,1], places=3)
+
+    def test_write_errors(self):
+        imwrite = cv.imwrite
+        def failing_imwrite(path, image, *args):
+            # Fail to write the images of the "right" crop region.
+            return False if Path(path).parent.name == 'right' else imwrite(path, image, *args)
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            output_dir = directory / 'outputs'
+            with mock.patch.object(image_writer_module.cv, 'imwrite', side_effect=failing_imwrite):
+                errors = self.run_batch(output_dir, directory / 'records.jsonl')
+            records = self.read_jsonl(directory / 'records.jsonl')
+            self.assertEqual(len(records), 2 * len(errors))
+            # No record refers to a file that was not written.
+            for record in records:
+                if record['label'] == 'right':
+                    self.assertIsNone(record['output'])
+                else:
+                    self.assertTrue(Path(record['output']).exists())
+            # The records of each input image are written together.
+            sources = [record['source'] for record in records]
+            runs = [source for (i, source) in enumerate(sources) if (i == 0) or (sources[i-1] != source)]
+            self.assertEqual(len(set(sources)), len(runs))
+
+    def test_bad_suffix(self):
+        with self.assertRaises(ValueError):
+            SingleFeatureMultiCrop().set_match_records('records.txt')
+
+    def test_flush_per_image(self):
+        with tempfile.TemporaryDirectory() as directory:
+            record_file = MatchRecordFile(Path(directory) / 'records.jsonl')
+            with mock.patch.object(record_file.file, 'flush', wraps=record_file.file.flush) as flush:
+                record_file.record(1, [{'output': None, 'id': 2}], [], [])
+                self.assertEqual(0, flush.call_count)
+                record_file.record(0, [{'output': None, 'id': i} for i in range(2)], [], [])
+                # Once for each image, not for each record.
+                self.assertEqual(2, flush.call_count)
+            self.assertEqual([0, 1, 2], [record['id'] for record in self.read_jsonl(record_file.get_path())])
+            record_file.close()
@@ -0,0 +1,259 @@
+import unittest
+from copy import deepcopy
+from pathlib import Path
+import tempfile
+from unittest import mock
+
+import cv2 as cv
+import numpy as np
+
+import patmatkit
+from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
+from DataPrepKit.DiskCache import DiskCache
+from DataPrepKit.SingleFeatureMultiCrop import SingleFeatureMultiCrop
+from DataPrepKit.ORBMatcher import \
+    ImageWithORB, KeypointGrid, ORBConfig, SegmentedImage, \
+    pack_keypoints, unpack_keypoints
+from DataPrepKit.utilities import merge_quadrilaterals
+from bench_ORBMatcher import \
+    loop_select_keypoints, loop_segment_keypoint_counts, synthetic_keypoints, synthetic_orb_target, \
+    loop_merge_quadrilaterals, synthetic_quadrilaterals, \
+    orb_search, orb_configs, count_found
+
+class TestORBMatcher(unittest.TestCase):
+    """Checks the parts of the ORB algorithm that avoid recomputing
+    keypoints for every segment of the target image."""
+
+    def test_keypoint_grid_random(self):
+        (keypoints, descriptors) = synthetic_keypoints(2000, 500, 300)
+        for cell_size in [1, 7, 64, 1000]:
+            grid = KeypointGrid(keypoints, descriptors, cell_size)
+            for rect in [(0, 0, 500, 300), (13, 27, 90, 90), (450, 250, 50, 50), (499, 0, 1, 300)]:
+                with self.subTest(cell_size=cell_size, rect=rect):
+                    expected = loop_select_keypoints(grid.points, rect)
+                    (points, selected_descriptors) = grid.select(rect)
+                    self.assertTrue(np.array_equal(grid.points[expected] - np.float32(rect[:2]), points))
+                    self.assertTrue(np.array_equal(descriptors[expected], selected_descriptors))
+
+    def test_keypoint_grid_empty(self):
+        grid = KeypointGrid([], [], 16)
+        (points, descriptors) = grid.select((0, 0, 100, 100))
+        self.assertEqual((0, 2), points.shape)
+        self.assertEqual(0, len(descriptors))
+
+    def test_search_modes(self):
+        pattern_size = 128
+        (target, pattern, centers) = synthetic_orb_target(768, 768, pattern_size, 4)
+        for (label, orb_config) in orb_configs():
+            with self.subTest(mode=label):
+                result = orb_search(target, pattern, orb_config)
+                self.assertEqual(len(centers), count_found(result, centers, pattern_size))
+
+    def test_workers(self):
+        (target, pattern, _centers) = synthetic_orb_target(768, 768, 128, 4)
+        for (label, orb_config) in orb_configs():
+            expected = orb_search(target, pattern, orb_config)
+            for workers in [2, 3]:
+                with self.subTest(mode=label, workers=workers):
+                    result = orb_search(target, pattern, orb_config, workers)
+                    self.assertEqual(
+                        [proj.get_rect() for proj in expected],
+                        [proj.get_rect() for proj in result],
+                      )
+                    for (a, b) in zip(expected, result):
+                        self.assertTrue(np.array_equal(a.homography, b.homography))
+
+    def test_merge_quadrilaterals_random(self):
+        for (count, extent, tolerance) in [(50, 2000, 12.8), (200, 1000, 20.0), (20, 200, 1000.0)]:
+            with self.subTest(count=count, extent=extent, tolerance=tolerance):
+                (quads, scores) = synthetic_quadrilaterals(count, extent, 128)
+                self.assertTrue(
+                    np.array_equal(
+                        loop_merge_quadrilaterals(quads, scores, tolerance),
+                        merge_quadrilaterals(quads, scores, tolerance),
+                      )
+                  )
+
+    def test_merge_duplicates(self):
+        (target, pattern, centers) = synthetic_orb_target(768, 768, 128, 4)
+        orb_config = ORBConfig()
+        orb_config.set_duplicate_tolerance(0.0)
+        duplicates = orb_search(target, pattern, orb_config)
+        orb_config.set_duplicate_tolerance(0.1)
+        merged = orb_search(target, pattern, orb_config)
+        self.assertLess(len(merged), len(duplicates))
+        self.assertEqual(len(centers), count_found(merged, centers, 128))
+        self.assertEqual(
+            max(proj.get_match_score() for proj in duplicates),
+            max(proj.get_match_score() for proj in merged),
+          )
+
+    def test_rematch(self):
+        (target, pattern, _centers) = synthetic_orb_target(768, 768, 128, 4)
+        for (label, orb_config) in orb_configs():
+            with self.subTest(mode=label):
+                reference = ImageWithORB(pattern, orb_config)
+                segmented = SegmentedImage(orb_config, target, reference.get_crop_rect())
+                segmented.find_matching_points(reference)
+                descriptors = reference.get_descriptors()
+                orb_config = deepcopy(orb_config)
+                orb_config.set_descriptor_threshold(0.6)
+                orb_config.set_minimum_descriptor_count(10)
+                reference.set_orb_config(orb_config)
+                segmented.set_orb_config(orb_config)
+                self.assertIs(descriptors, reference.get_descriptors())
+                self.assertFalse(segmented.needs_search(reference))
+                expected = orb_search(target, pattern, orb_config)
+                result = segmented.find_matching_points(reference)
+                self.assertEqual(
+                    [proj.get_rect() for proj in expected],
+                    [proj.get_rect() for proj in result],
+                  )
+                orb_config = deepcopy(orb_config)
+                orb_config.set_fastThreshold(10)
+                reference.set_orb_config(orb_config)
+                segmented.set_orb_config(orb_config)
+                self.assertTrue(segmented.needs_search(reference))
+
+    def test_crop_write_images(self):
+        (target, pattern, _centers) = synthetic_orb_target(768, 768, 128, 4)
+        projection = orb_search(target, pattern, ORBConfig())[0]
+        whole = projection.crop_image()
+        # The same as warping by the inverse homography, as OpenCV does
+        # when WARP_INVERSE_MAP is not given.
+        expected = cv.warpPerspective(target, projection.inverse_homography, (128, 128))
+        self.assertLessEqual(np.abs(np.int16(expected) - np.int16(whole)).max(), 1)
+        crop_rects = {'left': (2, 20, 40, 100), 'right': (60, 20, 40, 100), 'same': (60, 20, 40, 100)}
+        with tempfile.TemporaryDirectory() as output_dir:
+            projection.crop_write_images(crop_rects, Path(output_dir) / '{label}_{image_ID}.png')
+            for (label, (x, y, width, height)) in crop_rects.items():
+                with self.subTest(label=label):
+                    path = Path(output_dir) / f'{label}_{projection.get_string_id()}.png'
+                    written = cv.imread(str(path))
+                    self.assertEqual((height, width, 3), written.shape)
+                    for expected in [projection.crop_image((x, y, width, height)), whole[y:y+height, x:x+width]]:
+                        self.assertLessEqual(np.abs(np.int16(expected) - np.int16(written)).max(), 1)
+
+    def test_knn_search(self):
+        (keypoints, descriptors) = synthetic_keypoints(500, 100, 100)
+        grid = KeypointGrid(keypoints, descriptors, 16)
+        (indices, distances) = grid.knn_search(descriptors[:10], 4)
+        self.assertEqual((10, 4), indices.shape)
+        # Every descriptor is its own nearest neighbor.
+        self.assertTrue(np.array_equal(np.arange(10), indices[:,0]))
+        self.assertTrue(np.all(distances[:,0] == 0))
+        self.assertTrue(np.all(np.diff(distances, axis=1) >= 0))
+
+    def test_config_round_trip(self):
+        orb_config = ORBConfig()
+        orb_config.set_detect_whole_image(True)
+        self.assertEqual(orb_config, ORBConfig.from_dict(orb_config.to_dict()))
+        self.assertNotEqual(ORBConfig(), orb_config)
+        with self.assertRaises(ValueError):
+            orb_config.set_detect_whole_image('yes')
+        orb_config.set_matcher('flann')
+        self.assertEqual(orb_config, ORBConfig.from_dict(orb_config.to_dict()))
+        with self.assertRaises(ValueError):
+            orb_config.set_matcher('bf')
+        orb_config.set_prefilter_segments(True)
+        self.assertEqual(orb_config, ORBConfig.from_dict(orb_config.to_dict()))
+        with self.assertRaises(ValueError):
+            orb_config.set_prefilter_segments(1)
+
+    def test_pack_keypoints(self):
+        (_target, pattern, _centers) = synthetic_orb_target(256, 256, 128, 1)
+        image_orb = ImageWithORB(pattern, ORBConfig())
+        image_orb.compute()
+        keypoints = image_orb.get_keypoints()
+        self.assertGreater(len(keypoints), 0)
+        unpacked = unpack_keypoints(pack_keypoints(keypoints))
+        for (a, b) in zip(keypoints, unpacked):
+            self.assertEqual(
+                (a.pt, a.size, a.angle, a.response, a.octave),
+                (b.pt, b.size, b.angle, b.response, b.octave),
+              )
+        self.assertEqual((), unpack_keypoints(pack_keypoints(())))
+
+    def test_disk_cache(self):
+        (target, pattern, _centers) = synthetic_orb_target(768, 768, 128, 4)
+        for (label, orb_config) in orb_configs():
+            with self.subTest(mode=label), tempfile.TemporaryDirectory() as directory:
+                cache = DiskCache(Path(directory))
+                expected = orb_search(target, pattern, orb_config, cache=cache)
+                entries = len(cache.entries())
+                self.assertGreater(entries, 0)
+                # A second search must take every feature from the cache.
+                with mock.patch.object(ImageWithORB, 'detect', side_effect=AssertionError):
+                    result = orb_search(target, pattern, orb_config, workers=2, cache=cache)
+                self.assertEqual(
+                    [proj.get_rect() for proj in expected],
+                    [proj.get_rect() for proj in result],
+                  )
+                self.assertEqual(entries, len(cache.entries()))
+                orb_config = deepcopy(orb_config)
+                orb_config.set_fastThreshold(10)
+                orb_search(target, pattern, orb_config, cache=cache)
+                self.assertEqual(2 * entries, len(cache.entries()))
+
+    def test_batch_without_content_hash(self):
+        # Without a DiskCache, the pixels of the images are never hashed.
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            inputs = []
+            for count in [1, 2]:
+                (target, pattern, _centers) = synthetic_orb_target(512, 512, 128, count)
+                inputs.append(str(directory / f'target{count}.png'))
+                cv.imwrite(inputs[-1], target)
+            cv.imwrite(str(directory / 'pattern.png'), pattern)
+            cli_config = patmatkit.arper.parse_args(
+                [ '--algorithm=ORB', '--threshold=50', f'--pattern={directory / "pattern.png"!s}',
+                  f'--output-dir={directory / "outputs"!s}',
+                ] + inputs
+              )
+            app_model = SingleFeatureMultiCrop(cli_config)
+            with mock.patch.object(CachedCVImageLoader, 'get_content_hash', side_effect=AssertionError):
+                self.assertEqual([], app_model.batch_crop_matched_patterns())
+            self.assertGreater(len(list((directory / 'outputs').glob('*.png'))), 0)
+
+    def test_segment_keypoint_counts(self):
+        (target, _pattern, _centers) = synthetic_orb_target(1000, 700, 64, 1)
+        segmented = SegmentedImage(ORBConfig(), target, (0, 0, 64, 64))
+        rects = list(segmented.segment_rects())
+        for count in [0, 1, 1000]:
+            with self.subTest(count=count):
+                (keypoints, _descriptors) = synthetic_keypoints(count, 1000, 700)
+                points = np.float32([keypoint.pt for keypoint in keypoints]).reshape(-1, 2)
+                self.assertEqual(
+                    list(loop_segment_keypoint_counts(rects, points)),
+                    list(segmented.segment_keypoint_counts(rects, points)),
+                  )
+
+    def test_prefilter_segments(self):
+        (target, pattern, _centers) = synthetic_orb_target(1024, 1024, 128, 4, textured=False)
+        for (label, orb_config) in orb_configs():
+            with self.subTest(mode=label):
+                expected = orb_search(target, pattern, orb_config)
+                orb_config = deepcopy(orb_config)
+                orb_config.set_prefilter_segments(True)
+                reference = ImageWithORB(pattern, orb_config)
+                segmented = SegmentedImage(orb_config, target, reference.get_crop_rect())
+                steps = segmented.guess_compute_steps()
+                self.assertLess(steps, len(list(segmented.segment_rects())))
+                result = segmented.find_matching_points(reference)
+                self.assertEqual(
+                    [proj.get_rect() for proj in expected],
+                    [proj.get_rect() for proj in result],
+                  )
+                self.assertEqual(steps, len(segmented.segment_neighbors))
+                # Raising the minimum only skips more segments, lowering
+                # it or disabling the prefilter must search again.
+                changes = [
+                    ('set_minimum_descriptor_count', 30, False),
+                    ('set_minimum_descriptor_count', 10, True),
+                    ('set_prefilter_segments', False, True),
+                  ]
+                for (setter, value, needs_search) in changes:
+                    changed = deepcopy(orb_config)
+                    getattr(changed, setter)(value)
+                    segmented.set_orb_config(changed)
+                    self.assertEqual(needs_search, segmented.needs_search(reference))
@@ -0,0 +1,79 @@
+import unittest
+from pathlib import Path
+import shutil
+from datetime import datetime
+
+import patmatkit
+from DataPrepKit.SingleFeatureMultiCrop import SingleFeatureMultiCrop
+from test_CLIBatchModeRME import CLIBatchModeRME
+
+class TestPatternLibrary(unittest.TestCase):
+    """Runs the RME algorithm in batch mode with a library of two
+    patterns configured from JSON. The output for each pattern must be
+    the same as the output of running the CLI once for each pattern
+    with the same parameters, so the results are compared to the same
+    test fixtures used by 'test_CLIBatchModeRME'. """
+
+    def __init__(self, context):
+        super().__init__(context)
+        t = datetime.today()
+        self.output_dir = Path(
+            f'./test-results'
+            f'_{t.year:04}{t.month:02}{t.day:02}'
+            f'_{t.hour:02}{t.minute:02}{t.second:02}'
+            f'_{t.microsecond:06}',
+          )
+
+    def patterns_config(self, threshold):
+        # The pattern labels are the names of the fixture directories
+        # so that each pattern's output can be compared to them.
+        return \
+          [ { 'label': 'results-full',
+              'reference_image': CLIBatchModeRME.pattern_image,
+              'threshold': threshold / 100.0,
+            },
+            { 'label': 'results-crop-regions',
+              'reference_image': CLIBatchModeRME.pattern_image,
+              'crop_regions': {'left': [2,2,8,14], 'right': [8,2,8,14]},
+              'threshold': threshold / 100.0,
+            },
+          ]
+
+    def test_batch_mode_pattern_library(self):
+        for threshold in [99, 90]:
+            case = CLIBatchModeRME(self.output_dir, threshold)
+            output_dir = self.output_dir / Path(f'threshold-{threshold:03}')
+            cli_config = patmatkit.arper.parse_args(
+                [ '--algorithm=RME',
+                  f'--output-dir={output_dir!s}',
+                ] + CLIBatchModeRME.input_images
+              )
+            app_model = SingleFeatureMultiCrop(cli_config)
+            app_model.configure_from_json({'patterns': self.patterns_config(threshold)})
+            app_model.batch_crop_matched_patterns()
+            for label in ['results-full', 'results-crop-regions']:
+                with self.subTest(threshold=threshold, pattern=label):
+                    self.assertTrue(
+                        case.compare_dir_contents(
+                            output_dir / Path(label),
+                            CLIBatchModeRME.fixtures_dir / output_dir.name / Path(label),
+                          )
+                      )
+        shutil.rmtree(self.output_dir)
+
+    def test_configure_json_round_trip(self):
+        cli_config = patmatkit.arper.parse_args(['--algorithm=RME'])
+        app_model = SingleFeatureMultiCrop(cli_config)
+        config = self.patterns_config(90)
+        app_model.configure_from_json({'patterns': config})
+        for item in config:
+            item['reference_image'] = str(Path(item['reference_image']))
+        self.assertEqual(config, app_model.get_pattern_library().configure_to_json())
+
+    def test_duplicate_label(self):
+        cli_config = patmatkit.arper.parse_args(['--algorithm=RME'])
+        app_model = SingleFeatureMultiCrop(cli_config)
+        config = self.patterns_config(90)
+        config[1]['label'] = config[0]['label']
+        with self.assertRaises(ValueError):
+            app_model.configure_from_json({'patterns': config})
@@ -0,0 +1,221 @@
+import os
+import unittest
+from unittest import mock
+from pathlib import Path
+import tempfile
+
+import numpy as np
+
+from DataPrepKit.CachedCVImageLoader import CachedCVImageLoader
+from DataPrepKit.DiskCache import DiskCache
+from DataPrepKit.RMEMatcher import DistanceMap, RMECandidate, RMEMatcher, tile_minima
+from DataPrepKit.utilities import non_maximum_suppression
+from bench_RMEMatcher import \
+    loop_tile_minima, synthetic_distance_map, \
+    loop_non_maximum_suppression, synthetic_rects
+
+fixtures_dir = Path('./tests/fixtures')
+
+def load_fixture(name):
+    loader = CachedCVImageLoader()
+    loader.load_image(path=fixtures_dir / Path(name))
+    return loader
+
+class TestRMEMatcher(unittest.TestCase):
+    """Checks the array-based parts of the RME algorithm against simple
+    loop-based implementations of the same computation."""
+
+    def assert_same_minima(self, expected, result):
+        for (a, b) in zip(expected, result):
+            self.assertTrue(np.array_equal(a, b))
+
+    def test_tile_minima_random(self):
+        for (width, height, window_w, window_h) in \
+          [(64, 64, 8, 8), (100, 37, 5, 3), (31, 50, 31, 1)]:
+            with self.subTest(size=(width, height), window=(window_w, window_h)):
+                distance_map = synthetic_distance_map(width, height, window_w, window_h)
+                self.assert_same_minima(
+                    loop_tile_minima(distance_map, window_w, window_h),
+                    tile_minima(distance_map, window_w, window_h),
+                  )
+
+    def test_tile_minima_ties(self):
+        # A map full of equal values must choose the first element of
+        # each tile, the same as np.argmin().
+        distance_map = np.ones((12, 12), dtype=np.float32)
+        distance_map[5, 5] = 0.0
+        self.assert_same_minima(
+            loop_tile_minima(distance_map, 4, 4),
+            tile_minima(distance_map, 4, 4),
+          )
+
+    def test_find_matching_points_fixtures(self):
+        pattern = load_fixture('pattern.png')
+        for name in ['target1.png', 'target2.png', 'target3.png']:
+            target = load_fixture(name)
+            distance_map = DistanceMap(target, pattern)
+            (xs, ys, scores) = loop_tile_minima(
+                distance_map.distance_map,
+                distance_map.window_width,
+                distance_map.window_height,
+              )
+            for threshold in [0.99, 0.9, 0.5]:
+                with self.subTest(target=name, threshold=threshold):
+                    selected = scores >= threshold
+                    expected = list(zip(xs[selected], ys[selected], scores[selected]))
+                    result = \
+                      [ (c.get_rect()[0], c.get_rect()[1], c.get_match_score()) \
+                        for c in distance_map.find_matching_points(threshold) \
+                      ]
+                    self.assertEqual(expected, result)
+
+    def test_index_threshold_sweep(self):
+        # Threshold values exactly equal to a candidate score must
+        # select that candidate, the same as "similarity >= threshold".
+        pattern = load_fixture('pattern.png')
+        target = load_fixture('target3.png')
+        distance_map = DistanceMap(target, pattern)
+        (xs, ys, scores) = tile_minima(
+            distance_map.distance_map,
+            distance_map.window_width,
+            distance_map.window_height,
+          )
+        thresholds = sorted(set(float(s) for s in scores if s >= 0.5))[::7] + [0.5, 1.0]
+        for threshold in thresholds:
+            with self.subTest(threshold=threshold):
+                selected = scores >= threshold
+                result = distance_map.find_matching_points(threshold)
+                self.assertEqual(
+                    list(zip(xs[selected].tolist(), ys[selected].tolist())),
+                    [(c.get_rect()[0], c.get_rect()[1]) for c in result],
+                  )
+
+    def test_pyramid_recall_fixtures(self):
+        # Matches found coarse-to-fine must be found exhaustively too, and
+        # on the test fixtures no exhaustive match should be missed.
+        pattern = load_fixture('pattern.png')
+        for name in ['target1.png', 'target2.png', 'target3.png']:
+            target = load_fixture(name)
+            exhaustive = DistanceMap(target, pattern)
+            pyramid = DistanceMap(target, pattern, pyramid_levels=1)
+            for threshold in [0.99, 0.9]:
+                with self.subTest(target=name, threshold=threshold):
+                    self.assertEqual(
+                        [c.get_rect() for c in exhaustive.find_matching_points(threshold)],
+                        [c.get_rect() for c in pyramid.find_matching_points(threshold)],
+                      )
+
+    def test_strip_search_fixtures(self):
+        # Computing the distance map in strips must find the same
+        # candidates as computing it all at once, whatever the budget.
+        pattern = load_fixture('pattern.png')
+        for name in ['target1.png', 'target2.png', 'target3.png']:
+            target = load_fixture(name)
+            whole = DistanceMap(target, pattern)
+            for budget in [1, 4096, 1 << 30]:
+                strips = DistanceMap(target, pattern, memory_budget=budget, keep_distance_map=True)
+                with self.subTest(target=name, budget=budget):
+                    self.assertTrue(np.allclose(whole.distance_map, strips.distance_map, atol=1e-5))
+                    for threshold in [0.99, 0.9, 0.5]:
+                        self.assertEqual(
+                            [c.get_rect() for c in whole.find_matching_points(threshold)],
+                            [c.get_rect() for c in strips.find_matching_points(threshold)],
+                          )
+
+    def test_strip_search_discards_distance_map(self):
+        pattern = load_fixture('pattern.png')
+        target = load_fixture('target3.png')
+        strips = DistanceMap(target, pattern, memory_budget=4096)
+        self.assertIsNone(strips.distance_map)
+        self.assertTrue(len(strips.find_matching_points(0.9)) > 0)
+        with self.assertRaises(ValueError):
+            strips.save_distance_map('unused.png')
+
+    def test_strip_search_workers(self):
+        # Strips computed in a thread pool must be merged in the same
+        # order as strips computed one after the other.
+        pattern = load_fixture('pattern.png')
+        for name in ['target1.png', 'target2.png', 'target3.png']:
+            target = load_fixture(name)
+            whole = DistanceMap(target, pattern)
+            for (workers, budget) in [(3, None), (4, 4096)]:
+                strips = DistanceMap(target, pattern, memory_budget=budget, workers=workers)
+                with self.subTest(target=name, workers=workers, budget=budget):
+                    for threshold in [0.99, 0.9, 0.5]:
+                        self.assertEqual(
+                            [c.get_rect() for c in whole.find_matching_points(threshold)],
+                            [c.get_rect() for c in strips.find_matching_points(threshold)],
+                          )
+
+    def test_non_maximum_suppression_random(self):
+        for (count, extent, size, max_overlap) in \
+          [(0, 10, 4, 0.0), (1, 10, 4, 0.0), (300, 200, 16, 0.0), (300, 200, 16, 0.3), (500, 2000, 64, 0.0)]:
+            with self.subTest(count=count, extent=extent, size=size, max_overlap=max_overlap):
+                (rects, scores) = synthetic_rects(count, extent, size)
+                # Rounding the scores makes many equal scores, which must
+                # be ordered the same way as the loop does.
+                scores = np.round(scores, 1)
+                self.assertTrue(np.array_equal(
+                    loop_non_maximum_suppression(rects, scores, max_overlap),
+                    non_maximum_suppression(rects, scores, max_overlap),
+                  ))
+
+    def test_suppress_overlaps(self):
+        # Every match in the fixture is duplicated by a slightly less
+        # similar candidate shifted by a few pixels, only the original
+        # matches must be kept, in their original order.
+        pattern = load_fixture('pattern.png')
+        target = load_fixture('target1.png')
+        candidates = DistanceMap(target, pattern).find_matching_points(0.5)
+        shifted = \
+          [ RMECandidate((x + 3, y + 2, w, h), c.get_match_score() - 0.01, target) \
+            for c in candidates \
+            for (x, y, w, h) in [c.get_rect()] \
+          ]
+        merged = [c for pair in zip(shifted, candidates) for c in pair]
+        result = RMEMatcher(None).suppress_overlaps(merged)
+        self.assertEqual([c.get_rect() for c in candidates], [c.get_rect() for c in result])
+
+    def test_disk_cache(self):
+        pattern = load_fixture('pattern.png')
+        target = load_fixture('target1.png')
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory)
+            computed = DistanceMap(target, pattern, cache=cache)
+            cached = DistanceMap(target, pattern, cache=cache, memory_budget=4096)
+            self.assertIsNotNone(computed.distance_map)
+            self.assertIsNone(cached.distance_map)
+            for threshold in [0.99, 0.9, 0.5]:
+                with self.subTest(threshold=threshold):
+                    self.assertEqual(
+                        [(c.get_rect(), c.get_match_score()) for c in computed.find_matching_points(threshold)],
+                        [(c.get_rect(), c.get_match_score()) for c in cached.find_matching_points(threshold)],
+                      )
+            # A different crop of the target must not use the same result.
+            cropped = load_fixture('target1.png')
+            cropped.set_crop_rect((0, 0, 64, 64))
+            self.assertIsNotNone(DistanceMap(cropped, pattern, cache=cache).distance_map)
+
+    def test_disk_cache_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory, max_bytes=4096)
+            for (time, key) in enumerate(['a', 'b', 'c']):
+                cache.put(key, {'data': np.zeros(256, dtype=np.float32)})
+                os.utime(cache.entry_path(key), (time, time))
+            self.assertIsNotNone(cache.get('a', ['data']))
+            # Each of the first entries is just over 1K, the next ones are
+            # just under 512 bytes. The directory is only scanned when the
+            # cache grows larger than its maximum size, and then the least
+            # recently used entries are evicted until it is no larger than
+            # 3K.
+            with mock.patch.object(cache, 'entries', wraps=cache.entries) as entries:
+                cache.put('d', {'data': np.zeros(64, dtype=np.float32)})
+                self.assertEqual(0, entries.call_count)
+                cache.put('e', {'data': np.zeros(64, dtype=np.float32)})
+                self.assertEqual(1, entries.call_count)
+            self.assertIsNone(cache.get('b', ['data']))
+            for key in ['a', 'c', 'd', 'e']:
+                self.assertIsNotNone(cache.get(key, ['data']))
+            self.assertEqual(sum(size for (_, size, _) in cache.entries()), cache.get_total_bytes())
+            # A cache opened on the same directory counts what is in it.
+            self.assertEqual(cache.get_total_bytes(), DiskCache(directory, max_bytes=4096).get_total_bytes())
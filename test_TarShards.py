@@ -0,0 +1,104 @@
+import unittest
+from pathlib import Path
+import json
+import tarfile
+import tempfile
+
+import cv2 as cv
+import numpy as np
+
+from DataPrepKit.ImageWriter import ImageWriter
+from DataPrepKit.TarShards import TarShardWriter, read_shard_file
+from test_CLIBatchModeRME import CLIBatchModeRME
+
+class TestTarShards(unittest.TestCase):
+    """Checks that a batch run with "--tar-shards" writes the same images
+    into tar archives as it would otherwise write as separate files, and
+    that the index of each archive locates every image in it."""
+
+    def read_shards(self, output_dir):
+        """Return a dictionary mapping the name of every file in the shards
+        of 'output_dir' to its 2-tuple (index entry, content), checking
+        that the index agrees with the tar archive."""
+        result = {}
+        for shard_path in sorted(output_dir.glob('shard-*.tar')):
+            entries = \
+              [ json.loads(line) \
+                for line in shard_path.with_suffix('.jsonl').read_text().splitlines() \
+              ]
+            with tarfile.open(shard_path) as tar:
+                self.assertEqual([entry['name'] for entry in entries], tar.getnames())
+                for entry in entries:
+                    data = read_shard_file(shard_path, entry)
+                    self.assertEqual(tar.extractfile(entry['name']).read(), data)
+                    self.assertNotIn(entry['name'], result)
+                    result[entry['name']] = (entry, data)
+        return result
+
+    def test_batch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            files_dir = directory / 'files'
+            self.assertEqual([], CLIBatchModeRME.run_batch(CLIBatchModeRME.rme_args(files_dir)))
+            expected = \
+              { path.relative_to(files_dir).as_posix(): path \
+                for path in files_dir.glob('**/*.png') \
+              }
+            self.assertGreater(len(expected), 0)
+            for jobs in [1, 2]:
+                with self.subTest(jobs=jobs):
+                    shards_dir = directory / f'shards-{jobs}'
+                    self.assertEqual([], CLIBatchModeRME.run_batch(
+                        CLIBatchModeRME.rme_args(shards_dir, ['--tar-shards=64K', f'--jobs={jobs}']),
+                      ))
+                    # Only the shards and their indices are written.
+                    self.assertEqual(
+                        [], [path for path in shards_dir.iterdir() if path.suffix not in ['.tar', '.jsonl']],
+                      )
+                    self.assertGreater(len(list(shards_dir.glob('shard-*.tar'))), 1)
+                    files = self.read_shards(shards_dir)
+                    self.assertEqual(sorted(expected), sorted(files))
+                    for (name, (entry, data)) in files.items():
+                        image = cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_UNCHANGED)
+                        self.assertTrue((cv.imread(str(expected[name]), cv.IMREAD_UNCHANGED) == image).all())
+                        self.assertIn(entry['label'], ['left', 'right'])
+                        self.assertGreaterEqual(entry['score'], 0.9)
+                        self.assertEqual(name.split('/')[0], entry['label'])
+                        self.assertTrue(Path(entry['source']).exists())
+
+    def test_roll_over(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            shards = TarShardWriter(directory, max_bytes=4096)
+            for i in range(6):
+                shards.add(directory / 'a' / f'{i}.bin', bytes([i]) * 1000, {'i': i})
+            # A file larger than a shard is written into a shard of its own.
+            shards.add(directory / 'big.bin', b'x' * 10000)
+            shards.close()
+            self.assertEqual([directory / f'shard-{i:06}.tar' for i in range(4)], shards.get_shard_paths())
+            for path in shards.get_shard_paths()[:3]:
+                self.assertLessEqual(path.stat().st_size, 4096)
+            files = self.read_shards(directory)
+            self.assertEqual(['a/0.bin', 'a/1.bin', 'a/2.bin', 'a/3.bin', 'a/4.bin', 'a/5.bin', 'big.bin'], sorted(files))
+            self.assertEqual((3, bytes([3]) * 1000), (files['a/3.bin'][0]['i'], files['a/3.bin'][1]))
+            # Numbering continues after the shards already written.
+            shards = TarShardWriter(directory, max_bytes=4096)
+            shards.add('other.bin', b'y')
+            shards.close()
+            self.assertEqual([directory / 'shard-000004.tar'], shards.get_shard_paths())
+
+    def test_writer_sink(self):
+        rng = np.random.default_rng(0)
+        image = rng.integers(0, 256, (100, 100, 3), dtype=np.uint8)
+        received = []
+        writer = ImageWriter(workers=3, sink=lambda path, data, info: received.append((path, data, info)))
+        for i in range(20):
+            writer.write(f'{i}.png', image[i:i+50, i:i+50], source='image', info={'i': i})
+        self.assertEqual([], writer.flush())
+        writer.close()
+        # The images are passed to the sink in the order they were written.
+        self.assertEqual([f'{i}.png' for i in range(20)], [path for (path, _data, _info) in received])
+        for (i, (_path, data, info)) in enumerate(received):
+            self.assertEqual({'i': i}, info)
+            decoded = cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_COLOR)
+            self.assertTrue((image[i:i+50, i:i+50] == decoded).all())